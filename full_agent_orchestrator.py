@@ -1,11 +1,24 @@
 import os
 import glob
+import io
 import sys
 import argparse
 import json
-from langchain_google_vertexai import VertexAI
-import google.auth
-import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+# poc/ 配下の共有モジュール（JSON抽出など）を利用する
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "poc"))
+from design_cache import DesignCache, hash_text
+from json_repair import extract_json_tolerant, json_repair_stats, record_parse
+from json_stream import IncrementalJSONExtractor, JSONExtractionError
+from llm_cassette import cassette_stats, with_cassette
+from llm_client import model_tiers
+from llm_resilience import ResilientLLM, resilience_stats
+from model_router import RoutedLLM, routing_stats
+from prompt_budget import PromptSection, compact_json, prompt_budget
 
 # コーディングエージェント用のプロンプトテンプレート
 CODING_AGENT_PROMPT = """
@@ -18,9 +31,12 @@ CODING_AGENT_PROMPT = """
 ## 担当業務の設計書
 {design_document}
 
+## 先行する担当が生成したコード
+{upstream_code}
+
 ## 指示
 - 上記の情報を基に、担当業務を遂行するために必要なソースコードを1つ生成してください。
-- 以前のタスクで生成されたコードは考慮せず、この設計書で指示された単一のタスクに集中してください。
+- 先行する担当が生成したコードがある場合は、そのファイル構成やインターフェースに合わせてください。ただし、生成するのはこの設計書で指示された単一のタスクのコードだけです。
 - 生成するコードは、プロジェクトの技術スタックに完全に準拠している必要があります。
 - **ファイル名は、必ず `{target_path_prefix}` から始まるパスにしてください。**
 - 返答は、必ず以下のJSON形式で、ファイル名とソースコードのみを出力してください。その他の説明は一切含めないでください。
@@ -33,22 +49,217 @@ CODING_AGENT_PROMPT = """
 ```
 """
 
+# マニフェスト形式（1つの設計書から複数のファイルを生成する）のプロンプトテンプレート
+CODING_AGENT_MANIFEST_PROMPT = """
+あなたは、指定された技術スタックに精通した、世界クラスのソフトウェアエンジニアです。
+以下のプロジェクト概要と担当業務の設計書に基づいて、担当業務を遂行するために必要なファイル一式のファイル名とソースコードを生成してください。
+
+## プロジェクト概要
+{project_overview}
+
+## 担当業務の設計書
+{design_document}
+
+## 先行する担当が生成したコード
+{upstream_code}
+
+## 指示
+- 上記の情報を基に、担当業務を遂行するために必要なファイルをすべて生成してください（最大 {max_files} ファイル）。
+- 最初に "manifest" に生成するファイル名の一覧を書き、続けて "files" に同じ順番で各ファイルのファイル名とソースコードを書いてください。
+- 先行する担当が生成したコードがある場合は、そのファイル構成やインターフェースに合わせてください。
+- 生成するコードは、プロジェクトの技術スタックに完全に準拠している必要があります。
+- **ファイル名は、必ず `{target_path_prefix}` から始まるパスにしてください。**
+- 返答は、必ず以下のJSON形式で出力してください。その他の説明は一切含めないでください。
+
+```json
+{{
+  "manifest": ["{target_path_prefix}/src/components/example.tsx", "{target_path_prefix}/src/components/example.test.tsx"],
+  "files": [
+    {{"file_name": "{target_path_prefix}/src/components/example.tsx", "source_code": "ここにソースコードを記述"}},
+    {{"file_name": "{target_path_prefix}/src/components/example.test.tsx", "source_code": "ここにソースコードを記述"}}
+  ]
+}}
+```
+"""
+
+# マニフェスト形式で生成できなかったファイルを1つずつ再生成するためのプロンプトテンプレート
+CODING_AGENT_FILE_PROMPT = """
+あなたは、指定された技術スタックに精通した、世界クラスのソフトウェアエンジニアです。
+以下のプロジェクト概要と担当業務の設計書に基づいて、担当業務のファイル一式のうち、指定された1つのファイルのソースコードを生成してください。
+
+## プロジェクト概要
+{project_overview}
+
+## 担当業務の設計書
+{design_document}
+
+## 先行する担当が生成したコード
+{upstream_code}
+
+## 担当業務のファイル一式
+{manifest}
+
+## 指示
+- 「{file_name}」のソースコードだけを生成してください。ファイル一式の他のファイルは、すでに存在するものとしてください。
+- 生成するコードは、プロジェクトの技術スタックに完全に準拠している必要があります。
+- 返答は、必ず以下のJSON形式で、ファイル名とソースコードのみを出力してください。その他の説明は一切含めないでください。
+
+```json
+{{
+  "file_name": "{file_name}",
+  "source_code": "ここにソースコードを記述"
+}}
+```
+"""
+
+# 担当ごとの依存関係（先に生成し、コンテキストとして渡す担当）。設計書のない担当への依存は無視する
+ROLE_DEPENDENCIES = {
+    "architect": (),
+    "ui_ux_engineer": ("architect",),
+    "ux_ui_designer": ("architect",),
+    "api_data_engineer": ("architect",),
+    "ai_core_engineer": ("architect",),
+    "infra_cicd": ("architect", "ui_ux_engineer", "ux_ui_designer", "api_data_engineer", "ai_core_engineer"),
+    "quality_assurance": ("architect", "ui_ux_engineer", "ux_ui_designer", "api_data_engineer", "ai_core_engineer"),
+}
+# 上の表にない担当は、アーキテクトの成果物だけを待つ
+DEFAULT_ROLE_DEPENDENCIES = ("architect",)
+
+
+def agent_type_key(file_path):
+    """設計書のファイル名から担当を取り出す（"01_architect.md" -> "architect"）"""
+    return os.path.basename(file_path).replace('.md', '').split('_', 1)[-1]
+
+
+def plan_schedule(design_files):
+    """
+    設計書の依存関係のグラフを作り、(実行順のリスト, 設計書 -> 依存する設計書のリスト) を返す。
+    実行順は依存先が必ず先に来る順序で、依存関係で決まらない部分はファイル名順にする
+    """
+    files_by_role = {}
+    for design_file in design_files:
+        files_by_role.setdefault(agent_type_key(design_file), []).append(design_file)
+    dependencies = {}
+    for design_file in design_files:
+        roles = ROLE_DEPENDENCIES.get(agent_type_key(design_file), DEFAULT_ROLE_DEPENDENCIES)
+        dependencies[design_file] = [dep for role in roles for dep in files_by_role.get(role, ()) if dep != design_file]
+
+    order = []
+    remaining = sorted(design_files)
+    while remaining:
+        placed = set(order)
+        ready = next((f for f in remaining if all(dep in placed for dep in dependencies[f])), None)
+        if ready is None:
+            raise ValueError(f"設計書の依存関係が循環しています: {', '.join(os.path.basename(f) for f in remaining)}")
+        order.append(ready)
+        remaining.remove(ready)
+    return order, dependencies
+
+
+def critical_path(results):
+    """
+    実行順に並んだ結果から、依存関係に沿って所要時間の合計が最大になる経路を求め、(経路, 合計秒数) を返す。
+    並列数をいくら増やしても、全体の所要時間はこの合計より短くならない
+    """
+    finish = {}
+    previous = {}
+    for result in results:
+        name = result["design_file"]
+        before = max(result["depends_on"], key=lambda dep: finish.get(dep, 0.0), default=None)
+        finish[name] = result["seconds"] + (finish.get(before, 0.0) if before else 0.0)
+        previous[name] = before
+    if not finish:
+        return [], 0.0
+    last = max(finish, key=finish.get)
+    path = []
+    node = last
+    while node is not None:
+        path.append(node)
+        node = previous.get(node)
+    return list(reversed(path)), finish[last]
+
+
 def get_llm():
-    """VertexAIのLLMインスタンスを取得する"""
+    """
+    VertexAIのLLMインスタンスを取得する。
+    高速なモデルから試し、応答がファイル名とソースコードのJSONにならない場合だけ高性能なモデルに切り替える。
+    LLM_CASSETTE_MODE=replay の場合はVertexAIを使わず、記録済みの応答を返す
+    """
+    project_id = "denkojobcenter"
+
+    def build_vertex_ai(name):
+        # 読み込みに数秒かかるため、--help などLLMを使わない場合は読み込まない
+        from langchain_google_vertexai import VertexAI
+        return VertexAI(model_name=name, temperature=0.1, project=project_id)
+
     try:
-        project_id = "denkojobcenter"
         print(f"✅ GCPプロジェクト '{project_id}' を使用します。")
-        return VertexAI(model_name="gemini-2.5-pro", temperature=0.1, project=project_id)
+        tiers = [(name, with_cassette(name, lambda name=name: build_vertex_ai(name))) for name in model_tiers()]
+        print(f"🧭 モデルルーティング: {' -> '.join(name for name, _ in tiers)}")
+        return RoutedLLM("coding_agent", tiers)
     except Exception as e:
         print(f"❌ VertexAIの初期化中にエラーが発生しました: {e}")
         return None
 
+class ThreadLocalOutput(io.TextIOBase):
+    """
+    スレッドごとに出力先を切り替える標準出力。
+    並列実行中の各設計書のログ（リトライなど共有モジュールの出力を含む）をスレッドごとに溜め、後で順番に表示するために使う
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._local = threading.local()
+
+    def write(self, text):
+        buffer = getattr(self._local, "buffer", None)
+        return (buffer if buffer is not None else self._stream).write(text)
+
+    def flush(self):
+        self._stream.flush()
+
+    @contextmanager
+    def capture(self):
+        """with ブロック内でこのスレッドが出力した内容を StringIO に溜める"""
+        buffer = self._local.buffer = io.StringIO()
+        try:
+            yield buffer
+        finally:
+            self._local.buffer = None
+
+
+def build_codegen_cache(enabled=True):
+    """
+    設計書ごとのコード生成結果の永続キャッシュ（設計書・概要・プロンプト・モデルが変わらなければLLMを呼ばずに再利用する）。
+    再実行のたびに同じ結果を使い回すためのものなので、設計書生成のキャッシュより有効期限を長くする
+    """
+    cache = DesignCache(
+        cache_dir=os.getenv('CODEGEN_CACHE_DIR', '.codegen_cache'),
+        ttl_seconds=int(os.getenv('CODEGEN_CACHE_TTL_SECONDS', 30 * 24 * 60 * 60)),
+        max_disk_bytes=int(os.getenv('CODEGEN_CACHE_MAX_BYTES', 200 * 1024 * 1024)),
+    )
+    cache.enabled = enabled and os.getenv('CODEGEN_CACHE_ENABLED', 'true').lower() == 'true'
+    return cache
+
+
 class FullAgentOrchestrator:
-    def __init__(self, project_dir):
+    def __init__(self, project_dir, workers=1, use_cache=True, multi_file=False):
         if not os.path.isdir(project_dir):
             raise ValueError(f"指定されたディレクトリが見つかりません: {project_dir}")
         self.project_dir = project_dir
-        self.llm = get_llm()
+        # 同時に処理する設計書の数（1なら1件ずつ順番に処理する）
+        self.workers = max(1, workers)
+        # 1つの設計書から複数のファイルを生成するか（マニフェスト形式）
+        self.multi_file = multi_file
+        llm = get_llm()
+        # 一時的な失敗（クォータ超過・タイムアウトなど）で設計書1件分の処理が失われないよう、リトライ付きで呼び出す
+        self.llm = ResilientLLM(llm, "coding_agent") if llm else None
+        # キャッシュキーに含めるモデルの識別子（ルーティングするモデルの組み合わせと temperature）
+        self.model_identity = f"{'>'.join(getattr(llm, 'model_names', [type(llm).__name__]))}@0.1"
+        self.codegen_cache = build_codegen_cache(use_cache)
+        # 保存先のパス -> そのパスに保存した設計書の集合（マニフェスト形式では並列に保存されるため、衝突を _commit_result で解決する）
+        self._claims = {}
+        self._claims_lock = threading.Lock()
         self.project_overview = self._load_project_overview()
         # 担当エージェントと保存先ディレクトリのマッピング
         self.agent_path_map = {
@@ -68,93 +279,479 @@ class FullAgentOrchestrator:
         
         with open(overview_file, 'r', encoding='utf-8') as f:
             data = json.load(f)
-            return json.dumps(data.get("project_overview", {}), ensure_ascii=False, indent=2)
+            # すべてのプロンプトに埋め込まれるため、インデントなしで直列化する
+            return compact_json(data.get("project_overview", {}))
 
     def execute(self):
-        """統括エージェントのメイン実行フロー"""
+        """
+        統括エージェントのメイン実行フロー。設計書ごとの結果（成否・所要時間など）のリストを返す。
+        設計書は担当の依存関係の順に処理し、依存先の担当が生成したコードをコンテキストとして渡す。
+        並列実行の場合も、ログの表示と結果の確定（_commit_result）は実行順（plan_schedule）に行う。
+        マニフェスト形式ではファイルを生成した時点で保存するが、複数の設計書が同じパスに保存した場合は
+        確定の際に実行順で保存し直すため、最終的なファイルの内容は逐次実行と同じになる
+        """
         project_name = os.path.basename(self.project_dir)
         print(f"📂 プロジェクト '{project_name}' の処理を開始します。")
         print("-" * 50)
 
         if not self.llm:
             print("LLMが初期化されていないため、処理を中断します。")
-            return
+            return []
 
         design_files = sorted(glob.glob(os.path.join(self.project_dir, "*.md")))
         if not design_files:
             print(f"📂 設計書ファイル（.md）が {self.project_dir} 内に見つかりませんでした。")
-            return
+            return []
             
         print("📋 以下の設計書に基づいて、孫エージェントによるコーディングを開始します。")
-        for design_file in design_files:
-            self.process_design_file(design_file)
+        self._claims.clear()
+        order, dependencies = plan_schedule(design_files)
+        started = time.perf_counter()
+        if self.workers == 1:
+            results = self._execute_serial(order, dependencies, started)
+        else:
+            results = self._execute_parallel(order, dependencies, started)
             
         print("-" * 50)
         print("✅ すべての設計書の処理が完了しました。")
+        self._print_summary(results, time.perf_counter() - started)
+        return results
+
+    def _execute_serial(self, order, dependencies, run_started):
+        """設計書を実行順に1件ずつ処理する"""
+        outputs = {}
+        results = []
+        for design_file in order:
+            result = self._run_design_file(design_file, dependencies, outputs, run_started)
+            self._record_output(design_file, result, outputs)
+            results.append(self._commit_result(result))
+        return results
+
+    def _execute_parallel(self, order, dependencies, run_started):
+        """
+        依存先の処理が終わった設計書から順に、最大 self.workers 件ずつ並列に処理する。
+        ログの表示と結果の確定は実行順に行う（先の設計書が終わるまで後の設計書のログは表示しない）。
+        マニフェスト形式のファイルは生成した時点で保存されるため、同じパスの衝突は _commit_result で解決する
+        """
+        print(f"⚡ {len(order)} 件の設計書を依存関係に沿って最大 {self.workers} 件ずつ並列に処理します。")
+        original_stdout = sys.stdout
+        output = sys.stdout = ThreadLocalOutput(original_stdout)
+        outputs = {}
+
+        def run(design_file, upstream):
+            with output.capture() as log:
+                result = self._run_design_file(design_file, dependencies, upstream, run_started)
+            return result, log.getvalue()
+
+        results = []
+        finished = {}
+        pending = list(order)
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="coding-agent") as executor:
+                running = {}
+                while pending or running:
+                    for design_file in [f for f in pending if all(dep in finished for dep in dependencies[f])]:
+                        pending.remove(design_file)
+                        # 依存先の成果物は、投入時点で確定したものを渡す
+                        running[executor.submit(run, design_file, dict(outputs))] = design_file
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        design_file = running.pop(future)
+                        result, log = finished[design_file] = future.result()
+                        self._record_output(design_file, result, outputs)
+                    while len(results) < len(order) and order[len(results)] in finished:
+                        result, log = finished[order[len(results)]]
+                        original_stdout.write(log)
+                        results.append(self._commit_result(result))
+        finally:
+            sys.stdout = original_stdout
+        return results
 
-    def process_design_file(self, file_path):
-        """個別の設計書ファイルを処理し、AIにコーディングを指示する"""
+    def _run_design_file(self, design_file, dependencies, outputs, run_started):
+        """
+        依存先の成果物（outputs: 設計書 -> 生成したコード）を集めて設計書を処理し、
+        実行開始からの開始・終了時刻と依存先を結果に加える
+        """
+        upstream = [item for dep in dependencies[design_file] for item in outputs.get(dep, ())]
+        missing = [os.path.basename(dep) for dep in dependencies[design_file] if dep not in outputs]
+        started_at = time.perf_counter() - run_started
+        result = self.process_design_file(design_file, upstream)
+        if missing:
+            print(f"   ⚠️ 依存先のコードが生成されなかったため、コンテキストなしで生成しました: {', '.join(missing)}")
+        result.update(
+            depends_on=[os.path.basename(dep) for dep in dependencies[design_file]],
+            started_at=round(started_at, 3),
+            finished_at=round(time.perf_counter() - run_started, 3),
+        )
+        return result
+
+    @staticmethod
+    def _record_output(design_file, result, outputs):
+        """後続の設計書に渡すため、生成したコードを記録する（保存で source_code が取り除かれる前に呼ぶ）"""
+        if result.get("generated"):
+            outputs[design_file] = result["generated"]
+        elif result.get("source_code") is not None:
+            outputs[design_file] = [{"file_name": result["file_name"], "source_code": result["source_code"]}]
+
+    def _print_summary(self, results, elapsed):
+        """設計書ごとの成否と所要時間の表、およびLLM呼び出しの統計を表示する"""
+        if results:
+            width = max(len(result["design_file"]) for result in results)
+            print(f"\n{'設計書'.ljust(width)}  結果    所要時間  試行  出力ファイル（⚡ = キャッシュを再利用）")
+            for result in results:
+                status = ("✅" if result["success"] else "❌") + ("⚡" if result["cache"] == "hit" else "  ")
+                detail = result["output_path"] or (f"{len(result['files'])} ファイル" if result["files"] else "")
+                if result["error"]:
+                    detail = f"{detail} {result['error']}".strip()
+                print(f"{result['design_file'].ljust(width)}  {status}   {result['seconds']:>7.2f}s  {result['attempts']:>4}  {detail}")
+            succeeded = sum(1 for result in results if result["success"])
+            cached = sum(1 for result in results if result["cache"] == "hit")
+            print(f"成功 {succeeded}/{len(results)} 件 (うちキャッシュ {cached} 件) / 経過時間 {elapsed:.2f}s "
+                  f"(設計書ごとの所要時間の合計 {sum(result['seconds'] for result in results):.2f}s, 並列数 {self.workers})")
+            files = sum(len(result["files"]) for result in results)
+            llm_calls = sum(result["llm_calls"] for result in results)
+            if llm_calls:
+                print(f"📦 生成ファイル: {files} 件 / LLM呼び出し {llm_calls} 回 (1回あたり {files / llm_calls:.2f} ファイル)")
+            self._print_schedule(results, elapsed)
+            self._print_contested_files()
+        stats = prompt_budget.stats().get("coding_agent")
+        if stats:
+            print(f"📏 プロンプト: 合計 {stats['prompt_tokens_total']} トークン (最大 {stats['prompt_tokens_max']}) / "
+                  f"応答: 合計 {stats['response_tokens_total']} トークン")
+        calls = resilience_stats().get("coding_agent")
+        if calls:
+            print(f"🔁 LLM呼び出し: {calls['calls']} 回 (失敗 {calls['failed']}, リトライ {calls['retries']}, "
+                  f"ヘッジ {calls['hedges_fired']} / うち採用 {calls['hedges_won']})")
+        parses = json_repair_stats().get("coding_agent")
+        if parses and (parses["repaired"] or parses["failed"]):
+            print(f"🩹 応答のJSON: 修復 {parses['repaired']} 件 / 修復不可 {parses['failed']} 件 "
+                  f"(全 {parses['parsed']} 件, 修復率 {parses['repair_rate']:.0%})")
+        cassette = cassette_stats()
+        if cassette:
+            print(f"📼 LLMカセット ({cassette['mode']}): 記録 {cassette['recorded']} 件 / 再生 {cassette['replayed']} 件 / "
+                  f"記録なし {cassette['misses']} 件 ({cassette['path']})")
+        routes = routing_stats().get("coding_agent")
+        if routes:
+            served = ", ".join(f"{model} {count}件" for model, count in routes["served_by"].items())
+            print(f"🧭 モデル別の処理件数: {served} (切り替え率 {routes['escalation_rate']:.0%}, "
+                  f"推定短縮時間 {routes['latency_saved_seconds']:.1f}秒)")
+
+    def _print_contested_files(self):
+        """複数の設計書が生成したファイル（実行順で後の設計書の内容を保存した）を表示する"""
+        with self._claims_lock:
+            contested = {path: sorted(designs) for path, designs in self._claims.items() if len(designs) > 1}
+        if contested:
+            print("\n⚠️  複数の設計書が同じファイルを生成しました（実行順で後の設計書の内容を保存しています）:")
+            for path, designs in sorted(contested.items()):
+                print(f"   {os.path.relpath(path, self.project_dir)}: {', '.join(designs)}")
+
+    def _print_schedule(self, results, elapsed):
+        """各設計書の開始・終了時刻と依存先、および全体の所要時間を決めているクリティカルパスを表示する"""
+        width = max(len(result["design_file"]) for result in results)
+        print(f"\n🗺️  実行スケジュール（実行開始からの時刻）")
+        for result in results:
+            depends_on = f"  ← {', '.join(result['depends_on'])}" if result["depends_on"] else ""
+            print(f"{result['design_file'].ljust(width)}  {result['started_at']:>7.2f}s → {result['finished_at']:>7.2f}s{depends_on}")
+        path, seconds = critical_path(results)
+        seconds_by_file = {result["design_file"]: result["seconds"] for result in results}
+        print(f"⏱️  クリティカルパス: {' → '.join(f'{name} ({seconds_by_file[name]:.2f}s)' for name in path)} "
+              f"= {seconds:.2f}s (経過時間 {elapsed:.2f}s のうち、並列化では短縮できない部分)")
+
+    def process_design_file(self, file_path, upstream=()):
+        """
+        個別の設計書ファイルを処理し、AIにコーディングを指示する。
+        upstream は依存先の担当が生成したコード（file_name と source_code の辞書）のリストで、プロンプトに含める。
+        生成したコードはまだ保存せず、保存先とともに結果の辞書に入れて返す（保存は _commit_result で行う）
+        """
+        started = time.perf_counter()
+        result = {
+            "design_file": os.path.basename(file_path), "success": False, "attempts": 0, "cache": "miss",
+            "file_name": None, "output_path": None, "source_code": None, "error": None, "seconds": 0.0,
+            # 保存したファイル名と、LLMの呼び出し回数（1回あたりの生成ファイル数を求める）
+            "files": [], "llm_calls": 0,
+        }
         try:
             with open(file_path, 'r', encoding='utf-8') as f:
                 design_content = f.read()
             
             base_name = os.path.basename(file_path).replace('.md', '')
-            # "01_architect" から "architect" を抽出
-            agent_type_key = base_name.split('_', 1)[-1] 
+            role = agent_type_key(file_path)
             
             print(f"\n🤖 孫エージェント（コーディング担当）を起動: `{base_name}`")
             
             # マッピングに基づいて保存先のプレフィックスを決定
-            target_path_prefix = self.agent_path_map.get(agent_type_key, ".")
+            target_path_prefix = self.agent_path_map.get(role, ".")
+
+            # 設計書・概要・プロンプト・保存先・モデル・依存先のコードが前回と同じなら、LLMを呼ばずに前回の結果を使う
+            cache_key = self._codegen_cache_key(design_content, target_path_prefix, upstream)
+            cached = self.codegen_cache.get(cache_key)
+            if cached is not None and self.multi_file:
+                print(f"   ⚡ 設計書に変更がないため、前回生成したファイル一式を再利用します: {len(cached['files'])} ファイル")
+                result["cache"] = "hit"
+                result["generated"] = [item for item in cached["files"] if self._write_file(item, result)]
+                result["success"] = len(result["files"]) == len(cached["files"])
+                result["seconds"] = round(time.perf_counter() - started, 3)
+                return result
+            if cached is not None:
+                print(f"   ⚡ 設計書に変更がないため、前回生成したコードを再利用します: {cached['file_name']}")
+                result.update(cache="hit", file_name=cached["file_name"], source_code=cached["source_code"],
+                              output_path=os.path.join(self.project_dir, cached["file_name"]))
+                result["seconds"] = round(time.perf_counter() - started, 3)
+                return result
             
-            prompt = CODING_AGENT_PROMPT.format(
-                project_overview=self.project_overview,
-                design_document=design_content,
+            if self.multi_file:
+                print(f"   - 担当: {role} -> 保存先プレフィックス: '{target_path_prefix}'")
+                self._generate_manifest(result, cache_key, design_content, target_path_prefix, upstream)
+                result["seconds"] = round(time.perf_counter() - started, 3)
+                return result
+
+            prompt = prompt_budget.build(
+                "coding_agent",
+                CODING_AGENT_PROMPT,
+                {
+                    "design_document": PromptSection(design_content, priority=0),
+                    "project_overview": PromptSection(self.project_overview, priority=1),
+                    # 予算を超える場合は、依存先のコードから削る
+                    "upstream_code": PromptSection(self._format_upstream(upstream), priority=2),
+                },
                 target_path_prefix=target_path_prefix
             )
             
-            print(f"   - 担当: {agent_type_key} -> 保存先プレフィックス: '{target_path_prefix}'")
-            print("   - AIにコーディングを指示中...")
-            response_text = self.llm.invoke(prompt)
-            print("   - AIからの応答を受信。")
-            self._save_generated_code(response_text)
+            print(f"   - 担当: {role} -> 保存先プレフィックス: '{target_path_prefix}'")
+            if upstream:
+                print(f"   - 依存先のコード: {', '.join(item['file_name'] for item in upstream)}")
+            # 応答のJSONはまずローカルで修復し、それでも読めない場合だけLLMに再生成させる
+            attempts = 1 + int(os.getenv('CODING_AGENT_JSON_REINVOKES', 1))
+            for attempt in range(1, attempts + 1):
+                print("   - AIにコーディングを指示中..." if attempt == 1 else f"   - AIに再生成を指示中... ({attempt}/{attempts})")
+                result["attempts"] = result["llm_calls"] = attempt
+                response_text = self.llm.invoke(prompt)
+                prompt_budget.record_response("coding_agent", response_text)
+                print("   - AIからの応答を受信。")
+                generated = self._parse_generated_code(response_text)
+                if generated is not None:
+                    file_name, result["source_code"] = generated
+                    result["file_name"] = file_name
+                    result["output_path"] = os.path.join(self.project_dir, file_name)
+                    self.codegen_cache.set(cache_key, {"file_name": file_name, "source_code": result["source_code"]})
+                    break
+            else:
+                result["error"] = "応答からコードを取り出せませんでした"
 
         except Exception as e:
             print(f"❌ ファイル処理中にエラーが発生しました ({file_path}): {e}")
+            result["error"] = str(e)
+        result["seconds"] = round(time.perf_counter() - started, 3)
+        return result
+
+    def _codegen_cache_key(self, design_content, target_path_prefix, upstream=()):
+        """コード生成キャッシュのキー（プロジェクト概要・設計書・プロンプト・保存先・モデル・依存先のコードのハッシュ）"""
+        return hash_text(json.dumps([
+            self.project_overview,
+            design_content,
+            hash_text(CODING_AGENT_MANIFEST_PROMPT + CODING_AGENT_FILE_PROMPT if self.multi_file else CODING_AGENT_PROMPT),
+            target_path_prefix,
+            self.model_identity,
+            [[item["file_name"], hash_text(item["source_code"])] for item in upstream],
+        ], ensure_ascii=False))
+
+    @staticmethod
+    def _format_upstream(upstream):
+        """依存先のコードをプロンプトに埋め込む形式にする"""
+        if not upstream:
+            return "（なし）"
+        return "\n\n".join(f"### {item['file_name']}\n```\n{item['source_code']}\n```" for item in upstream)
 
-    def _save_generated_code(self, response_text):
-        """AIの応答からコードを抽出し、ファイルに保存する"""
+    def _parse_generated_code(self, response_text):
+        """
+        AIの応答からファイル名とコードを取り出し、(ファイル名, コード) を返す。
+        応答を読み取れなかった（再生成すべき）場合はNoneを返す
+        """
         try:
-            match = re.search(r"```json\s*([\s\S]+?)\s*```", response_text, re.DOTALL)
-            json_str = match.group(1) if match else response_text
-            data = json.loads(json_str)
-            file_name = data.get("file_name")
-            source_code = data.get("source_code")
-
-            if not file_name or source_code is None:
-                print("   - 応答JSONに'file_name'または'source_code'がありません。")
+            data = extract_json_tolerant(response_text, "coding_agent", require_fence=False)
+        except JSONExtractionError:
+            print(f"   - 応答のJSON形式が不正です（修復もできませんでした）。")
+            print(f"     AIの応答: {response_text}")
+            return None
+        file_name = data.get("file_name") if isinstance(data, dict) else None
+        source_code = data.get("source_code") if isinstance(data, dict) else None
+
+        if not file_name or source_code is None:
+            print("   - 応答JSONに'file_name'または'source_code'がありません。")
+            return None
+        return file_name, source_code
+
+    def _generate_manifest(self, result, cache_key, design_content, target_path_prefix, upstream):
+        """
+        マニフェスト形式で設計書1件分のファイル一式を生成する。応答をストリームで受け取りながらパースし、
+        "files" のエントリーが閉じるたびにそのファイルを保存する（並列実行でも、保存は生成した時点で行う。
+        他の設計書と同じパスに保存した場合の上書きの順序は _commit_result で実行順にそろえる）。
+        マニフェストにあるのに保存できなかったファイル（応答の途中での失敗・不正なエントリー）だけを1つずつ再生成する
+        """
+        sections = {
+            "design_document": PromptSection(design_content, priority=0),
+            "project_overview": PromptSection(self.project_overview, priority=1),
+            "upstream_code": PromptSection(self._format_upstream(upstream), priority=2),
+        }
+        prompt = prompt_budget.build(
+            "coding_agent", CODING_AGENT_MANIFEST_PROMPT, sections,
+            target_path_prefix=target_path_prefix, max_files=int(os.getenv('CODING_AGENT_MAX_FILES', 10)),
+        )
+        print("   - AIにファイル一式の生成を指示中（マニフェスト形式）...")
+        manifest = []
+        generated = {}
+        extractor = IncrementalJSONExtractor()
+        result["llm_calls"] += 1
+        try:
+            for chunk in self.llm.stream(prompt):
+                for event in extractor.feed(chunk):
+                    if event[0] == "member" and event[1] == "manifest" and isinstance(event[2], list):
+                        manifest = [name for name in event[2] if isinstance(name, str) and name]
+                        print(f"   - マニフェストを受信: {len(manifest)} ファイル")
+                    elif event[0] == "element" and event[1] == "files":
+                        self._write_manifest_entry(event[3], result, generated)
+        except Exception as e:
+            # 保存済みのファイルは残し、残りを個別に再生成する
+            print(f"   - 応答の受信中にエラーが発生しました: {e}")
+        prompt_budget.record_response("coding_agent", extractor.text)
+
+        if extractor.completed:
+            record_parse("coding_agent", "clean")
+        elif extractor.text:
+            # 途中で崩れた応答は全体を修復して読み直し、まだ保存していないエントリーを拾う
+            try:
+                data = extract_json_tolerant(extractor.text, "coding_agent")
+            except JSONExtractionError:
+                print("   - 応答のJSONが途中で崩れたため、残りのファイルは個別に再生成します。")
+                data = None
+            if isinstance(data, dict):
+                if not manifest and isinstance(data.get("manifest"), list):
+                    manifest = [name for name in data["manifest"] if isinstance(name, str) and name]
+                for entry in data.get("files") or []:
+                    if isinstance(entry, dict) and entry.get("file_name") not in generated:
+                        self._write_manifest_entry(entry, result, generated)
+
+        # マニフェストがない場合は、保存できたファイルを一式とみなす
+        manifest = manifest or list(generated)
+        if not manifest:
+            result["error"] = "応答からファイル一式を取り出せませんでした"
+            return
+        for file_name in manifest:
+            if file_name not in generated:
+                self._regenerate_file(file_name, manifest, result, generated, sections)
+
+        missing = [file_name for file_name in manifest if file_name not in generated]
+        result["generated"] = [{"file_name": name, "source_code": generated[name]} for name in manifest if name in generated]
+        result["generated"] += [{"file_name": name, "source_code": code} for name, code in generated.items() if name not in manifest]
+        result["attempts"] = result["llm_calls"]
+        if missing:
+            result["error"] = f"{len(missing)} ファイルを生成できませんでした: {', '.join(missing)}"
+            return
+        result["success"] = True
+        self.codegen_cache.set(cache_key, {"files": result["generated"]})
+
+    def _write_manifest_entry(self, entry, result, generated):
+        """マニフェスト形式の "files" のエントリーを検証して保存する。不正なエントリーは保存せず、後で再生成する"""
+        file_name = entry.get("file_name") if isinstance(entry, dict) else None
+        source_code = entry.get("source_code") if isinstance(entry, dict) else None
+        if not isinstance(file_name, str) or not file_name or not isinstance(source_code, str):
+            print(f"   - 'file_name'または'source_code'が不正なエントリーを読み飛ばしました: {str(file_name or entry)[:80]}")
+            return
+        if self._write_file({"file_name": file_name, "source_code": source_code}, result):
+            generated[file_name] = source_code
+
+    def _regenerate_file(self, file_name, manifest, result, generated, sections):
+        """マニフェストのファイルを1つだけ再生成して保存する"""
+        prompt = prompt_budget.build(
+            "coding_agent", CODING_AGENT_FILE_PROMPT, sections,
+            manifest="\n".join(f"- {name}" for name in manifest), file_name=file_name,
+        )
+        attempts = 1 + int(os.getenv('CODING_AGENT_JSON_REINVOKES', 1))
+        for attempt in range(1, attempts + 1):
+            print(f"   - AIに {file_name} の再生成を指示中... ({attempt}/{attempts})")
+            result["llm_calls"] += 1
+            try:
+                response_text = self.llm.invoke(prompt)
+            except Exception as e:
+                print(f"   - {file_name} の再生成中にエラーが発生しました: {e}")
                 return
+            prompt_budget.record_response("coding_agent", response_text)
+            generated_code = self._parse_generated_code(response_text)
+            if generated_code is None:
+                continue
+            # 応答のファイル名ではなく、マニフェストのファイル名で保存する
+            if self._write_file({"file_name": file_name, "source_code": generated_code[1]}, result):
+                generated[file_name] = generated_code[1]
+            return
 
-            output_path = os.path.join(self.project_dir, file_name)
+    def _write_file(self, item, result):
+        """file_name と source_code の辞書のコードを保存し、保存したファイル名を結果に加える。成否を返す"""
+        output_path = os.path.join(self.project_dir, item["file_name"])
+        with self._claims_lock:
+            self._claims.setdefault(os.path.normpath(output_path), set()).add(result["design_file"])
+        try:
             os.makedirs(os.path.dirname(output_path), exist_ok=True)
-            
             with open(output_path, 'w', encoding='utf-8') as f:
-                f.write(source_code)
-            print(f"   ✅ コードを保存しました: {output_path}")
-
-        except json.JSONDecodeError:
-            print(f"   - 応答のJSON形式が不正です。")
-            print(f"     AIの応答: {response_text}")
+                f.write(item["source_code"])
         except Exception as e:
-            print(f"   - コードの保存中にエラーが発生しました: {e}")
+            print(f"   - コードの保存中にエラーが発生しました ({output_path}): {e}")
+            return False
+        print(f"   ✅ コードを保存しました: {output_path}")
+        result["files"].append(item["file_name"])
+        return True
+
+    def _rewrite_contested_files(self, result):
+        """
+        生成時に保存済みのファイルのうち、他の設計書も保存したパスを保存し直す。
+        実行順に呼ばれるため、最終的には実行順で後の設計書の内容が残る（逐次実行と同じ）
+        """
+        for item in result.get("generated") or ():
+            output_path = os.path.normpath(os.path.join(self.project_dir, item["file_name"]))
+            with self._claims_lock:
+                others = sorted(self._claims.get(output_path, set()) - {result["design_file"]})
+            if not others:
+                continue
+            print(f"   ⚠️ {item['file_name']} は他の設計書 ({', '.join(others)}) も生成したため、実行順に保存し直します。")
+            try:
+                with open(output_path, 'w', encoding='utf-8') as f:
+                    f.write(item["source_code"])
+            except Exception as e:
+                print(f"   - コードの保存中にエラーが発生しました ({output_path}): {e}")
+                result["success"] = False
+                result["error"] = "コードを保存できませんでした"
+
+    def _commit_result(self, result):
+        """
+        process_design_file の結果のコードをファイルに保存し、表示用の結果を返す（実行順に呼ぶ）。
+        マニフェスト形式で保存済みのファイルは、他の設計書と衝突したパスだけを保存し直す
+        """
+        self._rewrite_contested_files(result)
+        # 後続の設計書に渡すためのコードは、保存後は不要
+        result.pop("generated", None)
+        source_code = result.pop("source_code")
+        if source_code is None:
+            return result
+        if self._write_file({"file_name": result["file_name"], "source_code": source_code}, result):
+            result["success"] = True
+        else:
+            result["error"] = "コードを保存できませんでした"
+        return result
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="設計書フォルダを処理して、各担当のコーディングタスクを実行するオーケストレーター")
     parser.add_argument("project_directory", help="処理対象の設計書が含まれるディレクトリのパス")
+    parser.add_argument("--workers", type=int, default=int(os.getenv('ORCHESTRATOR_WORKERS', 1)),
+                        help="同時に処理する設計書の数（既定: 1 = 逐次実行、環境変数 ORCHESTRATOR_WORKERS）")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="コード生成キャッシュを使わず、すべての設計書をLLMで生成し直す")
+    parser.add_argument("--multi-file", action="store_true",
+                        default=os.getenv('CODING_AGENT_MULTI_FILE', 'false').lower() == 'true',
+                        help="1つの設計書から複数のファイルを生成する（マニフェスト形式、環境変数 CODING_AGENT_MULTI_FILE）")
     args = parser.parse_args()
 
     try:
-        orchestrator = FullAgentOrchestrator(args.project_directory)
+        orchestrator = FullAgentOrchestrator(args.project_directory, workers=args.workers, use_cache=not args.no_cache,
+                                             multi_file=args.multi_file)
         orchestrator.execute()
     except ValueError as e:
         print(f"エラー: {e}")
@@ -0,0 +1,173 @@
+"""
+LLM呼び出しのアドミッション制御
+同時に実行するLLM呼び出しの数を制限し、超過分は上限付きの待ち行列で先着順に待たせる。
+待ち行列が満杯の場合や最大待ち時間を過ぎた場合は、推定した Retry-After 秒数とともに即座に拒否する。
+スレッド（Flask）とasyncio（ASGI）のどちらの呼び出し元も同じ枠と待ち行列を共有する。
+"""
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import deque
+
+
+class AdmissionRejectedError(Exception):
+    """同時実行枠の待ち行列が満杯、または待ち時間の上限を超えた"""
+
+    def __init__(self, message, retry_after, reason):
+        super().__init__(message)
+        self.retry_after = retry_after
+        # "queue_full" または "wait_timeout"
+        self.reason = reason
+
+
+class _Waiter:
+    __slots__ = ("event", "future", "loop", "granted")
+
+    def __init__(self, loop=None):
+        self.loop = loop
+        self.future = loop.create_future() if loop is not None else None
+        self.event = threading.Event() if loop is None else None
+        self.granted = False
+
+    def wake(self):
+        self.granted = True
+        if self.event is not None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(True)
+
+
+class ConcurrencyLimiter:
+    """同時実行数の上限、上限付きの待ち行列、最大待ち時間を持つリミッター"""
+
+    def __init__(self, max_concurrent=None, max_queue=None, max_wait=None):
+        self.max_concurrent = max_concurrent or int(os.getenv('LLM_MAX_CONCURRENCY', 8))
+        self.max_queue = max_queue if max_queue is not None else int(os.getenv('LLM_MAX_QUEUE', 32))
+        self.max_wait = max_wait or float(os.getenv('LLM_MAX_QUEUE_WAIT_SECONDS', 30))
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiters = deque()
+        # 1回の呼び出し時間の指数移動平均（Retry-After の推定に使う）
+        self._average_seconds = None
+        self._stats = {"admitted": 0, "queued": 0, "rejected_queue_full": 0, "rejected_wait_timeout": 0}
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def acquire(self):
+        """枠を確保するまで待ち、待った秒数を返す（拒否された場合はAdmissionRejectedError）"""
+        started = time.perf_counter()
+        with self._lock:
+            waiter = self._admit_or_enqueue(None)
+        if waiter is None:
+            return 0.0
+        waiter.event.wait(self.max_wait)
+        return self._finish_wait(waiter, started)
+
+    async def acquire_async(self):
+        """acquire の非同期版。待機中にイベントループをブロックしない"""
+        started = time.perf_counter()
+        with self._lock:
+            waiter = self._admit_or_enqueue(asyncio.get_running_loop())
+        if waiter is None:
+            return 0.0
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.max_wait)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            with self._lock:
+                if not waiter.granted:
+                    self._waiters.remove(waiter)
+                    raise
+            # キャンセルと同時に枠を受け取った場合は、次の待機者に譲る
+            self.release()
+            raise
+        return self._finish_wait(waiter, started)
+
+    def try_acquire(self):
+        """待たずに枠を確保できる場合だけ確保して True を返す（待ち行列には並ばない）"""
+        with self._lock:
+            if self._active < self.max_concurrent and not self._waiters:
+                self._active += 1
+                self._stats["admitted"] += 1
+                return True
+            return False
+
+    def release(self, duration=None):
+        """枠を返却する。duration（秒）を渡すと Retry-After の推定に使う平均所要時間を更新する"""
+        with self._lock:
+            if duration is not None:
+                self._average_seconds = duration if self._average_seconds is None \
+                    else self._average_seconds * 0.8 + duration * 0.2
+            if self._waiters:
+                # 枠は解放せず、そのまま先頭の待機者に引き渡す
+                self._waiters.popleft().wake()
+            else:
+                self._active -= 1
+
+    def retry_after(self):
+        """待ち行列が捌けるまでのおおよその秒数（Retry-After ヘッダー用、最低1秒）"""
+        with self._lock:
+            return self._estimate_retry_after()
+
+    def stats(self):
+        with self._lock:
+            waited = self._stats["queued"]
+            return dict(
+                self._stats,
+                active=self._active,
+                waiting=len(self._waiters),
+                max_concurrent=self.max_concurrent,
+                max_queue=self.max_queue,
+                max_wait_seconds=self.max_wait,
+                average_wait_ms=round(self._wait_total / waited * 1000, 2) if waited else 0.0,
+                max_wait_ms=round(self._wait_max * 1000, 2),
+                average_call_seconds=round(self._average_seconds, 3) if self._average_seconds else None
+            )
+
+    def queue_depth(self):
+        return len(self._waiters)
+
+    def active_count(self):
+        return self._active
+
+    def _admit_or_enqueue(self, loop):
+        if self._active < self.max_concurrent and not self._waiters:
+            self._active += 1
+            self._stats["admitted"] += 1
+            return None
+        if len(self._waiters) >= self.max_queue:
+            self._stats["rejected_queue_full"] += 1
+            raise AdmissionRejectedError(
+                f"Too many concurrent LLM requests (queue limit: {self.max_queue})",
+                self._estimate_retry_after(), "queue_full"
+            )
+        waiter = _Waiter(loop)
+        self._waiters.append(waiter)
+        self._stats["queued"] += 1
+        return waiter
+
+    def _finish_wait(self, waiter, started):
+        waited = time.perf_counter() - started
+        with self._lock:
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+            if waiter.granted:
+                self._stats["admitted"] += 1
+                return waited
+            self._waiters.remove(waiter)
+            self._stats["rejected_wait_timeout"] += 1
+            raise AdmissionRejectedError(
+                f"Timed out after {self.max_wait:.0f}s waiting for an LLM slot",
+                self._estimate_retry_after(), "wait_timeout"
+            )
+
+    def _estimate_retry_after(self):
+        average = self._average_seconds if self._average_seconds is not None else self.max_wait
+        return max(1, math.ceil(average * (len(self._waiters) + 1) / self.max_concurrent))
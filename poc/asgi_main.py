@@ -0,0 +1,170 @@
+"""
+Platform Architect Agent - ASGI（非同期）サーバーモード
+main.py と同じエンドポイント（/、/health、/metrics）とJSONの入出力を、非同期に提供する。
+LLM呼び出しは ainvoke で待機し、ディスクI/Oはスレッドに逃がすため、
+1プロセスで多数の低速なLLMリクエストを同時に保持できる。
+
+起動方法:
+    uvicorn asgi_main:app --host 0.0.0.0 --port 8080
+"""
+import asyncio
+import os
+import time
+from datetime import datetime
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+import main
+from circuit_breaker import CircuitOpenError
+from llm_client import is_demo_mode
+from prompt_budget import prompt_budget
+
+# 実行中の同一要件のLLM呼び出し（キャッシュキー -> asyncio.Future）
+_in_flight = {}
+
+
+async def generate_design_async(business_requirement, demo_mode, timings=None):
+    """main.generate_design の非同期版。レスポンス用の辞書を返す（失敗時はDesignGenerationError）"""
+    timings = timings if timings is not None else {}
+    with main.track_design_request(demo_mode):
+        started = time.perf_counter()
+        # キャッシュのディスク層とセマンティックインデックスの検索はブロッキングのためスレッドで実行する
+        result, context = await asyncio.to_thread(main.lookup_design, business_requirement, demo_mode)
+        timings["lookup_ms"] = main.elapsed_ms(started)
+        if result is None:
+            result = await _generate_design_coalesced(business_requirement, demo_mode, context, timings)
+    main.REQUESTS_TOTAL.inc(context["mode"], result["cache"])
+    return result
+
+
+async def _generate_design_coalesced(business_requirement, demo_mode, context, timings):
+    """LLMで設計書を生成する。実行中の同一要件の呼び出しがあれば、その結果を待って共有する"""
+    # 同じ要件の同時リクエストは1回のLLM呼び出しを共有する
+    key = context["cache_key"]
+    future = _in_flight.get(key)
+    if future is not None:
+        started = time.perf_counter()
+        result = await asyncio.shield(future)
+        timings["coalesced_wait_ms"] = main.elapsed_ms(started)
+        return dict(result, cache="coalesced")
+
+    future = _in_flight[key] = asyncio.get_running_loop().create_future()
+    try:
+        result = await _generate_design_with_llm_async(business_requirement, demo_mode, context, timings)
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        # 待機者がいない場合に「例外が取得されなかった」警告を出さないようにする
+        future.exception()
+        raise
+    finally:
+        del _in_flight[key]
+
+
+async def _generate_design_with_llm_async(business_requirement, demo_mode, context, timings):
+    """LLMを非同期に呼び出して設計書を生成・保存する"""
+    llm = main.get_design_llm(demo_mode, main.LLMCallSlot(context["mode"], timings))
+    prompt = main.build_design_prompt(business_requirement, context)
+
+    print("Generating agent design documents (async)...")
+    try:
+        main.design_breaker.reject_if_open()
+        with main.convert_llm_errors():
+            started = time.perf_counter()
+            response = await llm.ainvoke(prompt)
+    except CircuitOpenError as e:
+        return main.degraded_design(business_requirement, context, e)
+    main.observe_phase(main.LLM_INVOKE_SECONDS, context["mode"], started, timings, "llm_invoke_ms")
+    prompt_budget.record_response("design", response)
+
+    started = time.perf_counter()
+    design_data = main.extract_design_json(response)
+    main.observe_phase(main.JSON_EXTRACTION_SECONDS, context["mode"], started, timings, "json_extraction_ms")
+
+    # 書き込みキューが満杯の場合に待機する可能性があるため、スレッドで実行する
+    return await asyncio.to_thread(main.finalize_design, business_requirement, design_data, context, timings)
+
+
+async def get_business_requirement(request):
+    """リクエストボディ（JSON / フォーム）からビジネス要件を取り出す"""
+    if request.headers.get("content-type", "").startswith("application/json"):
+        try:
+            data = await request.json()
+        except ValueError:
+            return None
+        return data.get("business_requirements") if isinstance(data, dict) else None
+    form = await request.form()
+    return form.get("business_requirements")
+
+
+async def generate_designs(request):
+    """ビジネス要件を受け取り、エージェントの設計図を生成する"""
+    try:
+        business_requirement = await get_business_requirement(request)
+
+        if not business_requirement:
+            return JSONResponse({"error": "business_requirements is required"}, status_code=400)
+
+        print(f"Received requirement: {business_requirement}")
+
+        timings = {}
+        try:
+            result = await generate_design_async(business_requirement, is_demo_mode(), timings)
+        except main.DesignGenerationError as e:
+            return JSONResponse(e.to_dict(), status_code=e.status_code, headers=e.headers())
+
+        return JSONResponse(result, headers={
+            "X-Cache": result["cache"].upper(),
+            "Server-Timing": main.server_timing_header(timings)
+        })
+
+    except Exception as e:
+        print(f"Error in generate_designs: {e}")
+        return JSONResponse({"error": f"Internal server error: {str(e)}"}, status_code=500)
+
+
+async def health_check(request):
+    """ヘルスチェック。LLMクライアントの事前生成が完了するまでは503を返す"""
+    demo_mode = is_demo_mode()
+    llm_status = main.llm_pool.status(demo_mode)
+    warm = llm_status["state"] == "warm"
+    return JSONResponse({
+        "status": "healthy" if warm else "warming_up",
+        "timestamp": datetime.now().isoformat(),
+        "server": "asgi",
+        "llm": llm_status,
+        "cache": main.design_cache.stats(),
+        "semantic_index": main.semantic_index.stats(),
+        "in_flight": len(_in_flight),
+        "llm_admission": main.llm_limiter.stats(),
+        "llm_resilience": main.resilience_stats(),
+        "llm_circuit": main.design_breaker.stats(),
+        "llm_routing": main.routing_stats(),
+        "json_repair": main.json_repair_stats(),
+        "llm_cassette": main.cassette_stats(),
+        "prompt_tokens": prompt_budget.stats(),
+        "writer": main.design_writer.stats()
+    }, status_code=200 if warm else 503)
+
+
+async def metrics(request):
+    """Prometheusのテキスト形式でメトリクスを返す"""
+    return Response(main.metrics_registry.render(), headers={"Content-Type": main.METRICS_CONTENT_TYPE})
+
+
+app = Starlette(routes=[
+    Route("/", generate_designs, methods=["POST"]),
+    Route("/health", health_check, methods=["GET"]),
+    Route("/metrics", metrics, methods=["GET"]),
+])
+
+
+if __name__ == '__main__':
+    import uvicorn
+
+    port = int(os.getenv('PORT', 8080))
+    print(f"非同期サーバーを http://127.0.0.1:{port} で起動します。")
+    uvicorn.run(app, host='0.0.0.0', port=port)
@@ -0,0 +1,237 @@
+"""
+LLM呼び出しのサーキットブレーカー
+直近の呼び出しで失敗（クォータ超過・タイムアウト・サービス停止）や遅すぎる呼び出しが閾値を超えると回路を開き、
+一定時間はLLMを呼ばずに即座に CircuitOpenError を送出する。待ち時間を過ぎると半開状態になり、
+少数の試行呼び出しが成功すれば回路を閉じて通常の処理に戻る（失敗すれば再び開く）。
+
+状態遷移:
+    closed    --(失敗率が閾値以上)-->        open
+    open      --(CIRCUIT_OPEN_SECONDS 経過)--> half_open
+    half_open --(試行がすべて成功)-->        closed
+    half_open --(試行が失敗)-->              open
+"""
+import os
+import threading
+import time
+from collections import deque
+
+from llm_resilience import classify_error
+from metrics import registry as metrics_registry
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+CIRCUIT_STATE = metrics_registry.gauge(
+    "llm_circuit_state", "LLM circuit breaker state (0=closed, 1=half_open, 2=open)", ("circuit",))
+CIRCUIT_TRANSITIONS = metrics_registry.counter(
+    "llm_circuit_transitions_total", "LLM circuit breaker state transitions", ("circuit", "state"))
+CIRCUIT_REJECTED = metrics_registry.counter(
+    "llm_circuit_rejected_total", "LLM calls rejected because the circuit was open", ("circuit",))
+
+
+class CircuitOpenError(Exception):
+    """回路が開いているため、LLMを呼ばずに拒否した"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """直近の呼び出し結果の窓から失敗率を求め、回路の開閉を判断するサーキットブレーカー"""
+
+    def __init__(self, name, failure_ratio=None, min_calls=None, window=None, slow_call_seconds=None,
+                 open_seconds=None, half_open_probes=None, clock=None):
+        self.name = name
+        # 経過時間の計測に使う時計（テストでは差し替える）
+        self.clock = clock or time.monotonic
+        # 窓の中の失敗（遅い呼び出しを含む）の割合がこれ以上になったら開く
+        self.failure_ratio = failure_ratio or float(os.getenv('CIRCUIT_FAILURE_RATIO', 0.5))
+        # 失敗率を判断するのに必要な最小の呼び出し数
+        self.min_calls = min_calls or int(os.getenv('CIRCUIT_MIN_CALLS', 5))
+        self.window = window or int(os.getenv('CIRCUIT_WINDOW', 20))
+        # これより遅い呼び出しは、成功しても失敗として数える
+        self.slow_call_seconds = slow_call_seconds or float(os.getenv('CIRCUIT_SLOW_CALL_SECONDS', 60))
+        self.open_seconds = open_seconds or float(os.getenv('CIRCUIT_OPEN_SECONDS', 30))
+        # 半開状態で同時に通す試行呼び出しの数（すべて成功したら閉じる）
+        self.half_open_probes = half_open_probes or int(os.getenv('CIRCUIT_HALF_OPEN_PROBES', 1))
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._results = deque(maxlen=self.window)
+        self._opened_at = 0.0
+        self._probes_started = 0
+        self._probes_succeeded = 0
+        self._stats = {"calls": 0, "failures": 0, "slow_calls": 0, "rejected": 0, "opened": 0}
+        CIRCUIT_STATE.set(_STATE_VALUES[CLOSED], name)
+
+    @property
+    def state(self):
+        with self._lock:
+            self._refresh()
+            return self._state
+
+    def reject_if_open(self):
+        """回路が開いていれば CircuitOpenError を送出する（試行呼び出しの枠は消費しない）"""
+        with self._lock:
+            self._refresh()
+            if self._state == OPEN:
+                self._reject()
+
+    def before_call(self):
+        """呼び出しの前に呼ぶ。通せない場合は CircuitOpenError を送出する"""
+        with self._lock:
+            self._refresh()
+            if self._state == OPEN:
+                self._reject()
+            if self._state == HALF_OPEN:
+                if self._probes_started >= self.half_open_probes:
+                    self._reject()
+                self._probes_started += 1
+            self._stats["calls"] += 1
+
+    def record_success(self, duration):
+        """呼び出しが成功した。duration が遅い呼び出しの閾値を超えていれば失敗として数える"""
+        if duration >= self.slow_call_seconds:
+            with self._lock:
+                self._stats["slow_calls"] += 1
+            print(f"🐢 [{self.name}] LLM呼び出しが遅すぎるため失敗として数えます ({duration:.1f}s)")
+            self._record(False)
+        else:
+            self._record(True)
+
+    def record_failure(self, error):
+        """
+        呼び出しが失敗した。LLM側の障害（クォータ超過・タイムアウト・サービス停止）だけを数え、
+        それ以外（不正なリクエストなど）は回路の判断に使わない
+        """
+        if classify_error(error) == "other":
+            self.cancel_call()
+            return
+        with self._lock:
+            self._stats["failures"] += 1
+        self._record(False)
+
+    def cancel_call(self):
+        """結果を判断に使わない呼び出し（取り消し・対象外の失敗）。半開状態なら試行の枠を返す"""
+        with self._lock:
+            if self._state == HALF_OPEN and self._probes_started > 0:
+                self._probes_started -= 1
+
+    def retry_after(self):
+        """回路が半開になるまでの秒数（切り上げ、最小1秒）"""
+        with self._lock:
+            return self._retry_after()
+
+    def stats(self):
+        with self._lock:
+            self._refresh()
+            failures = self._results.count(False)
+            return dict(
+                self._stats,
+                state=self._state,
+                window_calls=len(self._results),
+                window_failure_ratio=round(failures / len(self._results), 3) if self._results else 0.0,
+                retry_after=self._retry_after() if self._state == OPEN else None,
+            )
+
+    def _record(self, success):
+        with self._lock:
+            if self._state == HALF_OPEN:
+                if not success:
+                    print(f"🔌 [{self.name}] 試行呼び出しが失敗したため、回路を再び開きます。")
+                    self._transition(OPEN)
+                    return
+                self._probes_succeeded += 1
+                if self._probes_succeeded >= self.half_open_probes:
+                    print(f"✅ [{self.name}] 試行呼び出しが成功したため、回路を閉じます。")
+                    self._transition(CLOSED)
+                return
+            if self._state == OPEN:
+                # 開く前に始まった呼び出しの結果は判断に使わない
+                return
+            self._results.append(success)
+            failures = self._results.count(False)
+            if len(self._results) >= self.min_calls and failures / len(self._results) >= self.failure_ratio:
+                print(f"🔌 [{self.name}] LLM呼び出しの失敗が続いているため回路を開きます "
+                      f"({failures}/{len(self._results)}件失敗, {self.open_seconds:.0f}秒間)")
+                self._transition(OPEN)
+
+    def _refresh(self):
+        if self._state == OPEN and self.clock() - self._opened_at >= self.open_seconds:
+            print(f"🔌 [{self.name}] 回路を半開にして、試行呼び出しを通します。")
+            self._transition(HALF_OPEN)
+
+    def _transition(self, state):
+        self._state = state
+        if state == OPEN:
+            self._opened_at = self.clock()
+            self._stats["opened"] += 1
+        self._results.clear()
+        self._probes_started = 0
+        self._probes_succeeded = 0
+        CIRCUIT_STATE.set(_STATE_VALUES[state], self.name)
+        CIRCUIT_TRANSITIONS.inc(self.name, state)
+
+    def _reject(self):
+        self._stats["rejected"] += 1
+        CIRCUIT_REJECTED.inc(self.name)
+        raise CircuitOpenError(f"LLM circuit '{self.name}' is open", self._retry_after())
+
+    def _retry_after(self):
+        remaining = self.open_seconds - (self.clock() - self._opened_at)
+        return max(1, int(-(-remaining // 1)))
+
+
+class CircuitBreakerLLM:
+    """LLMクライアントを包み、invoke / ainvoke / stream の1回ごとにサーキットブレーカーを通す"""
+
+    def __init__(self, llm, breaker):
+        self.llm = llm
+        self.breaker = breaker
+
+    def invoke(self, prompt):
+        self.breaker.before_call()
+        started = self.breaker.clock()
+        try:
+            result = self.llm.invoke(prompt)
+        except Exception as e:
+            self.breaker.record_failure(e)
+            raise
+        except BaseException:
+            # 取り消された呼び出し（ヘッジで負けた呼び出しや、途中で読むのをやめたストリーム）
+            self.breaker.cancel_call()
+            raise
+        self.breaker.record_success(self.breaker.clock() - started)
+        return result
+
+    async def ainvoke(self, prompt):
+        self.breaker.before_call()
+        started = self.breaker.clock()
+        try:
+            result = await self.llm.ainvoke(prompt)
+        except Exception as e:
+            self.breaker.record_failure(e)
+            raise
+        except BaseException:
+            # 取り消された呼び出し（ヘッジで負けた呼び出しや、途中で読むのをやめたストリーム）
+            self.breaker.cancel_call()
+            raise
+        self.breaker.record_success(self.breaker.clock() - started)
+        return result
+
+    def stream(self, prompt):
+        self.breaker.before_call()
+        started = self.breaker.clock()
+        try:
+            yield from self.llm.stream(prompt)
+        except Exception as e:
+            self.breaker.record_failure(e)
+            raise
+        except BaseException:
+            # 取り消された呼び出し（ヘッジで負けた呼び出しや、途中で読むのをやめたストリーム）
+            self.breaker.cancel_call()
+            raise
+        self.breaker.record_success(self.breaker.clock() - started)
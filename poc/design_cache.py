@@ -0,0 +1,156 @@
+"""
+設計書生成レスポンスのキャッシュ
+正規化したビジネス要件・プロンプトのハッシュ・モデル名・temperatureをキーに、
+メモリ上のLRU層とディスク上の永続層（TTL・サイズ上限付き）の2段構成で生成結果を保持する。
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+
+def normalize_requirement(requirement):
+    """表記揺れ（全角/半角・前後の空白・連続する空白）を吸収した要件文字列を返す"""
+    text = unicodedata.normalize("NFKC", requirement)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def hash_text(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class DesignCache:
+    """メモリLRU + ディスク永続化の2層キャッシュ"""
+
+    def __init__(self, cache_dir=None, memory_entries=None, ttl_seconds=None, max_disk_bytes=None):
+        self.cache_dir = cache_dir or os.getenv('DESIGN_CACHE_DIR', '.design_cache')
+        # 0を明示した場合はその層を使わない（memory_entries=0: メモリ層なし、max_disk_bytes=0: ディスク層なし、ttl_seconds=0: 常に期限切れ）
+        self.memory_entries = memory_entries if memory_entries is not None else int(
+            os.getenv('DESIGN_CACHE_MEMORY_ENTRIES', 256))
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else int(
+            os.getenv('DESIGN_CACHE_TTL_SECONDS', 24 * 60 * 60))
+        self.max_disk_bytes = max_disk_bytes if max_disk_bytes is not None else int(
+            os.getenv('DESIGN_CACHE_MAX_BYTES', 50 * 1024 * 1024))
+        self.enabled = os.getenv('DESIGN_CACHE_ENABLED', 'true').lower() == 'true'
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+    def make_key(self, requirement, prompt_template, model_name, temperature):
+        """キャッシュキーを生成する"""
+        material = json.dumps([
+            normalize_requirement(requirement),
+            hash_text(prompt_template),
+            model_name,
+            temperature,
+        ], ensure_ascii=False)
+        return hash_text(material)
+
+    def get(self, key):
+        """キャッシュされたエントリを返す。存在しない・期限切れの場合はNone"""
+        if not self.enabled:
+            return None
+
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if now - entry["created_at"] < self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return entry
+                del self._memory[key]
+
+        entry = self._read_disk(key, now)
+        with self._lock:
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["disk_hits"] += 1
+            self._remember(key, entry)
+        return entry
+
+    def set(self, key, value):
+        """エントリを両方の層に保存する"""
+        if not self.enabled:
+            return
+        entry = dict(value, created_at=time.time())
+        with self._lock:
+            self._remember(key, entry)
+        if self.max_disk_bytes <= 0:
+            return
+        try:
+            self._write_disk(key, entry)
+            self._evict_disk()
+        except OSError as e:
+            print(f"⚠️  設計書キャッシュの書き込みに失敗しました: {e}")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, memory_entries=len(self._memory))
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        total = hits + stats["misses"]
+        stats["hit_ratio"] = round(hits / total, 4) if total else 0.0
+        return stats
+
+    def _remember(self, key, entry):
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _read_disk(self, key, now):
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if now - entry.get("created_at", 0) >= self.ttl_seconds:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return entry
+
+    def _write_disk(self, key, entry):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def _evict_disk(self):
+        """期限切れのファイルを削除し、合計サイズが上限を超えていれば古い順に削除する"""
+        now = time.time()
+        files = []
+        total = 0
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith(".json"):
+                continue
+            st = entry.stat()
+            if now - st.st_mtime >= self.ttl_seconds:
+                os.remove(entry.path)
+                continue
+            files.append((st.st_mtime, st.st_size, entry.path))
+            total += st.st_size
+
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            os.remove(path)
+            total -= size
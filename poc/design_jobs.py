@@ -0,0 +1,145 @@
+"""
+設計書生成の非同期ジョブ
+POST /jobs で受け付けたジョブをローカルのSQLiteに保存し、上限付きのワーカープールで実行する。
+HTTPのワーカースレッドはLLMの応答を待たずにすぐ解放される。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+
+class JobQueueFullError(Exception):
+    """待機中のジョブ数が上限に達している"""
+
+
+class JobStore:
+    """ジョブの状態を保持するSQLiteストア"""
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or os.getenv('JOB_DB_PATH', 'design_jobs.sqlite3')
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    business_requirement TEXT NOT NULL,
+                    demo_mode INTEGER NOT NULL,
+                    created_at TEXT NOT NULL,
+                    started_at TEXT,
+                    finished_at TEXT,
+                    result TEXT,
+                    error TEXT,
+                    timing TEXT
+                )
+            """)
+
+    def create(self, business_requirement, demo_mode):
+        job_id = uuid.uuid4().hex
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, business_requirement, demo_mode, created_at) VALUES (?, 'queued', ?, ?, ?)",
+                (job_id, business_requirement, int(demo_mode), datetime.now().isoformat())
+            )
+        return job_id
+
+    def update(self, job_id, **fields):
+        for key in ("result", "error", "timing"):
+            if key in fields and fields[key] is not None:
+                fields[key] = json.dumps(fields[key], ensure_ascii=False)
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        with self._lock, self._conn:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["demo_mode"] = bool(job["demo_mode"])
+        for key in ("result", "error", "timing"):
+            if job[key] is not None:
+                job[key] = json.loads(job[key])
+        return job
+
+    def list_by_status(self, status):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, business_requirement, demo_mode FROM jobs WHERE status = ? ORDER BY created_at", (status,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+
+class JobRunner:
+    """ジョブを上限付きのワーカープールで実行する"""
+
+    def __init__(self, store, handler, max_workers=None, max_pending=None):
+        """
+        Args:
+            store: ジョブの状態を保存するJobStore。
+            handler: handler(business_requirement, demo_mode, timings) -> 結果の辞書。
+                     失敗時に送出する例外が to_dict() を持っていれば、その内容をエラーとして保存する。
+        """
+        self.store = store
+        self.handler = handler
+        self.max_workers = max_workers or int(os.getenv('JOB_WORKERS', 4))
+        self.max_pending = max_pending or int(os.getenv('JOB_MAX_PENDING', 100))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="design-job")
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    def recover(self):
+        """前回のプロセスで完了しなかったジョブを再開する"""
+        for job in self.store.list_by_status("running"):
+            self.store.update(job["id"], status="failed", finished_at=datetime.now().isoformat(),
+                              error={"error": "Job was interrupted by a server restart"})
+        for job in self.store.list_by_status("queued"):
+            self._schedule(job["id"], job["business_requirement"], bool(job["demo_mode"]))
+
+    def submit(self, business_requirement, demo_mode):
+        """ジョブを登録してIDを返す（待機数が上限の場合はJobQueueFullError）"""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise JobQueueFullError(f"Too many pending jobs (limit: {self.max_pending})")
+            self._pending += 1
+        try:
+            job_id = self.store.create(business_requirement, demo_mode)
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+        self._executor.submit(self._run, job_id, business_requirement, demo_mode, time.perf_counter())
+        return job_id
+
+    def stats(self):
+        with self._lock:
+            return {"workers": self.max_workers, "pending": self._pending, "max_pending": self.max_pending}
+
+    def _schedule(self, job_id, business_requirement, demo_mode):
+        with self._lock:
+            self._pending += 1
+        self._executor.submit(self._run, job_id, business_requirement, demo_mode, time.perf_counter())
+
+    def _run(self, job_id, business_requirement, demo_mode, enqueued_at):
+        started = time.perf_counter()
+        timings = {"queue_wait_ms": round((started - enqueued_at) * 1000, 2)}
+        self.store.update(job_id, status="running", started_at=datetime.now().isoformat())
+        try:
+            result = self.handler(business_requirement, demo_mode, timings)
+            status, fields = "succeeded", {"result": result}
+        except Exception as e:
+            error = e.to_dict() if hasattr(e, "to_dict") else {"error": f"Internal server error: {str(e)}"}
+            status, fields = "failed", {"error": error}
+        finally:
+            with self._lock:
+                self._pending -= 1
+        timings["run_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        self.store.update(job_id, status=status, finished_at=datetime.now().isoformat(), timing=timings, **fields)
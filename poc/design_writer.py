@@ -0,0 +1,128 @@
+"""
+設計書ファイルのバックグラウンド書き込み
+レスポンスを返す前の同期的なファイル書き込みをやめ、上限付きのキューを介して専用スレッドで書き込む。
+各ファイルは一時ファイルに書いてからリネームするため、読み手が書きかけのファイルを見ることはない。
+"""
+import itertools
+import os
+import queue
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+def write_file_atomically(path, content):
+    """同じディレクトリの一時ファイルに書き込み、os.replaceで置き換える"""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_", suffix=os.path.basename(path))
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+class WriteTicket:
+    """書き込み1回分の完了通知"""
+
+    def __init__(self, ticket_id, label):
+        self.id = ticket_id
+        self.label = label
+        self.error = None
+        self._done = threading.Event()
+
+    @property
+    def status(self):
+        if not self._done.is_set():
+            return "pending"
+        return "failed" if self.error else "written"
+
+    def wait(self, timeout=None):
+        """書き込み完了まで待つ。タイムアウトした場合はFalse"""
+        return self._done.wait(timeout)
+
+    def to_dict(self):
+        body = {"write_id": self.id, "output_dir": self.label, "status": self.status}
+        if self.error:
+            body["error"] = self.error
+        return body
+
+
+class DesignWriter:
+    """上限付きキューと専用スレッドでファイルを書き込むライター"""
+
+    def __init__(self, max_queue=None, enqueue_timeout=None, retained_tickets=1000):
+        self.max_queue = max_queue or int(os.getenv('DESIGN_WRITER_QUEUE_SIZE', 64))
+        self.enqueue_timeout = enqueue_timeout or float(os.getenv('DESIGN_WRITER_ENQUEUE_TIMEOUT', 1.0))
+        self.retained_tickets = retained_tickets
+        self._queue = queue.Queue(maxsize=self.max_queue)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._tickets = OrderedDict()
+        self._stats = {"written": 0, "failed": 0, "inline_writes": 0}
+        self._thread = threading.Thread(target=self._worker, name="design-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, render, label):
+        """
+        render() が返す (パス, 内容) のリストの書き込みを予約し、WriteTicketを返す。
+        キューが満杯のまま enqueue_timeout を過ぎた場合は、呼び出し元のスレッドで書き込む。
+        """
+        ticket = WriteTicket(str(next(self._ids)), label)
+        with self._lock:
+            self._tickets[ticket.id] = ticket
+            while len(self._tickets) > self.retained_tickets:
+                self._tickets.popitem(last=False)
+        try:
+            self._queue.put((ticket, render), timeout=self.enqueue_timeout)
+        except queue.Full:
+            print("⚠️  書き込みキューが満杯のため、設計書を同期的に書き込みます。")
+            with self._lock:
+                self._stats["inline_writes"] += 1
+            self._write(ticket, render)
+        return ticket
+
+    def get(self, ticket_id):
+        with self._lock:
+            return self._tickets.get(ticket_id)
+
+    def flush(self, timeout=None):
+        """現時点で予約済みの書き込みがすべて完了するまで待つ。timeout は全体の待ち時間で、超えた場合はFalse"""
+        with self._lock:
+            tickets = list(self._tickets.values())
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        for ticket in tickets:
+            remaining = max(0.0, deadline - time.monotonic()) if deadline is not None else None
+            if not ticket.wait(remaining):
+                return False
+        return True
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, queued=self._queue.qsize(), max_queue=self.max_queue)
+
+    def _worker(self):
+        while True:
+            ticket, render = self._queue.get()
+            try:
+                self._write(ticket, render)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, ticket, render):
+        try:
+            for path, content in render():
+                write_file_atomically(path, content)
+            print(f"Generated design documents saved in '{ticket.label}/'")
+            outcome = "written"
+        except Exception as e:
+            print(f"Error saving generated designs: {e}")
+            ticket.error = str(e)
+            outcome = "failed"
+        with self._lock:
+            self._stats[outcome] += 1
+        ticket._done.set()
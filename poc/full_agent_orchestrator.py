@@ -9,14 +9,8 @@ from datetime import datetime
 from pathlib import Path
 import requests # HTTPリクエストのために追加
 import time
-import google.auth
 
-# 既存のエージェントをインポート
-from frontend_developer_agent import FrontendDeveloperAgent
-from simple_backend_agent import BackendDeveloperAgent
-from qa_agent import QAEngineerAgent # QAエージェントをインポート
-from deploy_agent import DeployAgent # Deploy Agent をインポート
-from security_agent import SecurityAgent # Security Agent をインポート
+# 各エージェントと google.auth / VertexAI は、起動を速くするためにそれぞれのステップを実行する時点で読み込む
 
 class FullAgentOrchestrator:
     """全エージェントの統合オーケストレータ"""
@@ -69,6 +63,7 @@ class FullAgentOrchestrator:
         
         tech_stack = design_result["project_overview"].get("technical_stack", ["React", "TypeScript"])
         
+        from frontend_developer_agent import FrontendDeveloperAgent
         frontend_agent = FrontendDeveloperAgent()
         self.agents["frontend"] = frontend_agent
         
@@ -113,6 +108,7 @@ class FullAgentOrchestrator:
         tech_stack = design_result["project_overview"].get("technical_stack", ["Node.js", "Express"])
         requirements = ["ログイン機能", "ユーザー登録", "認証"]
         
+        from simple_backend_agent import BackendDeveloperAgent
         backend_agent = BackendDeveloperAgent()
         self.agents["backend"] = backend_agent
         
@@ -158,6 +154,7 @@ class FullAgentOrchestrator:
         print(f"\n🔬 QA Engineer Agent 実行中...")
         project_dir = f"full_stack_projects/{self.project_name}"
         
+        from qa_agent import QAEngineerAgent
         qa_agent = QAEngineerAgent()
         self.agents["qa"] = qa_agent
         
@@ -186,6 +183,7 @@ class FullAgentOrchestrator:
         print(f"\n🚀 Deploy Agent 実行中...")
         project_dir = f"full_stack_projects/{self.project_name}"
         
+        from deploy_agent import DeployAgent
         deploy_agent = DeployAgent()
         self.agents["deploy"] = deploy_agent
         
@@ -214,6 +212,7 @@ class FullAgentOrchestrator:
         print(f"\n🛡️ Security Agent 実行中...")
         project_dir = f"full_stack_projects/{self.project_name}"
         
+        from security_agent import SecurityAgent
         security_agent = SecurityAgent(llm)
         self.agents["security"] = security_agent
         
@@ -377,8 +376,12 @@ class FullAgentOrchestrator:
         # --------------------------------------------------------------------------
         print("\n🛡️ Security Agent 実行中...")
         from security_agent import SecurityAgent
+        from llm_client import model_tiers
+        from llm_cassette import with_cassette
+        from model_router import RoutedLLM
         # from langchain_community.llms.vertexai import VertexAI
         from langchain_google_vertexai import VertexAI
+        import google.auth
         
         project_id = os.environ.get("GOOGLE_CLOUD_PROJECT")
         if not project_id:
@@ -388,7 +391,11 @@ class FullAgentOrchestrator:
                 print("❌ Google Cloud credentials not found. Please run 'gcloud auth application-default login'.")
                 return
 
-        llm = VertexAI(project=project_id, model_name="gemini-2.5-pro")
+        # 高速なモデルから試し、レポートがマークダウンの形式を満たさない場合だけ高性能なモデルに切り替える
+        llm = RoutedLLM("security_report", [
+            (name, with_cassette(name, lambda name=name: VertexAI(project=project_id, model_name=name)))
+            for name in model_tiers()
+        ])
         security_agent = SecurityAgent(llm=llm)
         report_path = security_agent.run(project_path)
         print(f"✅ Security Agent 実行完了")
@@ -426,6 +433,9 @@ class FullAgentOrchestrator:
             result = response.json()
             # APIからのレスポンス形式に合わせて 'generated_design' を抽出
             if result.get("success") and "generated_design" in result:
+                if result.get("degraded"):
+                    # LLMの障害時にサーバーが返した縮退応答（類似要件の設計書、または定型の設計書）
+                    print(f"⚠️  LLMが利用できないため、縮退した設計書が返されました (情報源: {result['degraded']['source']})")
                 return result["generated_design"]
             else:
                 print(f"❌ APIからの応答エラー: {result.get('error', '不明なエラー')}")
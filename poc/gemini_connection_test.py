@@ -6,13 +6,8 @@ import os
 import sys
 from dotenv import load_dotenv
 
-try:
-    from langchain_google_vertexai import VertexAI
-    import google.auth
-    from google.api_core.exceptions import PermissionDenied
-except ImportError:
-    print("❌ 必要なライブラリが不足しています。 'pip install langchain-google-vertexai google-auth google-api-core' を実行してください。")
-    sys.exit(1)
+from llm_client import model_tiers
+from model_router import RoutedLLM, routing_stats
 
 def run_test():
     """Gemini APIへの接続をテストする"""
@@ -24,6 +19,15 @@ def run_test():
         print("❌ 環境変数 'GOOGLE_CLOUD_PROJECT' が.envファイルに設定されていません。")
         return
 
+    # VertexAI関連のライブラリは読み込みに数秒かかるため、設定を確認してから読み込む
+    try:
+        from langchain_google_vertexai import VertexAI
+        import google.auth
+        from google.api_core.exceptions import PermissionDenied
+    except ImportError:
+        print("❌ 必要なライブラリが不足しています。 'pip install langchain-google-vertexai google-auth google-api-core' を実行してください。")
+        sys.exit(1)
+
     print(f"🔑 プロジェクトID '{project_id}' を使用して接続を試みます。")
 
     try:
@@ -31,20 +35,24 @@ def run_test():
         credentials, detected_project_id = google.auth.default()
         print("✅ Google Cloudの認証情報を正常に読み込みました。")
 
-        # VertexAIクライアントの初期化
-        # ユーザー指定のモデルに変更
-        llm = VertexAI(project=project_id, model_name="gemini-2.5-pro")
-        print("✅ VertexAIクライアントの初期化に成功。")
+        # VertexAIクライアントの初期化（モデルルーティングで使うすべてのモデル）
+        tiers = [(name, VertexAI(project=project_id, model_name=name)) for name in model_tiers()]
+        print(f"✅ VertexAIクライアントの初期化に成功。 ({' -> '.join(name for name, _ in tiers)})")
+
+        # API呼び出しテスト（切り替え先のモデルにも接続できることを確認するため、モデルごとに呼び出す）
+        for name, llm in tiers:
+            print(f"🗣️ {name} に応答をリクエストしています...")
+            response = RoutedLLM("connection_test", [(name, llm)]).invoke("1+1は？")
 
-        # API呼び出しテスト
-        print("🗣️ APIに応答をリクエストしています...")
-        response = llm.invoke("1+1は？")
+            if response:
+                print("🎉 接続成功！ APIから応答がありました。")
+                print(f"   Geminiの答え: '{response.strip()}'")
+            else:
+                print("❌ 接続に失敗しました。APIから空の応答がありました。")
 
-        if response:
-            print("🎉 接続成功！ APIから応答がありました。")
-            print(f"   Geminiの答え: '{response.strip()}'")
-        else:
-            print("❌ 接続に失敗しました。APIから空の応答がありました。")
+        stats = routing_stats().get("connection_test", {})
+        for name, seconds in stats.get("average_latency_seconds", {}).items():
+            print(f"⏱️  {name}: {seconds:.2f}秒")
 
     except PermissionDenied as e:
         print(f"❌ 権限エラー: Vertex AI APIが有効になっていないか、必要な権限がありません。")
@@ -0,0 +1,260 @@
+"""
+LLM出力のJSONの修復
+厳密な抽出（json_stream.extract_json）に失敗した応答に対して、LLMがよく出す次の崩れをローカルで直してからパースする。
+    missing_fence       ```json フェンスがない（``` だけ、またはフェンスなし）
+    unescaped_control   文字列内の生の改行・タブなどの制御文字（source_code に多い）
+    invalid_escape      文字列内の不正なエスケープ（正規表現の \\d など）
+    single_quotes       シングルクォートで囲まれた文字列
+    trailing_comma      閉じ括弧の直前のカンマ
+    unclosed_brackets   途中で打ち切られて閉じ括弧が足りない（閉じのフェンスがない場合を含む）
+文字列の途中やキーの直後で打ち切られた応答は、内容が欠けているため修復しない（LLMの再呼び出しに任せる）。
+修復の成否は呼び出し箇所ごとに /metrics と json_repair_stats() で確認できる。
+"""
+import json
+import threading
+
+from json_stream import JSONExtractionError, extract_json
+from metrics import registry as metrics_registry
+
+JSON_PARSE_TOTAL = metrics_registry.counter(
+    "llm_json_parse_total", "JSON parses of LLM responses by outcome (clean / repaired / failed)", ("call_site", "outcome"))
+JSON_REPAIRS_TOTAL = metrics_registry.counter(
+    "llm_json_repairs_total", "Defects fixed by the local JSON repair pass", ("call_site", "fix"))
+
+_ESCAPABLE = set('"\\/bfnrtu')
+_WHITESPACE = " \t\r\n"
+
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+class _Frame:
+    __slots__ = ("kind", "state", "comma_at")
+
+    def __init__(self, kind):
+        self.kind = kind
+        # オブジェクト: key -> colon -> value -> after、配列: value -> after
+        self.state = "key" if kind == "{" else "value"
+        # 直前のカンマの出力位置（末尾のカンマを取り除くため）
+        self.comma_at = None
+
+
+def _closes_single_quote(text, pos):
+    """シングルクォートの文字列内の ' が、文字列の終わりか（アポストロフィではないか）を後続の文字で判断する"""
+    while pos < len(text) and text[pos] in _WHITESPACE:
+        pos += 1
+    return pos >= len(text) or text[pos] in ",:}]"
+
+
+def _find_start(text, require_fence):
+    """JSONの開始位置と、フェンスがなかったかどうかを返す"""
+    fence = text.find("```json")
+    if fence != -1:
+        return fence + len("```json"), False
+    bare = min((i for i in (text.find("{"), text.find("[")) if i != -1), default=-1)
+    if bare == -1:
+        raise JSONExtractionError("Could not extract JSON from LLM response", found_block=False)
+    # require_fence=False の場合は、フェンスがないことを修復とはみなさない
+    return bare, require_fence
+
+
+def repair_json(text, require_fence=True):
+    """
+    崩れたJSONを修復してパースし、(値, 適用した修復の名前のリスト) を返す。
+    修復できない場合はJSONExtractionError。
+    """
+    start, missing_fence = _find_start(text, require_fence)
+    fixes = set()
+    if missing_fence:
+        fixes.add("missing_fence")
+
+    out = []
+    stack = []
+    # トップレベルの値が始まったかどうか
+    started = False
+    quote = None
+    key_string = False
+    pos = start
+    end = len(text)
+
+    def value_done():
+        if stack:
+            stack[-1].state = "after"
+
+    while pos < end:
+        ch = text[pos]
+        if quote is not None:
+            if ch == "\\" and pos + 1 < end:
+                nxt = text[pos + 1]
+                if nxt == "'":
+                    # \' はJSONでは不正なエスケープのため、' にする
+                    out.append("'")
+                    pos += 2
+                elif nxt in _ESCAPABLE:
+                    out.append(ch + nxt)
+                    pos += 2
+                else:
+                    # バックスラッシュ自体をエスケープし、続く文字は通常どおり処理する
+                    fixes.add("invalid_escape")
+                    out.append("\\\\")
+                    pos += 1
+                continue
+            if ch == quote and (quote == '"' or _closes_single_quote(text, pos + 1)):
+                out.append('"')
+                quote = None
+                if key_string:
+                    stack[-1].state = "colon"
+                else:
+                    value_done()
+            elif ch == '"':
+                # シングルクォートの文字列内のダブルクォート
+                out.append('\\"')
+            elif ch < " ":
+                fixes.add("unescaped_control")
+                out.append({"\n": "\\n", "\t": "\\t", "\r": "\\r"}.get(ch, f"\\u{ord(ch):04x}"))
+            else:
+                out.append(ch)
+            pos += 1
+            continue
+
+        frame = stack[-1] if stack else None
+        if frame is None and ch not in "{[":
+            # 開始位置から最初の { / [ までの前置き
+            pos += 1
+            continue
+        if ch in _WHITESPACE:
+            out.append(ch)
+        elif text.startswith("```", pos):
+            # 閉じ括弧が足りないまま閉じのフェンスが来た
+            break
+        elif ch in "\"'":
+            if ch == "'":
+                fixes.add("single_quotes")
+            if frame.state not in ("key", "value"):
+                raise JSONExtractionError(f"Invalid JSON in LLM response: unexpected string at {pos}")
+            key_string = frame.state == "key"
+            quote = ch
+            frame.comma_at = None
+            out.append('"')
+        elif ch in "{[":
+            if frame is not None and frame.state != "value":
+                raise JSONExtractionError(f"Invalid JSON in LLM response: unexpected '{ch}' at {pos}")
+            if frame is not None:
+                frame.comma_at = None
+            stack.append(_Frame(ch))
+            started = True
+            out.append(ch)
+        elif ch in "}]":
+            if frame is None or frame.kind != ("{" if ch == "}" else "["):
+                raise JSONExtractionError(f"Invalid JSON in LLM response: unexpected '{ch}' at {pos}")
+            if frame.comma_at is not None:
+                fixes.add("trailing_comma")
+                del out[frame.comma_at]
+            elif frame.state == "colon" or (frame.state == "value" and frame.kind == "{"):
+                raise JSONExtractionError(f"Invalid JSON in LLM response: missing value at {pos}")
+            stack.pop()
+            out.append(ch)
+            if not stack:
+                break
+            value_done()
+        elif ch == ",":
+            if frame.state != "after":
+                raise JSONExtractionError(f"Invalid JSON in LLM response: unexpected ',' at {pos}")
+            frame.state = "key" if frame.kind == "{" else "value"
+            frame.comma_at = len(out)
+            out.append(ch)
+        elif ch == ":":
+            if frame.state != "colon":
+                raise JSONExtractionError(f"Invalid JSON in LLM response: unexpected ':' at {pos}")
+            frame.state = "value"
+            out.append(ch)
+        else:
+            # 数値・true/false/null などのプリミティブ値
+            if frame.state != "value":
+                raise JSONExtractionError(f"Invalid JSON in LLM response: unexpected '{ch}' at {pos}")
+            stop = pos
+            while stop < end and text[stop] not in _WHITESPACE + ",:{}[]\"'":
+                stop += 1
+            out.append(text[pos:stop])
+            frame.comma_at = None
+            value_done()
+            pos = stop
+            continue
+        pos += 1
+
+    if not started:
+        raise JSONExtractionError("Could not extract JSON from LLM response", found_block=False)
+    if quote is not None:
+        raise JSONExtractionError("Invalid JSON in LLM response: truncated inside a string")
+    if stack:
+        frame = stack[-1]
+        if frame.state == "colon" or (frame.state == "value" and frame.kind == "{"):
+            raise JSONExtractionError("Invalid JSON in LLM response: truncated after a key")
+        if frame.comma_at is not None:
+            del out[frame.comma_at]
+        fixes.add("unclosed_brackets")
+        out.extend("}" if f.kind == "{" else "]" for f in reversed(stack))
+
+    try:
+        value = json.loads("".join(out))
+    except json.JSONDecodeError as e:
+        raise JSONExtractionError(f"Invalid JSON in LLM response after repair: {e}")
+    return value, sorted(fixes)
+
+
+def parse_llm_json(text, require_fence=True):
+    """
+    厳密に抽出し、失敗した場合だけ修復を試みる。(値, 適用した修復の名前のリスト) を返す。
+    メトリクスは記録しない（応答の検証など、結果を保存しない用途向け）
+    """
+    try:
+        return extract_json(text, require_fence=require_fence), []
+    except JSONExtractionError as error:
+        try:
+            return repair_json(text, require_fence=require_fence)
+        except JSONExtractionError:
+            raise error
+
+
+def extract_json_tolerant(text, call_site, require_fence=True):
+    """
+    parse_llm_json と同じ処理で値を返し、呼び出し箇所ごとの結果（そのまま / 修復 / 失敗）を記録する。
+    修復できない場合は、厳密な抽出のJSONExtractionErrorをそのまま送出する
+    """
+    try:
+        value, fixes = parse_llm_json(text, require_fence=require_fence)
+    except JSONExtractionError:
+        record_parse(call_site, "failed")
+        raise
+    record_parse(call_site, "repaired" if fixes else "clean", fixes)
+    if fixes:
+        print(f"🩹 [{call_site}] LLMの応答のJSONを修復しました: {', '.join(fixes)}")
+    return value
+
+
+def json_repair_stats():
+    """呼び出し箇所ごとのパース結果の件数と修復率を返す"""
+    with _stats_lock:
+        result = {}
+        for call_site, stats in _stats.items():
+            parsed = stats["clean"] + stats["repaired"] + stats["failed"]
+            needed = stats["repaired"] + stats["failed"]
+            result[call_site] = dict(
+                stats, fixes=dict(stats["fixes"]),
+                # 厳密な抽出に失敗した応答のうち、修復で救えた割合
+                repair_rate=round(stats["repaired"] / needed, 3) if needed else None,
+                parsed=parsed,
+            )
+        return result
+
+
+def record_parse(call_site, outcome, fixes=()):
+    """パース結果（clean / repaired / failed）と適用した修復を記録する"""
+    JSON_PARSE_TOTAL.inc(call_site, outcome)
+    for fix in fixes:
+        JSON_REPAIRS_TOTAL.inc(call_site, fix)
+    with _stats_lock:
+        stats = _stats.setdefault(call_site, {"clean": 0, "repaired": 0, "failed": 0, "fixes": {}})
+        stats[outcome] += 1
+        for fix in fixes:
+            stats["fixes"][fix] = stats["fixes"].get(fix, 0) + 1
@@ -0,0 +1,259 @@
+"""
+LLM出力からのJSONの逐次抽出
+LLMの応答をチャンク単位で受け取り、```json フェンス内のJSONを走査しながら
+トップレベルのメンバーと配列要素を閉じた時点で取り出す。
+走査済みの位置は記録しておき、バッファ全体を再走査・再パースしない。
+"""
+import json
+import re
+
+_FENCE = "```json"
+# 走査用バッファから不要になった先頭部分を切り詰める際の最小サイズ
+_COMPACT_THRESHOLD = 4096
+# 文字列の外で意味を持つ文字
+_STRUCTURAL = re.compile(r'["{}\[\],:]')
+# 文字列の本体（エスケープを含む、閉じの " の直前まで）
+_STRING_BODY = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*', re.DOTALL)
+_NON_WHITESPACE = re.compile(r'\S')
+
+
+class JSONExtractionError(ValueError):
+    """LLMの応答からJSONを抽出できなかった"""
+
+    def __init__(self, message, found_block=True):
+        super().__init__(message)
+        # JSONブロック自体が見つからなかった場合はFalse
+        self.found_block = found_block
+
+
+class _Frame:
+    __slots__ = ("kind", "start", "collect", "items", "key", "expecting_key", "value_start",
+                 "has_value", "after_comma", "key_pending")
+
+    def __init__(self, kind, start, collect):
+        self.kind = kind
+        self.start = start
+        # 子要素を個別にパースして組み立てるかどうか（トップレベルと、トップレベルのオブジェクト直下の配列のみ）
+        self.collect = collect
+        self.items = ({} if kind == "{" else []) if collect else None
+        self.key = None
+        self.expecting_key = kind == "{"
+        self.value_start = None
+        # 収集対象のフレームで値の欠落（{"a": } や [1,]）を検出するための状態
+        self.has_value = False
+        self.after_comma = False
+        self.key_pending = False
+
+
+class IncrementalJSONExtractor:
+    """
+    チャンクを受け取るたびに、新しく完成した要素をイベントとして返す抽出器。
+
+    イベント:
+        ("member", key, value)          トップレベルのオブジェクトのメンバーが閉じた
+        ("element", key, index, value)  トップレベル直下の配列（key はそのメンバー名、
+                                         トップレベル自体が配列の場合は None）の要素が閉じた
+        ("document", value)             JSON全体が閉じた
+    """
+
+    def __init__(self, require_fence=True):
+        """
+        Args:
+            require_fence: Falseの場合、```json フェンスより先に現れた { / [ をJSONの開始とみなす。
+        """
+        self.require_fence = require_fence
+        self.document = None
+        self.completed = False
+        self.error = None
+        self._chunks = []
+        # 走査用のバッファ。まだ値が閉じていない部分より前は切り詰める
+        self._buffer = ""
+        self._pos = 0
+        self._started = False
+        self._stack = []
+        self._in_string = False
+        self._string_start = None
+
+    @property
+    def text(self):
+        """これまでに受け取った応答テキスト全体"""
+        if len(self._chunks) > 1:
+            self._chunks = ["".join(self._chunks)]
+        return self._chunks[0] if self._chunks else ""
+
+    def feed(self, chunk):
+        """チャンクを追加し、新たに完成した要素のイベントのリストを返す"""
+        self._chunks.append(chunk)
+        events = []
+        if self.completed or self.error is not None:
+            return events
+        self._buffer += chunk
+        if not self._started and not self._find_start():
+            self._compact()
+            return events
+        try:
+            self._scan(events)
+        except json.JSONDecodeError as e:
+            self.error = JSONExtractionError(f"Invalid JSON in LLM response: {str(e)}")
+        self._compact()
+        return events
+
+    def close(self):
+        """入力の終わりを通知し、完成したJSONを返す（抽出できない場合はJSONExtractionError）"""
+        if self.error is not None:
+            raise self.error
+        if not self._started:
+            raise JSONExtractionError("Could not extract JSON from LLM response", found_block=False)
+        if not self.completed:
+            raise JSONExtractionError("Invalid JSON in LLM response: unexpected end of JSON block")
+        return self.document
+
+    def _find_start(self):
+        buffer = self._buffer
+        search_from = max(0, self._pos - len(_FENCE) + 1)
+        fence = buffer.find(_FENCE, search_from)
+        start = fence + len(_FENCE) if fence != -1 else -1
+        if not self.require_fence:
+            bare = min((i for i in (buffer.find("{", self._pos), buffer.find("[", self._pos)) if i != -1), default=-1)
+            if bare != -1 and (fence == -1 or bare < fence):
+                start = bare
+        if start == -1:
+            self._pos = len(buffer)
+            return False
+        self._pos = start
+        self._started = True
+        return True
+
+    def _compact(self):
+        """以降の走査・パースで参照しない先頭部分をバッファから取り除く"""
+        if not self._started:
+            keep = max(0, self._pos - len(_FENCE) + 1)
+        elif self.completed:
+            keep = len(self._buffer)
+        else:
+            keep = self._pos
+            if self._in_string:
+                keep = min(keep, self._string_start)
+            for depth, frame in enumerate(self._stack):
+                child = self._stack[depth + 1] if depth + 1 < len(self._stack) else None
+                # 子が収集対象のコンテナであれば、その値は子の items から組み立てるため開始位置は不要
+                if frame.value_start is not None and not (child is not None and child.collect):
+                    keep = min(keep, frame.value_start)
+                if not frame.collect:
+                    # 収集対象の直下のコンテナは閉じた時点で丸ごとパースするため、開始位置から保持する
+                    keep = min(keep, frame.start)
+                    break
+        if keep < _COMPACT_THRESHOLD:
+            return
+
+        self._buffer = self._buffer[keep:]
+        self._pos -= keep
+        if self._string_start is not None:
+            self._string_start -= keep
+        for frame in self._stack:
+            frame.start -= keep
+            if frame.value_start is not None:
+                frame.value_start -= keep
+
+    def _scan(self, events):
+        buffer = self._buffer
+        end = len(buffer)
+        pos = self._pos
+        stack = self._stack
+
+        while pos < end:
+            if self._in_string:
+                pos = _STRING_BODY.match(buffer, pos).end()
+                if pos >= end or buffer[pos] == "\\":
+                    # 閉じの " またはエスケープ対象の文字が次のチャンクに来るまで待つ
+                    break
+                self._in_string = False
+                frame = stack[-1] if stack else None
+                if frame is not None and frame.kind == "{" and frame.expecting_key:
+                    frame.key = json.loads(buffer[self._string_start:pos + 1])
+                    frame.key_pending = True
+                pos += 1
+                continue
+
+            match = _STRUCTURAL.search(buffer, pos)
+            stop = match.start() if match else end
+            frame = stack[-1] if stack else None
+            if frame is not None and frame.collect and frame.value_start is None and not frame.expecting_key:
+                # 数値・true/false/null などのプリミティブ値の開始位置を記録する
+                text = _NON_WHITESPACE.search(buffer, pos, stop)
+                if text is not None:
+                    frame.value_start = text.start()
+            if match is None:
+                pos = end
+                break
+
+            pos = stop
+            ch = buffer[pos]
+            if ch == '"':
+                self._in_string = True
+                self._string_start = pos
+                if frame is not None and frame.collect and frame.value_start is None and not frame.expecting_key:
+                    frame.value_start = pos
+            elif ch == ":":
+                if frame is not None and frame.kind == "{":
+                    frame.expecting_key = False
+            elif ch == ",":
+                if frame is not None and frame.collect:
+                    if frame.value_start is not None:
+                        self._finish_value(frame, json.loads(buffer[frame.value_start:pos]), events)
+                    if not frame.has_value:
+                        raise json.JSONDecodeError("Expecting value", buffer, pos)
+                    frame.has_value = False
+                    frame.after_comma = True
+                if frame is not None and frame.kind == "{":
+                    frame.expecting_key = True
+            elif ch in "{[":
+                if frame is not None and frame.collect and frame.value_start is None:
+                    frame.value_start = pos
+                depth = len(stack) + 1
+                collect = depth == 1 or (depth == 2 and ch == "[" and stack[0].kind == "{")
+                stack.append(_Frame(ch, pos, collect))
+            else:  # } or ]
+                if frame is None or frame.kind != ("{" if ch == "}" else "["):
+                    raise json.JSONDecodeError("Unexpected closing bracket", buffer, pos)
+                if frame.collect:
+                    if frame.value_start is not None:
+                        self._finish_value(frame, json.loads(buffer[frame.value_start:pos]), events)
+                    if frame.key_pending or (frame.after_comma and not frame.has_value):
+                        raise json.JSONDecodeError("Expecting value", buffer, pos)
+                stack.pop()
+                parent = stack[-1] if stack else None
+                if parent is None:
+                    self.document = frame.items
+                    self.completed = True
+                    events.append(("document", frame.items))
+                    pos += 1
+                    break
+                if parent.collect:
+                    # 収集対象の直下の値だけをパースする（より深い要素は親ごとに1回だけパースされる）
+                    value = frame.items if frame.collect else json.loads(buffer[frame.start:pos + 1])
+                    self._finish_value(parent, value, events)
+            pos += 1
+
+        self._pos = pos
+
+    def _finish_value(self, frame, value, events):
+        """収集対象のフレームに値を追加し、イベントを発行する"""
+        frame.value_start = None
+        frame.has_value = True
+        frame.key_pending = False
+        if frame.kind == "{":
+            frame.items[frame.key] = value
+            events.append(("member", frame.key, value))
+        else:
+            index = len(frame.items)
+            frame.items.append(value)
+            parent = self._stack[-2] if len(self._stack) >= 2 and self._stack[-1] is frame else None
+            events.append(("element", parent.key if parent is not None else None, index, value))
+
+
+def extract_json(text, require_fence=True):
+    """応答テキスト全体から ```json ブロックのJSONを抽出して返す（失敗時はJSONExtractionError）"""
+    extractor = IncrementalJSONExtractor(require_fence=require_fence)
+    extractor.feed(text)
+    return extractor.close()
@@ -0,0 +1,246 @@
+"""
+LLM呼び出しの記録と再生（カセット）
+LLM_CASSETTE_MODE=record では、LLMクライアントへの呼び出しごとに、プロンプトのハッシュ・応答・レイテンシ
+（ストリームでは断片ごとの到着時刻）・失敗した場合の例外をカセットファイル（JSON Lines、.gz なら圧縮）に追記する
+（既存のカセットは最初の記録の時点で作り直すため、前回の記録が再生されることはない）。
+LLM_CASSETTE_MODE=replay では、LLMクライアントを生成せずに（認証もネットワークも使わずに）カセットから応答を返す。
+LLM_CASSETTE_TIMING=recorded なら記録したレイテンシどおりに待ってから返し、instant（既定）なら待たずに返す。
+
+カセットはリトライ・サーキットブレーカー・モデルルーティングより内側のクライアントを包むため、
+記録時の失敗とリトライも同じ順番で再生される。同じプロンプトの記録が複数ある場合は記録した順に返し、
+使い切った後は最後の記録を返し続ける。記録がないプロンプトは CassetteMissError になる。
+"""
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+
+from metrics import registry as metrics_registry
+
+CASSETTE_CALLS_TOTAL = metrics_registry.counter(
+    "llm_cassette_calls_total", "LLM calls recorded to or replayed from the cassette", ("outcome",))
+
+# 再生時に送出する例外クラス（エラーの種類の判定はクラス名で行うため、記録時と同じ名前のクラスを作る）
+_replayed_error_classes = {}
+
+_cassette = None
+_cassette_lock = threading.Lock()
+
+
+class CassetteMissError(LookupError):
+    """再生モードで、プロンプトに対応する記録がカセットにない"""
+
+
+def cassette_mode():
+    """環境変数LLM_CASSETTE_MODEから動作モード（off / record / replay）を返す"""
+    mode = os.getenv('LLM_CASSETTE_MODE', 'off').lower()
+    if mode not in ("off", "record", "replay"):
+        raise ValueError(f"LLM_CASSETTE_MODE must be off, record or replay: {mode}")
+    return mode
+
+
+def prompt_key(model, prompt):
+    """カセットの検索キー（モデル名とプロンプトのハッシュ）"""
+    return hashlib.sha256(f"{model}\0{prompt}".encode("utf-8")).hexdigest()
+
+
+def _replayed_error(name, message):
+    cls = _replayed_error_classes.get(name)
+    if cls is None:
+        cls = _replayed_error_classes[name] = type(name, (Exception,), {"__module__": __name__})
+    return cls(message)
+
+
+class Cassette:
+    """カセットファイル1つ分の記録。記録と再生はスレッドセーフ"""
+
+    def __init__(self, path=None, mode=None, timing=None):
+        self.path = path or os.getenv('LLM_CASSETTE_PATH', 'llm_cassette.jsonl.gz')
+        self.mode = mode or cassette_mode()
+        # instant: 待たずに返す / recorded: 記録したレイテンシどおりに待つ
+        self.timing = (timing or os.getenv('LLM_CASSETTE_TIMING', 'instant')).lower()
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._cursors = {}
+        self._stats = {"recorded": 0, "replayed": 0, "misses": 0, "recorded_seconds": 0.0}
+        # 記録モードで、このプロセスがカセットを作り直したかどうか
+        self._truncated = False
+        if self.mode == "replay":
+            self._load()
+
+    def _open(self, mode):
+        if self.path.endswith(".gz"):
+            return gzip.open(self.path, mode + "t", encoding="utf-8")
+        return open(self.path, mode, encoding="utf-8")
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f"LLM cassette not found: {self.path} (LLM_CASSETTE_MODE=record で記録してください)")
+        count = 0
+        with self._open("r") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries.setdefault(entry["key"], []).append(entry)
+                    count += 1
+        print(f"📼 LLMカセットを再生します: {self.path} ({count} 件, タイミング: {self.timing})")
+
+    def record(self, entry):
+        """呼び出し1回分の記録をカセットに追記する"""
+        line = json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n"
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # 最初の記録で前回の記録を消す（追記すると、再生時に前回の応答が先に返ってしまう）
+            with self._open("a" if self._truncated else "w") as f:
+                f.write(line)
+            self._truncated = True
+            self._stats["recorded"] += 1
+            self._stats["recorded_seconds"] += entry["latency"]
+        CASSETTE_CALLS_TOTAL.inc("recorded")
+
+    def next_entry(self, model, prompt):
+        """プロンプトに対応する次の記録を返す（ない場合は CassetteMissError）"""
+        key = prompt_key(model, prompt)
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                self._stats["misses"] += 1
+                CASSETTE_CALLS_TOTAL.inc("miss")
+                raise CassetteMissError(f"No recorded LLM response for prompt {key[:12]} ({model}) in {self.path}")
+            index = self._cursors.get(key, 0)
+            self._cursors[key] = index + 1
+            self._stats["replayed"] += 1
+        CASSETTE_CALLS_TOTAL.inc("replayed")
+        return entries[min(index, len(entries) - 1)]
+
+    def delay(self, seconds):
+        """再生時に待つ秒数（instant なら0）"""
+        return seconds if self.timing == "recorded" else 0.0
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, mode=self.mode, path=self.path, timing=self.timing,
+                        recorded_seconds=round(self._stats["recorded_seconds"], 3),
+                        prompts=len(self._entries))
+
+
+def get_cassette():
+    """プロセス内で共有するカセット（LLM_CASSETTE_PATH）を返す"""
+    global _cassette
+    with _cassette_lock:
+        if _cassette is None:
+            _cassette = Cassette()
+        return _cassette
+
+
+def cassette_stats():
+    """ヘルスチェック用のカセットの統計（LLM_CASSETTE_MODE=off の場合はNone）"""
+    return get_cassette().stats() if cassette_mode() != "off" else None
+
+
+def with_cassette(model_name, factory):
+    """
+    factory() でLLMクライアントを生成し、LLM_CASSETTE_MODE に応じて包んで返す。
+    replay の場合は factory を呼ばない（VertexAIの読み込み・認証・ネットワークが不要になる）
+    """
+    mode = cassette_mode()
+    if mode == "off":
+        return factory()
+    if mode == "replay":
+        return CassetteLLM(None, model_name, get_cassette())
+    llm = factory()
+    return CassetteLLM(llm, model_name, get_cassette()) if llm is not None else None
+
+
+class CassetteLLM:
+    """
+    LLMクライアントを包み、invoke / ainvoke / stream を記録または再生するLLM。
+    llm が None の場合は再生専用になる
+    """
+
+    def __init__(self, llm, model, cassette):
+        self.llm = llm
+        self.model = model
+        self.cassette = cassette
+
+    def invoke(self, prompt):
+        if self.llm is None:
+            entry = self.cassette.next_entry(self.model, prompt)
+            time.sleep(self.cassette.delay(entry["latency"]))
+            return self._replay(entry)
+        started = time.perf_counter()
+        try:
+            response = self.llm.invoke(prompt)
+        except Exception as e:
+            self._record(prompt, "", started, error=e)
+            raise
+        self._record(prompt, response, started)
+        return response
+
+    async def ainvoke(self, prompt):
+        """invoke の非同期版。記録したレイテンシを待つ間もイベントループをブロックしない"""
+        if self.llm is None:
+            entry = self.cassette.next_entry(self.model, prompt)
+            await asyncio.sleep(self.cassette.delay(entry["latency"]))
+            return self._replay(entry)
+        started = time.perf_counter()
+        try:
+            response = await self.llm.ainvoke(prompt)
+        except Exception as e:
+            self._record(prompt, "", started, error=e)
+            raise
+        self._record(prompt, response, started)
+        return response
+
+    def stream(self, prompt):
+        """断片ごとの到着時刻も記録し、再生時は同じ区切りで返す（invoke で記録した応答は1つの断片として返す）"""
+        if self.llm is None:
+            entry = self.cassette.next_entry(self.model, prompt)
+            chunks = entry.get("chunks") or [[entry["latency"], len(entry["response"])]]
+            position = 0
+            elapsed = 0.0
+            for offset, length in chunks:
+                time.sleep(self.cassette.delay(offset - elapsed))
+                elapsed = offset
+                yield entry["response"][position:position + length]
+                position += length
+            if entry.get("error"):
+                raise _replayed_error(*entry["error"])
+            return
+        started = time.perf_counter()
+        parts = []
+        chunks = []
+        try:
+            for chunk in self.llm.stream(prompt):
+                parts.append(chunk)
+                chunks.append([round(time.perf_counter() - started, 3), len(chunk)])
+                yield chunk
+        except Exception as e:
+            # 途中まで受け取った断片も記録し、再生時は同じ位置で失敗させる
+            self._record(prompt, "".join(parts), started, chunks=chunks, error=e)
+            raise
+        self._record(prompt, "".join(parts), started, chunks=chunks)
+
+    @staticmethod
+    def _replay(entry):
+        if entry.get("error"):
+            raise _replayed_error(*entry["error"])
+        return entry["response"]
+
+    def _record(self, prompt, response, started, chunks=None, error=None):
+        entry = {
+            "key": prompt_key(self.model, prompt),
+            "model": self.model,
+            "latency": round(time.perf_counter() - started, 3),
+            "response": response,
+        }
+        if chunks is not None:
+            entry["chunks"] = chunks
+        if error is not None:
+            entry["error"] = [type(error).__name__, str(error)]
+        self.cassette.record(entry)
@@ -0,0 +1,206 @@
+"""
+LLMクライアントの共有プール
+プロセス起動時に一度だけ認証とクライアント生成を行い、全リクエスト・全スレッドで再利用する。
+GCPの認証情報はバックグラウンドスレッドで有効期限前に更新する。
+google.auth と langchain_google_vertexai は読み込みに数秒かかるため、本番モードで初めて必要になった時点で読み込む。
+LLM_CASSETTE_MODE=record / replay の場合は、生成したクライアントをカセット（llm_cassette.py）で包む。
+"""
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+
+from llm_cassette import with_cassette
+
+DEFAULT_MODEL_NAME = "gemini-2.5-pro"
+# モデルルーティングで最初に試す、安価で高速なモデル
+DEFAULT_FAST_MODEL_NAME = "gemini-2.5-flash"
+
+
+def is_demo_mode():
+    """環境変数DEMO_MODEからデモモードかどうかを判定する"""
+    return os.getenv('DEMO_MODE', 'true').lower() == 'true'
+
+
+def model_tiers(model_name=None):
+    """
+    モデルルーティングで順に試すモデル名のリスト（高速なモデル -> 高性能なモデル）。
+    MODEL_ROUTING=false の場合や、LLM_FAST_MODEL_NAME が空または高性能なモデルと同じ場合は高性能なモデルだけを返す
+    """
+    model_name = model_name or os.getenv('LLM_MODEL_NAME', DEFAULT_MODEL_NAME)
+    if os.getenv('MODEL_ROUTING', 'true').lower() != 'true':
+        return [model_name]
+    fast_model_name = os.getenv('LLM_FAST_MODEL_NAME', DEFAULT_FAST_MODEL_NAME)
+    return [fast_model_name, model_name] if fast_model_name and fast_model_name != model_name else [model_name]
+
+
+def mode_label(demo_mode):
+    """メトリクスやヘルスチェックで使う実行モード名（demo / vertex）"""
+    return "demo" if demo_mode else "vertex"
+
+
+class LLMClientPool:
+    """
+    モード（デモ / VertexAI）とモデルごとにLLMクライアントを1つだけ保持するスレッドセーフなプール。
+    VertexAIではモデルルーティングで使うすべてのモデル（model_tiers）を事前生成する
+    """
+
+    def __init__(self, mock_factory, model_name=None, refresh_interval=None, refresh_margin=None):
+        self.mock_factory = mock_factory
+        self.model_name = model_name or os.getenv('LLM_MODEL_NAME', DEFAULT_MODEL_NAME)
+        self.model_names = model_tiers(self.model_name)
+        temperature = os.getenv('LLM_TEMPERATURE')
+        self.temperature = float(temperature) if temperature else None
+        # 認証情報の有効期限チェック間隔と、期限の何秒前に更新するか
+        self.refresh_interval = refresh_interval or int(os.getenv('LLM_CREDENTIAL_REFRESH_SECONDS', 300))
+        self.refresh_margin = refresh_margin or int(os.getenv('LLM_CREDENTIAL_REFRESH_MARGIN_SECONDS', 600))
+
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._credentials = None
+        self._project_id = None
+        self._warmed_at = {}
+        self._credentials_refreshed_at = None
+        self._last_error = None
+        self._stop_event = threading.Event()
+        self._refresher = None
+
+    def start(self, demo_mode):
+        """バックグラウンドでクライアントを事前生成し、認証情報の更新スレッドを起動する"""
+        threading.Thread(target=self._warm_up, args=(demo_mode,), name="llm-warmup", daemon=True).start()
+
+    def stop(self):
+        """認証情報の更新スレッドを停止する"""
+        self._stop_event.set()
+
+    def get(self, demo_mode, model_name=None):
+        """
+        生成済みのクライアントを返す。未生成の場合はその場で生成する（失敗時はNone）。
+        model_name を省略すると高性能なモデル（LLM_MODEL_NAME）を返す。デモモードでは model_name を無視する
+        """
+        key = self._client_key(demo_mode, model_name)
+        client = self._clients.get(key)
+        if client is not None:
+            return client
+
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = self._build(demo_mode, key[1])
+                if client is not None:
+                    self._clients[key] = client
+                    self._warmed_at[key] = datetime.now(timezone.utc).isoformat()
+            return client
+
+    def get_tiers(self, demo_mode):
+        """
+        モデルルーティング用の (モデル名, クライアント) のリストを返す（いずれかの生成に失敗した場合はNone）。
+        デモモードではモックLLMだけを返す
+        """
+        names = ["MockLLM"] if demo_mode else self.model_names
+        tiers = [(name, self.get(demo_mode, name)) for name in names]
+        return tiers if all(client is not None for _, client in tiers) else None
+
+    def is_warm(self, demo_mode):
+        return all(key in self._clients for key in self._tier_keys(demo_mode))
+
+    def status(self, demo_mode):
+        """ヘルスチェック用の状態を返す"""
+        keys = self._tier_keys(demo_mode)
+        return {
+            "mode": self._mode_key(demo_mode),
+            "state": "warm" if all(key in self._clients for key in keys) else "cold",
+            "model": "MockLLM" if demo_mode else self.model_name,
+            "routing": None if demo_mode else self.model_names,
+            "warmed_at": self._warmed_at.get(keys[-1]),
+            "credentials_refreshed_at": self._credentials_refreshed_at,
+            "last_error": self._last_error,
+        }
+
+    def model_identity(self, demo_mode):
+        """キャッシュキーなどに使う (モデル名, temperature) の組を返す"""
+        if demo_mode:
+            return "MockLLM", None
+        # ルーティングするモデルの組み合わせが変われば、生成される設計書も変わりうる
+        return ">".join(self.model_names), self.temperature
+
+    def _mode_key(self, demo_mode):
+        return mode_label(demo_mode)
+
+    def _client_key(self, demo_mode, model_name=None):
+        if demo_mode:
+            return self._mode_key(demo_mode), "MockLLM"
+        return self._mode_key(demo_mode), model_name or self.model_name
+
+    def _tier_keys(self, demo_mode):
+        if demo_mode:
+            return [self._client_key(demo_mode)]
+        return [self._client_key(demo_mode, name) for name in self.model_names]
+
+    def _warm_up(self, demo_mode):
+        if demo_mode:
+            self.get(demo_mode)
+        for model_name in ([] if demo_mode else self.model_names):
+            self.get(demo_mode, model_name)
+        if not demo_mode and self._credentials is not None and self._refresher is None:
+            self._refresher = threading.Thread(target=self._refresh_loop, name="llm-credential-refresh", daemon=True)
+            self._refresher.start()
+
+    def _build(self, demo_mode, model_name):
+        """実行モードに応じてLLMインスタンスを生成する（カセットの再生時は生成せず、記録から応答する）"""
+        return with_cassette(model_name, lambda: self._build_client(demo_mode, model_name))
+
+    def _build_client(self, demo_mode, model_name):
+        if demo_mode:
+            print("🤖 MockLLM (デモモード) を使用します。")
+            return self.mock_factory()
+
+        print(f"☁️  Google VertexAI (本番モード, {model_name}) を使用します。")
+        import google.auth
+        try:
+            from langchain_google_vertexai import VertexAI
+
+            # GCP認証情報の確認（2つ目以降のモデルは取得済みの認証情報を使う）
+            if self._credentials is None:
+                credentials, project_id = google.auth.default()
+                print(f"✅ GCP認証成功 (Project ID: {project_id})")
+                self._credentials = credentials
+                self._project_id = project_id
+            self._last_error = None
+
+            # VertexAIの初期化（取得済みの認証情報を使い回す）
+            params = {"model_name": model_name, "credentials": self._credentials, "project": self._project_id}
+            if self.temperature is not None:
+                params["temperature"] = self.temperature
+            return VertexAI(**params)
+        except google.auth.exceptions.DefaultCredentialsError:
+            print("❌ Google Cloud の認証情報が見つかりません。")
+            print("   gcloud auth application-default login を実行して認証してください。")
+            self._last_error = "DefaultCredentialsError"
+            return None
+        except Exception as e:
+            print(f"❌ VertexAIの初期化中にエラーが発生しました: {e}")
+            self._last_error = str(e)
+            return None
+
+    def _refresh_loop(self):
+        """有効期限が近づいた認証情報をリクエスト経路の外で更新する"""
+        while not self._stop_event.wait(self.refresh_interval):
+            try:
+                self._refresh_credentials_if_needed()
+            except Exception as e:
+                print(f"⚠️  GCP認証情報の更新に失敗しました: {e}")
+                self._last_error = str(e)
+
+    def _refresh_credentials_if_needed(self):
+        credentials = self._credentials
+        if credentials is None:
+            return
+        expiry = getattr(credentials, "expiry", None)
+        # google-authのexpiryはタイムゾーンなしのUTC
+        threshold = datetime.utcnow() + timedelta(seconds=self.refresh_margin)
+        if credentials.valid and expiry is not None and expiry > threshold:
+            return
+        import google.auth.transport.requests
+        credentials.refresh(google.auth.transport.requests.Request())
+        self._credentials_refreshed_at = datetime.now(timezone.utc).isoformat()
+        print("🔄 GCP認証情報を更新しました。")
@@ -0,0 +1,335 @@
+"""
+LLM呼び出しのリトライとヘッジ
+LLMクライアントを ResilientLLM で包むと、失敗した呼び出しをエラーの種類ごとのポリシーに従って
+ジッター付きの指数バックオフで再試行する。ヘッジを有効にすると、観測したレイテンシのp95を過ぎても
+応答がない呼び出しに対して同じリクエストをもう1つ送り、先に成功した方の結果を使う。
+リトライ・ヘッジの回数は呼び出し箇所ごとに /metrics と stats() で確認できる。
+"""
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from metrics import registry as metrics_registry
+
+# 例外クラス名 -> エラーの種類（google.api_core に依存しないよう、名前で判定する）
+ERROR_CLASSES = {
+    "ResourceExhausted": "quota",
+    "TooManyRequests": "quota",
+    "DeadlineExceeded": "timeout",
+    "TimeoutError": "timeout",
+    "ServiceUnavailable": "unavailable",
+    "InternalServerError": "unavailable",
+    "BadGateway": "unavailable",
+    "GatewayTimeout": "timeout",
+    "ConnectionError": "unavailable",
+}
+
+# エラーの種類ごとの既定のリトライポリシー（LLM_RETRY_POLICY にJSONで上書きできる）
+DEFAULT_RETRY_POLICIES = {
+    # クォータ超過は回復に時間がかかるため、長めに待つ
+    "quota": {"max_attempts": 4, "base_delay": 2.0, "max_delay": 20.0},
+    "timeout": {"max_attempts": 2, "base_delay": 1.0, "max_delay": 5.0},
+    "unavailable": {"max_attempts": 3, "base_delay": 0.5, "max_delay": 8.0},
+    # 上記以外（不正なリクエストなど）は再試行しても成功しないため、再試行しない
+    "other": {"max_attempts": 1, "base_delay": 0.0, "max_delay": 0.0},
+}
+
+RETRIES_TOTAL = metrics_registry.counter(
+    "llm_retries_total", "LLM calls retried after a failure", ("call_site", "error_class"))
+FAILURES_TOTAL = metrics_registry.counter(
+    "llm_failures_total", "LLM calls that failed after all retries", ("call_site", "error_class"))
+HEDGES_TOTAL = metrics_registry.counter(
+    "llm_hedges_total", "Hedged LLM requests (fired, and won by the hedge)", ("call_site", "outcome"))
+
+
+def classify_error(error):
+    """例外をエラーの種類（quota / timeout / unavailable / other）に分類する"""
+    for cls in type(error).__mro__:
+        if cls.__name__ in ERROR_CLASSES:
+            return ERROR_CLASSES[cls.__name__]
+    return "other"
+
+
+class RetryPolicy:
+    """エラーの種類ごとの最大試行回数と、フルジッター付き指数バックオフ"""
+
+    def __init__(self, policies=None):
+        self.policies = {name: dict(policy) for name, policy in DEFAULT_RETRY_POLICIES.items()}
+        overrides = policies if policies is not None else json.loads(os.getenv('LLM_RETRY_POLICY', '{}'))
+        for name, policy in overrides.items():
+            self.policies.setdefault(name, dict(DEFAULT_RETRY_POLICIES["other"])).update(policy)
+
+    def max_attempts(self, error_class):
+        return self.policies.get(error_class, self.policies["other"])["max_attempts"]
+
+    def backoff(self, error_class, attempt, rng=random):
+        """attempt 回目の失敗の後に待つ秒数（0〜指数的に増える上限の一様分布）"""
+        policy = self.policies.get(error_class, self.policies["other"])
+        return rng.uniform(0, min(policy["max_delay"], policy["base_delay"] * 2 ** (attempt - 1)))
+
+
+class HedgePolicy:
+    """ヘッジの設定。観測したレイテンシの percentile を過ぎたら2本目を送る"""
+
+    def __init__(self, enabled=None, percentile=None, min_samples=None, max_ratio=None, window=200):
+        self.enabled = enabled if enabled is not None else os.getenv('LLM_HEDGE_ENABLED', 'false').lower() == 'true'
+        self.percentile = percentile or float(os.getenv('LLM_HEDGE_PERCENTILE', 95))
+        # ヘッジの判断に必要な最小のサンプル数
+        self.min_samples = min_samples or int(os.getenv('LLM_HEDGE_MIN_SAMPLES', 20))
+        # 呼び出し全体のうちヘッジしてよい割合の上限（コストの上限）
+        self.max_ratio = max_ratio if max_ratio is not None else float(os.getenv('LLM_HEDGE_MAX_RATIO', 0.1))
+        self.window = window
+
+
+class _CallSiteState:
+    """呼び出し箇所ごとのレイテンシの観測値と統計"""
+
+    def __init__(self, window):
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=window)
+        self.stats = {"calls": 0, "succeeded": 0, "failed": 0, "retries": 0, "hedges_fired": 0, "hedges_won": 0}
+
+    def hedge_delay(self, hedge):
+        """ヘッジを送るまでの秒数。サンプル不足やヘッジ割合の上限に達している場合は None"""
+        with self.lock:
+            if len(self.latencies) < hedge.min_samples:
+                return None
+            if self.stats["hedges_fired"] >= hedge.max_ratio * max(1, self.stats["calls"]):
+                return None
+            values = sorted(self.latencies)
+        index = min(len(values) - 1, int(len(values) * hedge.percentile / 100))
+        return values[index]
+
+    def record(self, field, latency=None):
+        with self.lock:
+            self.stats[field] += 1
+            if latency is not None:
+                self.latencies.append(latency)
+
+
+_states = {}
+_states_lock = threading.Lock()
+_hedge_executor = None
+
+
+def _state(call_site, window):
+    with _states_lock:
+        state = _states.get(call_site)
+        if state is None:
+            state = _states[call_site] = _CallSiteState(window)
+        return state
+
+
+def _executor():
+    global _hedge_executor
+    with _states_lock:
+        if _hedge_executor is None:
+            _hedge_executor = ThreadPoolExecutor(
+                max_workers=int(os.getenv('LLM_HEDGE_WORKERS', 32)), thread_name_prefix="llm-hedge"
+            )
+        return _hedge_executor
+
+
+def resilience_stats():
+    """呼び出し箇所ごとの統計（呼び出し数、リトライ数、ヘッジ数など）を返す"""
+    with _states_lock:
+        states = dict(_states)
+    result = {}
+    for call_site, state in states.items():
+        with state.lock:
+            result[call_site] = dict(state.stats)
+    return result
+
+
+class ResilientLLM:
+    """
+    LLMクライアントを包み、invoke / ainvoke / stream にリトライとヘッジを加える。
+    limiter（acquire / acquire_async / try_acquire / release を持つ同時実行枠、admission.ConcurrencyLimiter など）を
+    渡すと、試行とヘッジの1回ごとに枠を確保・返却する。バックオフ中は枠を保持せず、
+    ヘッジは空き枠がすぐに確保できる場合だけ送る。
+    """
+
+    def __init__(self, llm, call_site, retry=None, hedge=None, limiter=None):
+        self.llm = llm
+        self.call_site = call_site
+        self.retry = retry or RetryPolicy()
+        self.hedge = hedge or HedgePolicy()
+        self.limiter = limiter
+        self._state = _state(call_site, self.hedge.window)
+
+    def invoke(self, prompt):
+        return self._with_retries(lambda: self._hedged_invoke(prompt))
+
+    async def ainvoke(self, prompt):
+        """invoke の非同期版。バックオフ中もイベントループをブロックしない"""
+        self._state.record("calls")
+        attempt = 0
+        while True:
+            attempt += 1
+            # 枠を確保できない場合は呼び出しの失敗ではないため、再試行せずにそのまま送出する
+            await self._acquire_async()
+            started = time.perf_counter()
+            try:
+                result = await self._hedged_ainvoke(prompt)
+            except Exception as e:
+                delay = self._on_failure(e, attempt)
+                await asyncio.sleep(delay)
+                continue
+            self._state.record("succeeded", time.perf_counter() - started)
+            return result
+
+    def stream(self, prompt):
+        """最初の断片を受け取る前の失敗だけを再試行する（出力済みの断片は取り消せないため）"""
+        self._state.record("calls")
+        attempt = 0
+        while True:
+            attempt += 1
+            self._acquire()
+            started = time.perf_counter()
+            try:
+                chunks = iter(self.llm.stream(prompt))
+                try:
+                    first = next(chunks)
+                except StopIteration:
+                    self._state.record("succeeded", time.perf_counter() - started)
+                    return
+                except Exception as e:
+                    error = e
+                else:
+                    yield first
+                    yield from chunks
+                    self._state.record("succeeded", time.perf_counter() - started)
+                    return
+            finally:
+                self._release(started)
+            time.sleep(self._on_failure(error, attempt))
+
+    def _with_retries(self, call):
+        self._state.record("calls")
+        attempt = 0
+        while True:
+            attempt += 1
+            self._acquire()
+            started = time.perf_counter()
+            try:
+                result = call()
+            except Exception as e:
+                time.sleep(self._on_failure(e, attempt))
+                continue
+            self._state.record("succeeded", time.perf_counter() - started)
+            return result
+
+    def _on_failure(self, error, attempt):
+        """再試行する場合は待つ秒数を返し、しない場合は例外をそのまま送出する"""
+        error_class = classify_error(error)
+        if attempt >= self.retry.max_attempts(error_class):
+            self._state.record("failed")
+            FAILURES_TOTAL.inc(self.call_site, error_class)
+            raise error
+        delay = self.retry.backoff(error_class, attempt)
+        self._state.record("retries")
+        RETRIES_TOTAL.inc(self.call_site, error_class)
+        print(f"🔁 [{self.call_site}] LLM呼び出しを再試行します ({error_class}, {attempt}回目の失敗, {delay:.1f}秒後): {error}")
+        return delay
+
+    def _hedged_invoke(self, prompt):
+        delay = self._state.hedge_delay(self.hedge) if self.hedge.enabled else None
+        if delay is None:
+            return self._invoke_and_release(prompt)
+
+        executor = _executor()
+        primary = executor.submit(self._invoke_and_release, prompt)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._try_acquire():
+            return primary.result()
+
+        self._fire_hedge()
+        hedge = executor.submit(self._invoke_and_release, prompt)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self._hedge_won()
+                    # 遅い方の呼び出しは取り消せないため、結果を捨てる
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    async def _hedged_ainvoke(self, prompt):
+        delay = self._state.hedge_delay(self.hedge) if self.hedge.enabled else None
+        if delay is None:
+            return await self._ainvoke_and_release(prompt)
+
+        primary = asyncio.ensure_future(self._ainvoke_and_release(prompt))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done or not self._try_acquire():
+            return await primary
+
+        self._fire_hedge()
+        hedge = asyncio.ensure_future(self._ainvoke_and_release(prompt))
+        pending = {primary, hedge}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self._hedge_won()
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # 非同期の場合は遅い方の呼び出しを取り消せる
+            for task in pending:
+                task.cancel()
+
+    def _invoke_and_release(self, prompt):
+        """
+        試行の開始時に確保した枠で1回呼び出し、終わったら枠を返す
+        （ヘッジに負けた遅い呼び出しも、完了した時点で枠を返す）
+        """
+        started = time.perf_counter()
+        try:
+            return self.llm.invoke(prompt)
+        finally:
+            self._release(started)
+
+    async def _ainvoke_and_release(self, prompt):
+        started = time.perf_counter()
+        try:
+            return await self.llm.ainvoke(prompt)
+        finally:
+            self._release(started)
+
+    def _acquire(self):
+        if self.limiter is not None:
+            self.limiter.acquire()
+
+    async def _acquire_async(self):
+        if self.limiter is not None:
+            await self.limiter.acquire_async()
+
+    def _try_acquire(self):
+        """ヘッジ用の枠。待たずに確保できない場合はヘッジを送らない"""
+        return self.limiter is None or self.limiter.try_acquire()
+
+    def _release(self, started):
+        if self.limiter is not None:
+            self.limiter.release(time.perf_counter() - started)
+
+    def _fire_hedge(self):
+        self._state.record("hedges_fired")
+        HEDGES_TOTAL.inc(self.call_site, "fired")
+
+    def _hedge_won(self):
+        self._state.record("hedges_won")
+        HEDGES_TOTAL.inc(self.call_site, "won")
@@ -0,0 +1,267 @@
+"""
+負荷試験用のLLMシミュレーター
+デモ用のモックLLMを包み、VertexAIに近い振る舞い（応答までの遅延、トークン単位のストリーミング速度、
+クォータ超過・タイムアウト・壊れたJSONの注入、エージェント数に応じた応答サイズ）を再現する。
+LLM_SIMULATOR=true のときにデモモードで有効になる。
+
+遅延のモデル:
+    応答時間 = 最初のトークンまでの遅延（分布からサンプリング） + 出力トークン数 / LLM_SIM_TOKENS_PER_SECOND
+    /metrics の design_llm_invoke_seconds を記録したファイルを LLM_SIM_LATENCY_HISTOGRAM に指定すると、
+    その分布から遅延を再生する（記録値は出力時間を含むため、LLM_SIM_TOKENS_PER_SECOND=0 と併用する）。
+"""
+import asyncio
+import json
+import math
+import os
+import random
+import re
+import time
+
+from json_stream import extract_json
+from prompt_budget import count_tokens
+
+
+# google.api_core は読み込みに時間がかかり、簡易版（simple_main.py）には含まれないため、同名の例外を用意する。
+# 呼び出し元はクラス名で分類する（llm_resilience.classify_error）ため、本物の例外と同じように扱われる
+class ResourceExhausted(Exception):
+    """クォータ超過（google.api_core.exceptions.ResourceExhausted 相当）"""
+
+
+class DeadlineExceeded(Exception):
+    """タイムアウト（google.api_core.exceptions.DeadlineExceeded 相当）"""
+
+
+STREAM_CHUNK_SIZE = 64
+_BUCKET_LINE = re.compile(r'^(\w+)_bucket\{(.*?)le="([^"]+)"\}\s+(\S+)')
+
+
+def simulator_enabled():
+    """環境変数LLM_SIMULATORからシミュレーターを使うかどうかを判定する"""
+    return os.getenv('LLM_SIMULATOR', 'false').lower() == 'true'
+
+
+def load_latency_histogram(path, metric="design_llm_invoke_seconds"):
+    """
+    記録済みの遅延分布を読み込み、(上限秒数, 件数) のリストを返す。
+    JSONファイル（秒数のリスト、または {"buckets": [[上限, 累積件数], ...]}）と、
+    /metrics の出力を保存したPrometheusテキスト（vertex モードの系列を優先）に対応する。
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        text = f.read()
+
+    if path.endswith(".json"):
+        data = json.loads(text)
+        if isinstance(data, list):
+            return [(float(sample), 1) for sample in sorted(data)]
+        cumulative = [(float(le), int(count)) for le, count in data["buckets"]]
+    else:
+        totals = {}
+        lines = [match for match in map(_BUCKET_LINE.match, text.splitlines()) if match and match.group(1) == metric]
+        if any('mode="vertex"' in match.group(2) for match in lines):
+            lines = [match for match in lines if 'mode="vertex"' in match.group(2)]
+        for match in lines:
+            le = float("inf") if match.group(3) == "+Inf" else float(match.group(3))
+            totals[le] = totals.get(le, 0) + float(match.group(4))
+        cumulative = sorted(totals.items())
+
+    buckets = []
+    previous = 0
+    for le, count in sorted(cumulative):
+        buckets.append((le, count - previous))
+        previous = count
+    if not any(count > 0 for _, count in buckets):
+        raise ValueError(f"No latency samples found in {path}")
+    return buckets
+
+
+class SimulatorConfig:
+    """シミュレーターの設定（環境変数 LLM_SIM_* から読み込む）"""
+
+    def __init__(self, latency_distribution=None, latency_median=None, latency_sigma=None,
+                 latency_histogram=None, tokens_per_second=None, quota_error_rate=None,
+                 timeout_rate=None, timeout_seconds=None, malformed_json_rate=None,
+                 agent_count=None, seed=None):
+        # fixed / uniform / lognormal / histogram
+        self.latency_distribution = latency_distribution or os.getenv('LLM_SIM_LATENCY_DIST', 'lognormal')
+        self.latency_median = _env_float(latency_median, 'LLM_SIM_LATENCY_MEDIAN_SECONDS', 4.0)
+        self.latency_sigma = _env_float(latency_sigma, 'LLM_SIM_LATENCY_SIGMA', 0.5)
+        self.latency_histogram = latency_histogram or os.getenv('LLM_SIM_LATENCY_HISTOGRAM')
+        self.tokens_per_second = _env_float(tokens_per_second, 'LLM_SIM_TOKENS_PER_SECOND', 80.0)
+        self.quota_error_rate = _env_float(quota_error_rate, 'LLM_SIM_QUOTA_ERROR_RATE', 0.0)
+        self.timeout_rate = _env_float(timeout_rate, 'LLM_SIM_TIMEOUT_RATE', 0.0)
+        self.timeout_seconds = _env_float(timeout_seconds, 'LLM_SIM_TIMEOUT_SECONDS', 30.0)
+        self.malformed_json_rate = _env_float(malformed_json_rate, 'LLM_SIM_MALFORMED_JSON_RATE', 0.0)
+        # エージェント数。"8" のような固定値か "3-12" のような範囲（0 または未指定ならモックの応答のまま）
+        self.agent_count = agent_count or os.getenv('LLM_SIM_AGENT_COUNT', '0')
+        seed = seed if seed is not None else os.getenv('LLM_SIM_SEED')
+        self.seed = int(seed) if seed not in (None, '') else None
+        if self.latency_histogram and latency_distribution is None and 'LLM_SIM_LATENCY_DIST' not in os.environ:
+            self.latency_distribution = 'histogram'
+
+    def to_dict(self):
+        return dict(vars(self))
+
+
+def _env_float(value, name, default):
+    return float(value) if value is not None else float(os.getenv(name, default))
+
+
+class _Plan:
+    """1回の呼び出しでの振る舞い（遅延と注入する障害）"""
+    __slots__ = ("first_token_seconds", "failure")
+
+    def __init__(self, first_token_seconds, failure):
+        self.first_token_seconds = first_token_seconds
+        # None / "quota" / "timeout" / "malformed"
+        self.failure = failure
+
+
+class SimulatedLLM:
+    """
+    モックLLMを包んで遅延と障害を注入するLLM。
+    invoke / stream / ainvoke は main.py の MockLLM（プロンプト -> ```json 付きのテキスト）、
+    generate_response は simple_main.py の SimpleMockLLM（要件 -> 設計書の辞書）と同じ使い方ができる。
+    """
+
+    def __init__(self, base, config=None):
+        self.base = base
+        self.config = config or SimulatorConfig()
+        self._random = random.Random(self.config.seed)
+        self._histogram = None
+        if self.config.latency_distribution == 'histogram':
+            self._histogram = load_latency_histogram(self.config.latency_histogram)
+        self.stats = {"calls": 0, "quota_errors": 0, "timeouts": 0, "malformed": 0}
+        print(f"🧪 LLMシミュレーターを使用します: {self.config.to_dict()}")
+
+    def invoke(self, prompt):
+        plan = self._plan()
+        time.sleep(self._failure_delay(plan))
+        self._raise_failure(plan)
+        text = self._render(self.base.invoke(prompt), plan)
+        time.sleep(plan.first_token_seconds + self._generation_seconds(text))
+        return text
+
+    async def ainvoke(self, prompt):
+        """invoke の非同期版。待機中にイベントループをブロックしない"""
+        plan = self._plan()
+        await asyncio.sleep(self._failure_delay(plan))
+        self._raise_failure(plan)
+        text = self._render(self.base.invoke(prompt), plan)
+        await asyncio.sleep(plan.first_token_seconds + self._generation_seconds(text))
+        return text
+
+    def stream(self, prompt):
+        """最初のトークンまで待ってから、設定されたトークン速度で断片を返す"""
+        plan = self._plan()
+        time.sleep(self._failure_delay(plan))
+        self._raise_failure(plan)
+        text = self._render(self.base.invoke(prompt), plan)
+        time.sleep(plan.first_token_seconds)
+        for i in range(0, len(text), STREAM_CHUNK_SIZE):
+            chunk = text[i:i + STREAM_CHUNK_SIZE]
+            time.sleep(self._generation_seconds(chunk))
+            yield chunk
+
+    def generate_response(self, requirement):
+        """SimpleMockLLM 互換。設計書の辞書を返す（壊れたJSONを注入した場合はJSONDecodeError）"""
+        plan = self._plan()
+        time.sleep(self._failure_delay(plan))
+        self._raise_failure(plan)
+        design = self._resize(self.base.generate_response(requirement), self._target_agent_count())
+        text = json.dumps(design, ensure_ascii=False, indent=2)
+        if plan.failure == "malformed":
+            text = self._corrupt(text)
+        time.sleep(plan.first_token_seconds + self._generation_seconds(text))
+        return json.loads(text)
+
+    def _plan(self):
+        config = self.config
+        roll = self._random.random()
+        failure = None
+        for name, rate in (("quota", config.quota_error_rate), ("timeout", config.timeout_rate),
+                           ("malformed", config.malformed_json_rate)):
+            if roll < rate:
+                failure = name
+                break
+            roll -= rate
+        self.stats["calls"] += 1
+        if failure is not None:
+            self.stats[{"quota": "quota_errors", "timeout": "timeouts", "malformed": "malformed"}[failure]] += 1
+        return _Plan(self._sample_latency(), failure)
+
+    def _sample_latency(self):
+        config = self.config
+        if config.latency_distribution == 'fixed':
+            return config.latency_median
+        if config.latency_distribution == 'uniform':
+            spread = config.latency_median * config.latency_sigma
+            return max(0.0, self._random.uniform(config.latency_median - spread, config.latency_median + spread))
+        if config.latency_distribution == 'histogram':
+            return self._sample_histogram()
+        return self._random.lognormvariate(math.log(config.latency_median), config.latency_sigma)
+
+    def _sample_histogram(self):
+        """バケットを件数で重み付けして選び、その範囲内で一様に遅延を選ぶ"""
+        buckets = self._histogram
+        bucket = self._random.choices(range(len(buckets)), weights=[count for _, count in buckets])[0]
+        upper = buckets[bucket][0]
+        lower = buckets[bucket - 1][0] if bucket > 0 else 0.0
+        if math.isinf(upper):
+            return lower
+        return self._random.uniform(lower, upper)
+
+    def _failure_delay(self, plan):
+        """タイムアウトを注入する場合は、タイムアウトするまで待つ"""
+        return self.config.timeout_seconds if plan.failure == "timeout" else 0.0
+
+    def _raise_failure(self, plan):
+        if plan.failure == "quota":
+            raise ResourceExhausted("429 Quota exceeded (simulated)")
+        if plan.failure == "timeout":
+            raise DeadlineExceeded(f"504 Deadline exceeded after {self.config.timeout_seconds:.0f}s (simulated)")
+
+    def _generation_seconds(self, text):
+        rate = self.config.tokens_per_second
+        return count_tokens(text) / rate if rate > 0 else 0.0
+
+    def _render(self, response, plan):
+        """モックの応答をエージェント数に合わせて拡大・縮小し、必要なら壊す"""
+        count = self._target_agent_count()
+        if count is not None:
+            design = self._resize(extract_json(response), count)
+            response = f"```json\n{json.dumps(design, ensure_ascii=False, indent=2)}\n```"
+        return self._corrupt(response) if plan.failure == "malformed" else response
+
+    def _target_agent_count(self):
+        spec = str(self.config.agent_count).strip()
+        if "-" in spec:
+            low, high = (int(part) for part in spec.split("-", 1))
+            return self._random.randint(low, high)
+        count = int(spec or 0)
+        return count if count > 0 else None
+
+    def _resize(self, design, count):
+        """required_agents を count 件にする（足りない分は既存のエージェントを番号付きで複製する）"""
+        agents = design.get("required_agents", [])
+        if count is None or not agents:
+            return design
+        resized = []
+        for i in range(count):
+            agent = dict(agents[i % len(agents)])
+            generation = i // len(agents)
+            if generation:
+                agent["agent_name"] = f"{agent.get('agent_name', 'Agent')} {generation + 1}"
+                agent["agent_type"] = f"{agent.get('agent_type', 'agent')}_{generation + 1}"
+            resized.append(agent)
+        return dict(design, required_agents=resized)
+
+    def _corrupt(self, text):
+        """途中で打ち切る、末尾にカンマを入れる、括弧を閉じないなどの壊れ方を再現する"""
+        kind = self._random.choice(("truncate", "trailing_comma", "unclosed"))
+        if kind == "truncate":
+            return text[:self._random.randint(len(text) // 3, len(text) * 2 // 3)]
+        if kind == "trailing_comma":
+            index = text.rfind("}")
+            return text[:index] + ",}" + text[index + 1:] if index != -1 else text
+        index = text.rfind("}")
+        return text[:index] + text[index + 1:] if index != -1 else text
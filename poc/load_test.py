@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""
+Platform Architect Agent の負荷試験ツール
+test_client.py と同じ POST / を、固定の並列度（クローズドループ）または
+一定の到着率（オープンループ、ポアソン到着）で送り続け、スループット・レイテンシのパーセンタイル・
+エラーの内訳・サーバー側のフェーズ別所要時間（Server-Timing ヘッダー）を集計する。
+結果はJSONに保存し、--baseline で過去の結果と比較できる。
+
+使い方:
+    # 起動済みのサーバーに並列度16で200件送る
+    python load_test.py --concurrency 16 --requests 200
+    # 毎秒5件の到着率で60秒間、要件のコーパスを使って送り、結果を保存する
+    python load_test.py --rate 5 --duration 60 --corpus requirements.txt --output results.json
+    # ネットワークを使わず、プロセス内のFlaskアプリとLLMシミュレーターに対して実行する
+    DEMO_MODE=true LLM_SIMULATOR=true python load_test.py --in-process --concurrency 32 --requests 300
+"""
+import argparse
+import itertools
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+
+from test_client import DEFAULT_URL, TEST_CASES, post_requirement
+
+PERCENTILES = (50, 95, 99)
+
+
+def load_corpus(path):
+    """要件のコーパスを読み込む（JSONの文字列リスト、または1行1要件のテキスト。# で始まる行は無視）"""
+    if path is None:
+        return list(TEST_CASES)
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith(".json"):
+            corpus = json.load(f)
+        else:
+            corpus = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+    if not corpus:
+        raise ValueError(f"Corpus is empty: {path}")
+    return corpus
+
+
+class RequirementSource:
+    """コーパスを順番に繰り返して要件を返す。unique=True の場合はキャッシュに当たらないよう通し番号を付ける"""
+
+    def __init__(self, corpus, unique=False, shuffle_seed=None):
+        corpus = list(corpus)
+        if shuffle_seed is not None:
+            random.Random(shuffle_seed).shuffle(corpus)
+        self._corpus = itertools.cycle(corpus)
+        self._counter = itertools.count(1)
+        self._lock = threading.Lock()
+        self.unique = unique
+
+    def next(self):
+        with self._lock:
+            requirement = next(self._corpus)
+            number = next(self._counter)
+        return f"{requirement}（負荷試験 #{number}）" if self.unique else requirement
+
+
+class HttpTarget:
+    """HTTPでサーバーに送信する。requests.Session はスレッドごとに持つ"""
+
+    def __init__(self, url, timeout):
+        self.url = url
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def send(self, requirement):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        response = post_requirement(requirement, url=self.url, timeout=self.timeout, session=session)
+        return response.status_code, response.headers, _json_or_none(response.text)
+
+    def describe(self):
+        return self.url
+
+
+class InProcessTarget:
+    """ネットワークを使わず、同じプロセス内の main.app（Flaskテストクライアント）に送信する"""
+
+    def __init__(self):
+        import main
+        self._client = main.app.test_client()
+
+    def send(self, requirement):
+        response = self._client.post('/', json={"business_requirements": requirement})
+        return response.status_code, response.headers, _json_or_none(response.get_data(as_text=True))
+
+    def describe(self):
+        return "in-process"
+
+
+def _json_or_none(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return None
+
+
+def parse_server_timing(value):
+    """Server-Timing ヘッダーを {フェーズ名: ミリ秒} に変換する"""
+    timings = {}
+    for part in (value or "").split(","):
+        name, _, params = part.strip().partition(";")
+        for param in params.split(";"):
+            key, _, duration = param.strip().partition("=")
+            if name and key == "dur":
+                try:
+                    timings[name] = float(duration)
+                except ValueError:
+                    pass
+    return timings
+
+
+def send_one(target, requirement, scheduled_at):
+    """1件送信して計測結果を返す。レイテンシは予定送信時刻から測る（送信の遅れも含める）"""
+    sample = {"requirement": requirement, "started_at": scheduled_at}
+    try:
+        status, headers, body = target.send(requirement)
+        sample["status"] = status
+        sample["cache"] = headers.get("X-Cache")
+        sample["server_timing"] = parse_server_timing(headers.get("Server-Timing"))
+        if status != 200:
+            error = body.get("error") if isinstance(body, dict) else None
+            sample["error"] = f"{status} {str(error or '')[:80]}".strip()
+    except requests.exceptions.Timeout:
+        sample.update(status=None, error="client_timeout")
+    except requests.exceptions.ConnectionError:
+        sample.update(status=None, error="connection_error")
+    except Exception as e:
+        sample.update(status=None, error=f"{type(e).__name__}: {str(e)[:80]}")
+    sample["latency_ms"] = round((time.perf_counter() - scheduled_at) * 1000, 2)
+    return sample
+
+
+def run_closed_loop(target, source, concurrency, total_requests=None, duration=None):
+    """concurrency 個のワーカーが、前のレスポンスを受け取るたびに次の要件を送る"""
+    samples = []
+    lock = threading.Lock()
+    issued = itertools.count()
+    deadline = time.perf_counter() + duration if duration else None
+
+    def worker():
+        while True:
+            if deadline is not None and time.perf_counter() >= deadline:
+                return
+            if total_requests is not None and next(issued) >= total_requests:
+                return
+            sample = send_one(target, source.next(), time.perf_counter())
+            with lock:
+                samples.append(sample)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples
+
+
+def run_open_loop(target, source, rate, total_requests=None, duration=None, max_in_flight=256, seed=None):
+    """
+    到着間隔を指数分布（平均 1/rate 秒）からサンプリングし、サーバーの応答を待たずに送る。
+    実行中のリクエストが max_in_flight に達している場合は送信せず、client_overload として記録する。
+    """
+    samples = []
+    lock = threading.Lock()
+    slots = threading.BoundedSemaphore(max_in_flight)
+    arrivals = random.Random(seed)
+    started = time.perf_counter()
+    next_arrival = started
+
+    def task(requirement, scheduled_at):
+        try:
+            sample = send_one(target, requirement, scheduled_at)
+        finally:
+            slots.release()
+        with lock:
+            samples.append(sample)
+
+    with ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="load-test") as executor:
+        for count in itertools.count():
+            if total_requests is not None and count >= total_requests:
+                break
+            if duration is not None and next_arrival - started >= duration:
+                break
+            delay = next_arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            requirement = source.next()
+            if slots.acquire(blocking=False):
+                executor.submit(task, requirement, next_arrival)
+            else:
+                with lock:
+                    samples.append({"requirement": requirement, "started_at": next_arrival, "status": None,
+                                    "error": "client_overload", "latency_ms": None})
+            next_arrival += arrivals.expovariate(rate)
+    return samples
+
+
+def percentile(sorted_values, p):
+    """ソート済みの値の p パーセンタイル（最近接順位法）"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def latency_summary(values):
+    values = sorted(values)
+    if not values:
+        return {"count": 0}
+    summary = {"count": len(values), "mean": round(sum(values) / len(values), 2), "min": values[0], "max": values[-1]}
+    for p in PERCENTILES:
+        summary[f"p{p}"] = percentile(values, p)
+    return summary
+
+
+def summarize(samples, elapsed):
+    """計測結果を集計する"""
+    succeeded = [sample for sample in samples if sample.get("status") == 200]
+    errors = {}
+    statuses = {}
+    caches = {}
+    phases = {}
+    for sample in samples:
+        status = str(sample.get("status"))
+        statuses[status] = statuses.get(status, 0) + 1
+        if sample.get("error"):
+            errors[sample["error"]] = errors.get(sample["error"], 0) + 1
+        if sample.get("cache"):
+            caches[sample["cache"]] = caches.get(sample["cache"], 0) + 1
+        for phase, duration in (sample.get("server_timing") or {}).items():
+            phases.setdefault(phase, []).append(duration)
+
+    return {
+        "total": len(samples),
+        "succeeded": len(succeeded),
+        "failed": len(samples) - len(succeeded),
+        "error_rate": round((len(samples) - len(succeeded)) / len(samples), 4) if samples else 0.0,
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round(len(samples) / elapsed, 3) if elapsed > 0 else 0.0,
+        "success_rps": round(len(succeeded) / elapsed, 3) if elapsed > 0 else 0.0,
+        "latency_ms": latency_summary([sample["latency_ms"] for sample in succeeded]),
+        "latency_ms_all": latency_summary([sample["latency_ms"] for sample in samples if sample.get("latency_ms") is not None]),
+        "status_counts": statuses,
+        "errors": dict(sorted(errors.items(), key=lambda item: -item[1])),
+        "cache": caches,
+        "server_timing_ms": {phase: latency_summary(values) for phase, values in sorted(phases.items())}
+    }
+
+
+def print_report(summary, baseline=None):
+    """集計結果を表示する。baseline（過去の結果のsummary）があれば差分も表示する"""
+
+    def delta(path):
+        if baseline is None:
+            return ""
+        current, previous = summary, baseline
+        for key in path:
+            current = (current or {}).get(key)
+            previous = (previous or {}).get(key)
+        if not isinstance(current, (int, float)) or not isinstance(previous, (int, float)) or not previous:
+            return ""
+        return f"  ({(current - previous) / previous * 100:+.1f}% vs baseline)"
+
+    print("\n📊 負荷試験の結果")
+    print("=" * 50)
+    print(f"リクエスト数: {summary['total']} (成功 {summary['succeeded']} / 失敗 {summary['failed']}, "
+          f"エラー率 {summary['error_rate'] * 100:.1f}%)")
+    print(f"経過時間: {summary['elapsed_seconds']}s")
+    print(f"スループット: {summary['throughput_rps']} req/s (成功 {summary['success_rps']} req/s)"
+          f"{delta(('success_rps',))}")
+    latency = summary["latency_ms"]
+    if latency["count"]:
+        print("レイテンシ（成功したリクエスト, ms）:")
+        for key in ("mean", "p50", "p95", "p99", "max"):
+            print(f"   {key:>4}: {latency[key]:>10.2f}{delta(('latency_ms', key))}")
+    print(f"ステータス: {summary['status_counts']}")
+    if summary["cache"]:
+        print(f"キャッシュ: {summary['cache']}")
+    if summary["errors"]:
+        print("エラーの内訳:")
+        for error, count in summary["errors"].items():
+            print(f"   {count:>6}  {error}")
+    if summary["server_timing_ms"]:
+        print("サーバー側の所要時間 (ms):")
+        for phase, values in summary["server_timing_ms"].items():
+            print(f"   {phase:<20} p50 {values['p50']:>9.2f}  p95 {values['p95']:>9.2f}  p99 {values['p99']:>9.2f}")
+    print("=" * 50)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="設計書生成サービス (POST /) の負荷試験ツール")
+    parser.add_argument("--url", default=DEFAULT_URL, help=f"送信先のURL (既定: {DEFAULT_URL})")
+    parser.add_argument("--in-process", action="store_true",
+                        help="ネットワークを使わず、このプロセス内の main.app に送信する（DEMO_MODE / LLM_SIMULATOR と併用）")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--concurrency", type=int, default=None, help="クローズドループの並列度（既定: 8）")
+    mode.add_argument("--rate", type=float, default=None, help="オープンループの到着率 (req/s)")
+    parser.add_argument("--requests", type=int, default=None, help="送信するリクエスト数（ウォームアップを除く）")
+    parser.add_argument("--duration", type=float, default=None, help="計測時間 (秒)")
+    parser.add_argument("--warmup", type=int, default=0, help="計測前に送るウォームアップのリクエスト数")
+    parser.add_argument("--corpus", default=None, help="要件のコーパス（.json の文字列リスト、または1行1要件のテキスト）")
+    parser.add_argument("--unique", action="store_true", help="要件に通し番号を付けて、完全一致のキャッシュに当たらないようにする"
+                             "（類似要件の再利用も避ける場合はサーバーを SEMANTIC_INDEX_ENABLED=false で起動する）")
+    parser.add_argument("--shuffle-seed", type=int, default=None, help="コーパスをシャッフルする場合のシード")
+    parser.add_argument("--timeout", type=float, default=60, help="1リクエストのタイムアウト (秒)")
+    parser.add_argument("--max-in-flight", type=int, default=256, help="オープンループで同時に送信中にできる最大数")
+    parser.add_argument("--seed", type=int, default=None, help="オープンループの到着間隔のシード")
+    parser.add_argument("--output", default=None, help="結果を保存するJSONファイル")
+    parser.add_argument("--save-samples", action="store_true", help="リクエストごとの計測結果も保存する")
+    parser.add_argument("--baseline", default=None, help="比較対象の過去の結果JSON")
+    args = parser.parse_args()
+
+    if args.requests is None and args.duration is None:
+        args.requests = 100
+    if args.rate is None and args.concurrency is None:
+        args.concurrency = 8
+
+    corpus = load_corpus(args.corpus)
+    source = RequirementSource(corpus, unique=args.unique, shuffle_seed=args.shuffle_seed)
+    target = InProcessTarget() if args.in_process else HttpTarget(args.url, args.timeout)
+
+    print("🏗️  Platform Architect Agent 負荷試験")
+    print(f"送信先: {target.describe()} / コーパス: {len(corpus)} 件")
+    if args.rate is not None:
+        print(f"オープンループ: {args.rate} req/s")
+    else:
+        print(f"クローズドループ: 並列度 {args.concurrency}")
+
+    if args.warmup:
+        print(f"🔥 ウォームアップ: {args.warmup} 件")
+        run_closed_loop(target, source, max(1, args.concurrency or 1), total_requests=args.warmup)
+
+    started = time.perf_counter()
+    if args.rate is not None:
+        samples = run_open_loop(target, source, args.rate, args.requests, args.duration, args.max_in_flight, args.seed)
+    else:
+        samples = run_closed_loop(target, source, args.concurrency, args.requests, args.duration)
+    elapsed = time.perf_counter() - started
+    summary = summarize(samples, elapsed)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f).get("summary")
+    print_report(summary, baseline)
+
+    if args.output:
+        result = {
+            "timestamp": datetime.now().isoformat(),
+            "target": target.describe(),
+            "config": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+            "environment": {key: value for key, value in os.environ.items()
+                            if key == "DEMO_MODE" or key.startswith(("LLM_", "DESIGN_CACHE_", "SEMANTIC_INDEX_"))},
+            "summary": summary
+        }
+        if args.save_samples:
+            result["samples"] = [dict(sample, started_at=round(sample["started_at"] - started, 4)) for sample in samples]
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"💾 結果を保存しました: {args.output}")
+
+    return 0 if summary["total"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,30 @@
 import os
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 from datetime import datetime
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify
-from langchain_google_vertexai import VertexAI
-from langchain.prompts import PromptTemplate
-import google.auth
+from flask import Flask, Response, request, jsonify, stream_with_context
 import re
 
+from admission import AdmissionRejectedError, ConcurrencyLimiter
+from circuit_breaker import CircuitBreaker, CircuitBreakerLLM, CircuitOpenError
+from design_cache import DesignCache
+from design_jobs import JobQueueFullError, JobRunner, JobStore
+from design_writer import DesignWriter
+from json_repair import extract_json_tolerant, json_repair_stats, record_parse
+from json_stream import IncrementalJSONExtractor, JSONExtractionError, extract_json
+from llm_cassette import cassette_stats
+from llm_client import LLMClientPool, is_demo_mode, mode_label
+from llm_resilience import ResilientLLM, classify_error, resilience_stats
+from llm_simulator import SimulatedLLM, simulator_enabled
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, registry as metrics_registry
+from model_router import RoutedLLM, routing_stats
+from prompt_budget import PromptSection, compact_json, prompt_budget
+from semantic_index import SemanticIndex
+from singleflight import SingleFlight
+
 # .envファイルから環境変数を読み込む (ローカル開発用)
 # GCPのCloud Runで実行する際は、環境変数はCloud Runのサービス設定から読み込まれます。
 load_dotenv()
@@ -65,59 +82,77 @@ AGENT_DESIGN_PROMPT = """
 - ビジネス要件に最適な技術スタックを提案してください
 """
 
-def save_generated_designs(design_data, timestamp, requirement):
-    """生成された設計書を日付とプロジェクト名のフォルダに分かりやすく整理して保存する"""
-    try:
-        # --- フォルダ名の設定 ---
-        date_str = datetime.now().strftime("%Y%m%d")
-        project_name = design_data.get("project_overview", {}).get("name", "Unnamed_Project")
-        
-        # ファイル名として使えるようにプロジェクト名をサニタイズ
-        # 英数字、アンダースコア、ハイフンのみを許可
-        safe_project_name = re.sub(r'[^\w\-]', '_', project_name)
-        
-        output_dir = f"{date_str}_{safe_project_name}"
-        os.makedirs(output_dir, exist_ok=True)
-
-        # --- ファイル名のマッピング定義 ---
-        agent_filename_map = {
-            "tech_lead": "01_architect",
-            "frontend_developer": "02_ui_ux_engineer",
-            "backend_developer": "03_api_data_engineer",
-            "ml_engineer": "04_ai_core_engineer",
-            "devops_engineer": "05_infra_cicd",
-            "qa_engineer": "06_quality_assurance",
-            # 必要に応じて他の役割も追加
-        }
+# 類似要件の既存設計を参考として渡す場合にプロンプトへ追記するセクション
+WARM_START_PROMPT_SUFFIX = """
+## 参考: 類似した過去の要件と設計書
+過去の要件「{reference_requirement}」に対して、以下の設計書が生成されています。
+今回のビジネス要件との差分を踏まえて、必要な部分を修正・追加した設計書を上記の出力形式で出力してください。
 
-        # --- プロジェクト概要ファイルの保存 ---
-        project_file = os.path.join(output_dir, "00_project_overview.json")
-        with open(project_file, 'w', encoding='utf-8') as f:
-            json.dump({
-                "timestamp": timestamp,
-                "business_requirement": requirement,
-                "project_overview": design_data.get("project_overview", {}),
-                "agents_count": len(design_data.get("required_agents", []))
-            }, f, ensure_ascii=False, indent=2)
-
-        # --- 各エージェントの設計書を保存 ---
-        agents = design_data.get("required_agents", [])
-        for i, agent in enumerate(agents):
-            agent_type = agent.get("agent_type", "unknown")
-            
-            # マップからファイル名を取得、なければデフォルト名を作成
-            base_name = agent_filename_map.get(agent_type, f"{str(i+1).zfill(2)}_{agent_type}")
-            
-            # 最終的なファイルパスを作成
-            agent_file = os.path.join(output_dir, f"{base_name}.md")
-            
-            with open(agent_file, 'w', encoding='utf-8') as f:
-                f.write(generate_agent_markdown(agent, timestamp, requirement))
-
-        print(f"Generated design documents saved in '{output_dir}/'")
+```json
+{reference_design}
+```
+"""
 
-    except Exception as e:
-        print(f"Error saving generated designs: {e}")
+# --- ファイル名のマッピング定義 ---
+AGENT_FILENAME_MAP = {
+    "tech_lead": "01_architect",
+    "frontend_developer": "02_ui_ux_engineer",
+    "backend_developer": "03_api_data_engineer",
+    "ml_engineer": "04_ai_core_engineer",
+    "devops_engineer": "05_infra_cicd",
+    "qa_engineer": "06_quality_assurance",
+    # 必要に応じて他の役割も追加
+}
+
+
+def design_output_dir(design_data):
+    """設計書の保存先フォルダ名（日付_プロジェクト名）を返す"""
+    date_str = datetime.now().strftime("%Y%m%d")
+    project_name = design_data.get("project_overview", {}).get("name", "Unnamed_Project")
+
+    # ファイル名として使えるようにプロジェクト名をサニタイズ
+    # 英数字、アンダースコア、ハイフンのみを許可
+    safe_project_name = re.sub(r'[^\w\-]', '_', project_name)
+    return f"{date_str}_{safe_project_name}"
+
+
+def render_design_files(design_data, timestamp, requirement, output_dir):
+    """保存する設計書ファイルの (パス, 内容) のリストを作成する"""
+    # --- プロジェクト概要ファイル ---
+    files = [(
+        os.path.join(output_dir, "00_project_overview.json"),
+        json.dumps({
+            "timestamp": timestamp,
+            "business_requirement": requirement,
+            "project_overview": design_data.get("project_overview", {}),
+            "agents_count": len(design_data.get("required_agents", []))
+        }, ensure_ascii=False, indent=2)
+    )]
+
+    # --- 各エージェントの設計書 ---
+    agents = design_data.get("required_agents", [])
+    for i, agent in enumerate(agents):
+        agent_type = agent.get("agent_type", "unknown")
+
+        # マップからファイル名を取得、なければデフォルト名を作成
+        base_name = AGENT_FILENAME_MAP.get(agent_type, f"{str(i+1).zfill(2)}_{agent_type}")
+        agent_file = os.path.join(output_dir, f"{base_name}.md")
+        files.append((agent_file, generate_agent_markdown(agent, timestamp, requirement)))
+
+    return files
+
+
+def save_generated_designs(design_data, timestamp, requirement):
+    """
+    生成された設計書を日付とプロジェクト名のフォルダに分かりやすく整理して保存する。
+    書き込みはバックグラウンドのライターに任せ、(保存先フォルダ, WriteTicket) をすぐに返す。
+    """
+    output_dir = design_output_dir(design_data)
+    ticket = design_writer.submit(
+        lambda: render_design_files(design_data, timestamp, requirement, output_dir),
+        label=output_dir
+    )
+    return output_dir, ticket
 
 
 def generate_agent_markdown(agent_data, timestamp, requirement):
@@ -170,30 +205,28 @@ def generate_agent_markdown(agent_data, timestamp, requirement):
 
 
 def get_llm(demo_mode):
-    """実行モードに応じてLLMインスタンスを返す"""
-    if demo_mode:
-        print("🤖 MockLLM (デモモード) を使用します。")
-        return MockLLM()
-    else:
-        print("☁️  Google VertexAI (本番モード) を使用します。")
-        try:
-            # GCP認証情報の確認
-            credentials, project_id = google.auth.default()
-            print(f"✅ GCP認証成功 (Project ID: {project_id})")
-
-            # VertexAIの初期化
-            return VertexAI(model_name="gemini-2.5-pro")
-        except google.auth.exceptions.DefaultCredentialsError:
-            print("❌ Google Cloud の認証情報が見つかりません。")
-            print("   gcloud auth application-default login を実行して認証してください。")
-            return None
-        except Exception as e:
-            print(f"❌ VertexAIの初期化中にエラーが発生しました: {e}")
-            return None
+    """
+    実行モードに応じて、起動時に生成済みのLLMインスタンスを返す（初期化に失敗した場合はNone）。
+    本番モードでは高速なモデルから試し、設計書の形式を満たさない場合だけ高性能なモデルに切り替える
+    """
+    tiers = llm_pool.get_tiers(demo_mode)
+    return RoutedLLM("design", tiers) if tiers is not None else None
 
 
 class MockLLM:
     """デモ用のモックLLMクラス"""
+
+    STREAM_CHUNK_SIZE = 64
+
+    async def ainvoke(self, prompt):
+        """invoke の非同期版（ASGIモード用）"""
+        return self.invoke(prompt)
+
+    def stream(self, prompt):
+        """モックレスポンスを一定の長さの断片に分けて返す"""
+        response = self.invoke(prompt)
+        for i in range(0, len(response), self.STREAM_CHUNK_SIZE):
+            yield response[i:i + self.STREAM_CHUNK_SIZE]
     
     def invoke(self, prompt):
         """モックレスポンスを返す"""
@@ -325,15 +358,615 @@ class MockLLM:
 }```'''
 
 
+def build_mock_llm():
+    """デモモードのLLMを生成する。LLM_SIMULATOR=true の場合は遅延と障害を注入するシミュレーターで包む"""
+    mock = MockLLM()
+    return SimulatedLLM(mock) if simulator_enabled() else mock
+
+
+# LLMクライアントはプロセス内で共有し、起動時にバックグラウンドで事前生成する
+llm_pool = LLMClientPool(mock_factory=build_mock_llm)
+llm_pool.start(demo_mode=is_demo_mode())
+
+# 同一要件の再送に備えた設計書キャッシュ（メモリLRU + ディスク）
+design_cache = DesignCache()
+
+# 言い換えられた要件を拾うためのローカルなセマンティックインデックス
+semantic_index = SemanticIndex()
+semantic_index.load()
+
+# 同一要件の同時リクエストをまとめるシングルフライト
+design_flight = SingleFlight()
+
+# 設計書ファイルはリクエストの外でバックグラウンド書き込みする
+design_writer = DesignWriter()
+
+# LLMの同時呼び出し数の上限と、上限付きの待ち行列
+llm_limiter = ConcurrencyLimiter()
+
+# VertexAIの障害時にタイムアウトまで待たずに失敗させるサーキットブレーカー
+design_breaker = CircuitBreaker("design")
+
+# /metrics で公開する設計書生成のメトリクス（mode ラベルは demo / vertex）
+LLM_INVOKE_SECONDS = metrics_registry.histogram(
+    "design_llm_invoke_seconds", "Latency of the LLM call for design generation", ("mode",))
+JSON_EXTRACTION_SECONDS = metrics_registry.histogram(
+    "design_json_extraction_seconds", "Time spent extracting JSON from the LLM response", ("mode",))
+SAVE_SECONDS = metrics_registry.histogram(
+    "design_save_seconds", "Time spent in save_generated_designs", ("mode",))
+REQUEST_SECONDS = metrics_registry.histogram(
+    "design_request_seconds", "Total time to produce a design response", ("mode",))
+REQUESTS_TOTAL = metrics_registry.counter(
+    "design_requests_total", "Design responses by cache outcome", ("mode", "cache"))
+ERRORS_TOTAL = metrics_registry.counter(
+    "design_errors_total", "Design generation failures by error type", ("mode", "type"))
+IN_FLIGHT = metrics_registry.gauge(
+    "design_requests_in_flight", "Design requests currently being processed", ("mode",))
+LLM_QUEUE_WAIT_SECONDS = metrics_registry.histogram(
+    "llm_queue_wait_seconds", "Time spent waiting for an LLM concurrency slot", ("mode",))
+LLM_ADMISSION_REJECTED = metrics_registry.counter(
+    "llm_admission_rejected_total", "LLM calls rejected by admission control", ("mode", "reason"))
+metrics_registry.gauge(
+    "llm_queue_depth", "Requests waiting for an LLM concurrency slot").set_function(llm_limiter.queue_depth)
+metrics_registry.gauge(
+    "llm_active_calls", "LLM calls currently holding a concurrency slot").set_function(llm_limiter.active_count)
+
+
+@app.route('/health', methods=['GET'])
+def health_check():
+    """ヘルスチェック。LLMクライアントの事前生成が完了するまでは503を返す"""
+    demo_mode = is_demo_mode()
+    llm_status = llm_pool.status(demo_mode)
+    warm = llm_status["state"] == "warm"
+    return jsonify({
+        "status": "healthy" if warm else "warming_up",
+        "timestamp": datetime.now().isoformat(),
+        "llm": llm_status,
+        "cache": design_cache.stats(),
+        "semantic_index": semantic_index.stats(),
+        "singleflight": design_flight.stats(),
+        "writer": design_writer.stats(),
+        "prompt_tokens": prompt_budget.stats(),
+        "llm_admission": llm_limiter.stats(),
+        "llm_resilience": resilience_stats(),
+        "llm_circuit": design_breaker.stats(),
+        "llm_routing": routing_stats(),
+        "json_repair": json_repair_stats(),
+        "llm_cassette": cassette_stats(),
+        "jobs": job_runner.stats()
+    }), 200 if warm else 503
+
+
+class DesignGenerationError(Exception):
+    """
+    設計書生成の失敗。HTTPステータス、エラー種別（メトリクス用）、LLMの生レスポンス、
+    再試行までの秒数（429の場合）を保持する
+    """
+
+    def __init__(self, message, status_code=500, raw_response=None, error_type="internal", retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.raw_response = raw_response
+        self.error_type = error_type
+        self.retry_after = retry_after
+
+    def to_dict(self):
+        body = {"error": str(self)}
+        if self.raw_response is not None:
+            body["raw_response"] = self.raw_response
+        if self.retry_after is not None:
+            body["retry_after"] = self.retry_after
+        return body
+
+    def headers(self):
+        """エラーレスポンスに付けるHTTPヘッダー"""
+        return {"Retry-After": str(self.retry_after)} if self.retry_after is not None else {}
+
+
+def extract_design_json(response):
+    """
+    LLMのレスポンスから ```json ブロックを抽出してパースする。
+    末尾のカンマや閉じ括弧の不足などはローカルで修復し、修復できない場合だけDesignGenerationErrorにする
+    """
+    try:
+        return extract_json_tolerant(response, "design")
+    except JSONExtractionError as e:
+        raise json_extraction_error(e, response)
+
+
+def json_extraction_error(error, response):
+    """JSONExtractionErrorを、ブロックが見つからない / パースできないを区別したDesignGenerationErrorに変換する"""
+    error_type = "json_decode_failure" if error.found_block else "json_extraction_failure"
+    return DesignGenerationError(str(error), raw_response=response, error_type=error_type)
+
+
+def lookup_design(business_requirement, demo_mode):
+    """
+    キャッシュとセマンティックインデックスを確認する。
+    (即時に返せる結果 or None, LLM生成に使うコンテキスト) を返す。
+    """
+    model_name, temperature = llm_pool.model_identity(demo_mode)
+    context = {
+        "cache_key": design_cache.make_key(business_requirement, AGENT_DESIGN_PROMPT, model_name, temperature),
+        "model_name": model_name,
+        "mode": mode_label(demo_mode),
+    }
+    cached = design_cache.get(context["cache_key"])
+    if cached is not None:
+        print("⚡ キャッシュ済みの設計書を返します。")
+        return {
+            "success": True,
+            "timestamp": cached["timestamp"],
+            "business_requirement": business_requirement,
+            "generated_design": cached["generated_design"],
+            "cache": "hit"
+        }, context
+
+    # 言い換えられた要件は、意味的に近い過去の設計書で代替するか、参考としてプロンプトに含める
+    verdict, similarity, match = semantic_index.lookup(business_requirement, model_name)
+    context.update(verdict=verdict, similarity=similarity, match=match)
+    if verdict == "serve":
+        print(f"🧭 類似要件の設計書を返します (類似度: {similarity:.3f})")
+        return {
+            "success": True,
+            "timestamp": datetime.now().strftime("%Y%m%d_%H%M%S"),
+            "business_requirement": business_requirement,
+            "generated_design": match["design"],
+            "cache": "semantic_hit",
+            "semantic_match": {"requirement": match["requirement"], "similarity": round(similarity, 4)}
+        }, context
+    return None, context
+
+
+def summarize_reference_design(design_json):
+    """参考設計書をプロジェクト概要とエージェントの名前・役割だけに要約する"""
+    design = json.loads(design_json)
+    return compact_json({
+        "project_overview": design.get("project_overview", {}),
+        "required_agents": [
+            {key: agent.get(key) for key in ("agent_name", "agent_type", "responsibility")}
+            for agent in design.get("required_agents", [])
+        ]
+    })
+
+
+def build_design_prompt(business_requirement, context):
+    """設計書生成用のプロンプトをトークン予算内で作成する"""
+    sections = {"business_requirement": PromptSection(business_requirement, priority=0)}
+    if context.get("verdict") != "warm_start":
+        return prompt_budget.build("design", AGENT_DESIGN_PROMPT, sections)
+
+    match = context["match"]
+    print(f"🧭 類似要件の設計書を参考にします (類似度: {context['similarity']:.3f})")
+    sections["reference_design"] = PromptSection(
+        compact_json(match["design"]), priority=1, summarize=summarize_reference_design
+    )
+    return prompt_budget.build(
+        "design", AGENT_DESIGN_PROMPT + WARM_START_PROMPT_SUFFIX, sections,
+        reference_requirement=match["requirement"]
+    )
+
+
+def elapsed_ms(started):
+    """perf_counter() の開始時刻からの経過ミリ秒"""
+    return round((time.perf_counter() - started) * 1000, 2)
+
+
+def server_timing_header(timings):
+    """timings（フェーズ名_ms -> ミリ秒）を Server-Timing ヘッダーの値に変換する"""
+    return ", ".join(f"{name.removesuffix('_ms')};dur={value}" for name, value in timings.items())
+
+
+def observe_phase(histogram, mode, started, timings, field):
+    """perf_counter() の開始時刻からの経過時間をヒストグラムと timings（ミリ秒）に記録する"""
+    seconds = time.perf_counter() - started
+    histogram.observe(seconds, mode)
+    if timings is not None:
+        timings[field] = round(seconds * 1000, 2)
+
+
+def admission_rejected_error(error, mode):
+    """AdmissionRejectedErrorを429のDesignGenerationErrorに変換する"""
+    LLM_ADMISSION_REJECTED.inc(mode, error.reason)
+    print(f"🚦 LLMの同時実行枠が空いていないため拒否しました ({error.reason}, Retry-After: {error.retry_after}s)")
+    return DesignGenerationError(str(error), status_code=429, error_type="admission_rejected", retry_after=error.retry_after)
+
+
+def llm_timeout_error(error):
+    """LLM呼び出しのタイムアウトを504のDesignGenerationErrorに変換する"""
+    return DesignGenerationError(f"LLM call timed out: {error}", status_code=504, error_type="llm_timeout")
+
+
+def quota_exceeded_error(error):
+    """VertexAIのクォータ超過を429のDesignGenerationErrorに変換する"""
+    return DesignGenerationError(
+        f"LLM quota exceeded: {error}", status_code=429, error_type="quota_exceeded",
+        retry_after=llm_limiter.retry_after()
+    )
+
+
+def llm_call_error(error):
+    """
+    LLM呼び出しの例外のうち、クォータ超過（429）とタイムアウト（504）をDesignGenerationErrorに変換する（それ以外はNone）。
+    google.api_core は読み込みに時間がかかるため、例外はクラス名で分類する
+    """
+    error_class = classify_error(error)
+    if error_class == "quota":
+        return quota_exceeded_error(error)
+    if error_class == "timeout":
+        return llm_timeout_error(error)
+    return None
+
+
+def circuit_open_error(error):
+    """回路が開いていて縮退応答も返せない場合の503のDesignGenerationError"""
+    return DesignGenerationError(
+        f"LLM is temporarily unavailable: {error}", status_code=503, error_type="circuit_open",
+        retry_after=error.retry_after
+    )
+
+
+def degraded_fallback_sources():
+    """
+    回路が開いているときに縮退応答に使う情報源（環境変数DEGRADED_FALLBACK、カンマ区切り）。
+    "cache"（類似要件の生成済み設計書）、"mock"（MockLLMの定型設計書）、"off"（縮退応答を返さない）
+    """
+    value = os.getenv('DEGRADED_FALLBACK', 'cache')
+    return [source.strip() for source in value.split(",") if source.strip() and source.strip() != "off"]
+
+
+def degraded_design(business_requirement, context, error):
+    """
+    回路が開いているときに、LLMを呼ばずに返す縮退応答を作る。
+    設計書はキャッシュにもセマンティックインデックスにも保存せず、レスポンスの "degraded" で縮退していることを示す。
+    使える情報源がない場合は503のDesignGenerationErrorを送出する。
+    """
+    for source in degraded_fallback_sources():
+        if source == "cache" and context.get("verdict") == "warm_start" and context["match"]["complete"]:
+            match = context["match"]
+            design_data = match["design"]
+            detail = {"requirement": match["requirement"], "similarity": round(context["similarity"], 4)}
+        elif source == "mock":
+            design_data = extract_json(MockLLM().invoke(business_requirement))
+            detail = None
+        else:
+            continue
+        print(f"🩹 LLMが利用できないため、縮退応答を返します (情報源: {source})")
+        result = {
+            "success": True,
+            "timestamp": datetime.now().strftime("%Y%m%d_%H%M%S"),
+            "business_requirement": business_requirement,
+            "generated_design": design_data,
+            "cache": "degraded",
+            "degraded": {"reason": str(error), "source": source, "retry_after": error.retry_after}
+        }
+        if detail is not None:
+            result["semantic_match"] = detail
+        return result
+    raise circuit_open_error(error)
+
+
+class LLMCallSlot:
+    """
+    ResilientLLM に渡す llm_limiter の同時実行枠。リトライの試行とヘッジの1回ごとに確保・返却されるため、
+    バックオフ中の待機は枠を占有せず、ヘッジで増えた上流への呼び出しも枠に数えられる。
+    枠が確保できない場合は429のDesignGenerationErrorを送出する。
+    """
+
+    def __init__(self, mode, timings=None):
+        self.mode = mode
+        self.timings = timings
+
+    def acquire(self):
+        try:
+            waited = llm_limiter.acquire()
+        except AdmissionRejectedError as e:
+            raise admission_rejected_error(e, self.mode)
+        self._observe_wait(waited)
+
+    async def acquire_async(self):
+        """acquire の非同期版。枠が空くまでイベントループをブロックせずに待つ"""
+        try:
+            waited = await llm_limiter.acquire_async()
+        except AdmissionRejectedError as e:
+            raise admission_rejected_error(e, self.mode)
+        self._observe_wait(waited)
+
+    def try_acquire(self):
+        return llm_limiter.try_acquire()
+
+    def release(self, duration=None):
+        llm_limiter.release(duration)
+
+    def _observe_wait(self, waited):
+        LLM_QUEUE_WAIT_SECONDS.observe(waited, self.mode)
+        if self.timings is not None:
+            # 再試行した場合は、試行ごとの待ち時間を合計する
+            self.timings["llm_queue_wait_ms"] = round(self.timings.get("llm_queue_wait_ms", 0) + waited * 1000, 2)
+
+
+@contextmanager
+def convert_llm_errors():
+    """リトライし尽くしたLLM呼び出しのクォータ超過・タイムアウトを、429・504のDesignGenerationErrorに変換する"""
+    try:
+        yield
+    except Exception as e:
+        converted = llm_call_error(e)
+        if converted is None:
+            raise
+        raise converted
+
+
+@contextmanager
+def track_design_request(demo_mode):
+    """実行中のリクエスト数、総所要時間、エラー種別ごとの失敗数を記録する"""
+    mode = mode_label(demo_mode)
+    started = time.perf_counter()
+    IN_FLIGHT.inc(mode)
+    try:
+        yield
+    except DesignGenerationError as e:
+        ERRORS_TOTAL.inc(mode, e.error_type)
+        raise
+    except Exception:
+        ERRORS_TOTAL.inc(mode, "internal")
+        raise
+    finally:
+        IN_FLIGHT.dec(mode)
+        REQUEST_SECONDS.observe(time.perf_counter() - started, mode)
+
+
+def finalize_design(business_requirement, design_data, context, timings=None):
+    """生成された設計書を保存・キャッシュし、レスポンス用の辞書を返す"""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    started = time.perf_counter()
+    output_dir, write_ticket = save_generated_designs(design_data, timestamp, business_requirement)
+    observe_phase(SAVE_SECONDS, context["mode"], started, timings, "save_ms")
+    design_cache.set(context["cache_key"], {"timestamp": timestamp, "generated_design": design_data})
+    semantic_index.add(business_requirement, design_data, context["model_name"], output_dir)
+
+    result = {
+        "success": True,
+        "timestamp": timestamp,
+        "business_requirement": business_requirement,
+        "generated_design": design_data,
+        "output_dir": output_dir,
+        "write_id": write_ticket.id,
+        "cache": "miss"
+    }
+    if context.get("verdict") == "warm_start":
+        match = context["match"]
+        result["semantic_match"] = {"requirement": match["requirement"], "similarity": round(context["similarity"], 4)}
+    return result
+
+
+def get_design_llm(demo_mode, slot=None):
+    """
+    設計書生成に使うLLMを、サーキットブレーカーとリトライ・ヘッジを行うラッパーで包んで返す
+    （VertexAIの初期化に失敗した場合はDesignGenerationError）。
+    ブレーカーは再試行の1回ごとに通すため、回路が開いた時点で残りの再試行も打ち切られる。
+    slot（LLMCallSlot）を渡すと、同時実行枠も再試行・ヘッジの1回ごとに確保する。
+    """
+    llm = get_llm(demo_mode)
+    if llm is None and not demo_mode:
+        raise DesignGenerationError("Failed to initialize VertexAI. Check authentication.", error_type="auth_failure")
+    return ResilientLLM(CircuitBreakerLLM(llm, design_breaker), "design", limiter=slot)
+
+
+def generate_design(business_requirement, demo_mode, timings=None):
+    """
+    ビジネス要件から設計書を生成し、レスポンス用の辞書を返す（失敗時はDesignGenerationError）。
+    timings に辞書を渡すと、フェーズごとの所要時間（ミリ秒）を記録する。
+    """
+    timings = timings if timings is not None else {}
+    with track_design_request(demo_mode):
+        started = time.perf_counter()
+        result, context = lookup_design(business_requirement, demo_mode)
+        timings["lookup_ms"] = elapsed_ms(started)
+        if result is None:
+            # 同じ要件の同時リクエストは1回のLLM呼び出しと保存フォルダを共有する
+            started = time.perf_counter()
+            result, shared = design_flight.do(
+                context["cache_key"],
+                lambda: _generate_design_with_llm(business_requirement, demo_mode, context, timings)
+            )
+            if shared:
+                timings["coalesced_wait_ms"] = elapsed_ms(started)
+                print("🔗 実行中の同一要件のLLM呼び出し結果を共有しました。")
+                result = dict(result, cache="coalesced")
+    REQUESTS_TOTAL.inc(context["mode"], result["cache"])
+    return result
+
+
+def _generate_design_with_llm(business_requirement, demo_mode, context, timings):
+    """LLMを呼び出して設計書を生成・保存する"""
+    # LLMを取得
+    llm = get_design_llm(demo_mode, LLMCallSlot(context["mode"], timings))
+
+    # プロンプトを作成して実行
+    prompt = build_design_prompt(business_requirement, context)
+
+    # LLMに問い合わせを実行（回路が開いている場合は、同時実行枠を待たずに縮退応答を返す）
+    print("Generating agent design documents...")
+    try:
+        design_breaker.reject_if_open()
+        with convert_llm_errors():
+            started = time.perf_counter()
+            response = llm.invoke(prompt)
+    except CircuitOpenError as e:
+        return degraded_design(business_requirement, context, e)
+    observe_phase(LLM_INVOKE_SECONDS, context["mode"], started, timings, "llm_invoke_ms")
+    prompt_budget.record_response("design", response)
+
+    # レスポンスからJSONを抽出
+    started = time.perf_counter()
+    design_data = extract_design_json(response)
+    observe_phase(JSON_EXTRACTION_SECONDS, context["mode"], started, timings, "json_extraction_ms")
+
+    # 生成された設計書を保存
+    return finalize_design(business_requirement, design_data, context, timings)
+
+
+def stream_design_events(business_requirement, demo_mode):
+    """設計書生成をServer-Sent Eventsとして逐次返すジェネレーター"""
+
+    def sse(event, data):
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    try:
+        with track_design_request(demo_mode):
+            result, context = lookup_design(business_requirement, demo_mode)
+            if result is None:
+                try:
+                    design_breaker.reject_if_open()
+                except CircuitOpenError as e:
+                    result = degraded_design(business_requirement, context, e)
+            if result is not None:
+                design = result["generated_design"]
+                yield sse("project_overview", design.get("project_overview", {}))
+                for index, agent in enumerate(design.get("required_agents", [])):
+                    yield sse("agent", {"index": index, "agent": agent})
+                REQUESTS_TOTAL.inc(context["mode"], result["cache"])
+                yield sse("done", result)
+                return
+
+            llm = get_design_llm(demo_mode, LLMCallSlot(context["mode"]))
+            prompt = build_design_prompt(business_requirement, context)
+
+            print("Streaming agent design documents...")
+            extractor = IncrementalJSONExtractor()
+            try:
+                with convert_llm_errors():
+                    started = time.perf_counter()
+                    for chunk in llm.stream(prompt):
+                        yield sse("token", {"text": chunk})
+                        for event in extractor.feed(chunk):
+                            if event[0] == "member" and event[1] == "project_overview":
+                                yield sse("project_overview", event[2])
+                            elif event[0] == "element" and event[1] == "required_agents":
+                                yield sse("agent", {"index": event[2], "agent": event[3]})
+            except CircuitOpenError as e:
+                # 半開状態の試行枠が埋まっていた場合（ストリームを始めた後は縮退応答に切り替えない）
+                raise circuit_open_error(e)
+            # ストリーミングではJSONの抽出がLLMの出力と並行するため、ストリーム全体をLLM呼び出し時間とする
+            observe_phase(LLM_INVOKE_SECONDS, context["mode"], started, None, None)
+
+            prompt_budget.record_response("design", extractor.text)
+            try:
+                design_data = extractor.close()
+                record_parse("design", "clean")
+            except JSONExtractionError:
+                # ストリームの途中で崩れていた場合は、応答全体を修復してパースし直す
+                design_data = extract_design_json(extractor.text)
+            result = finalize_design(business_requirement, design_data, context)
+            REQUESTS_TOTAL.inc(context["mode"], result["cache"])
+            yield sse("done", result)
+
+    except DesignGenerationError as e:
+        yield sse("error", dict(e.to_dict(), status=e.status_code))
+    except Exception as e:
+        print(f"Error in stream_design_events: {e}")
+        yield sse("error", {"error": f"Internal server error: {str(e)}", "status": 500})
+
+
+def wait_for_design_files(result, timeout=None):
+    """結果に対応する設計書ファイルの書き込み完了を待ち、書き込めたかどうかを返す"""
+    write_id = result.get("write_id")
+    if write_id is None:
+        return True
+    ticket = design_writer.get(write_id)
+    if ticket is None:
+        return True
+    timeout = timeout if timeout is not None else float(os.getenv('DESIGN_WRITER_WAIT_TIMEOUT', 30))
+    return ticket.wait(timeout) and ticket.error is None
+
+
+def generate_design_and_persist(business_requirement, demo_mode, timings=None):
+    """
+    設計書を生成し、ファイルの書き込み完了まで待ってから結果を返す（非同期ジョブ用）。
+    結果の辞書はシングルフライトでまとめた他のリクエストと共有しているため、書き換えずにコピーして返す
+    """
+    result = generate_design(business_requirement, demo_mode, timings)
+    return dict(result, files_written=wait_for_design_files(result))
+
+
+def run_batch_item(index, business_requirement, demo_mode):
+    """バッチの1件を実行し、成功・失敗にかかわらず結果の辞書を返す"""
+    started = time.perf_counter()
+    item = {"index": index, "business_requirement": business_requirement}
+    try:
+        if not isinstance(business_requirement, str) or not business_requirement.strip():
+            raise DesignGenerationError("business_requirements must be a non-empty string", status_code=400)
+        item.update(status=200, result=generate_design(business_requirement, demo_mode))
+    except DesignGenerationError as e:
+        item.update(status=e.status_code, error=e.to_dict())
+    except Exception as e:
+        print(f"Error in batch item {index}: {e}")
+        item.update(status=500, error={"error": f"Internal server error: {str(e)}"})
+    item["success"] = item["status"] == 200
+    item["elapsed_ms"] = elapsed_ms(started)
+    return item
+
+
+def run_batch(requirements, concurrency, demo_mode):
+    """要件のリストを上限付きの並列度で実行し、完了した順に結果を返すジェネレーター"""
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="design-batch") as executor:
+        futures = [
+            executor.submit(run_batch_item, index, requirement, demo_mode)
+            for index, requirement in enumerate(requirements)
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def parse_batch_request():
+    """バッチリクエストを検証し、(要件のリスト, 並列度) を返す（不正な場合はDesignGenerationError）"""
+    data = request.get_json(silent=True) or {}
+    requirements = data.get("business_requirements")
+    if not isinstance(requirements, list) or not requirements:
+        raise DesignGenerationError("business_requirements must be a non-empty list", status_code=400)
+
+    max_items = int(os.getenv('BATCH_MAX_ITEMS', 100))
+    if len(requirements) > max_items:
+        raise DesignGenerationError(f"Too many business_requirements (limit: {max_items})", status_code=400)
+
+    max_concurrency = int(os.getenv('BATCH_MAX_CONCURRENCY', 8))
+    try:
+        concurrency = int(data.get("concurrency", max_concurrency))
+    except (TypeError, ValueError):
+        raise DesignGenerationError("concurrency must be an integer", status_code=400)
+    return requirements, max(1, min(concurrency, max_concurrency, len(requirements)))
+
+
+def get_business_requirement():
+    """リクエストボディ（JSON / フォーム）からビジネス要件を取り出す"""
+    if request.is_json:
+        data = request.get_json()
+        return data.get("business_requirements")
+    return request.form.get("business_requirements")
+
+
+def wants_files_written():
+    """設計書ファイルの書き込み完了を待ってから応答するよう求められているか"""
+    value = request.args.get("wait_for_files")
+    if value is None and request.is_json:
+        value = (request.get_json(silent=True) or {}).get("wait_for_files")
+    if value is None:
+        value = request.form.get("wait_for_files")
+    return str(value).lower() in ("1", "true", "yes")
+
+
+# 非同期ジョブ（SQLiteに状態を保存し、上限付きのワーカープールで実行する）
+job_store = JobStore()
+job_runner = JobRunner(job_store, generate_design_and_persist)
+job_runner.recover()
+
+
 @app.route('/', methods=['POST'])
 def generate_designs():
     """ビジネス要件を受け取り、エージェントの設計図を生成する"""
     try:
-        if request.is_json:
-            data = request.get_json()
-            business_requirement = data.get("business_requirements")
-        else:
-            business_requirement = request.form.get("business_requirements")
+        business_requirement = get_business_requirement()
 
         if not business_requirement:
             return jsonify({"error": "business_requirements is required"}), 400
@@ -341,56 +974,169 @@ def generate_designs():
         print(f"Received requirement: {business_requirement}")
 
         # 環境変数からDEMO_MODEを取得
-        demo_mode = os.getenv('DEMO_MODE', 'true').lower() == 'true'
+        demo_mode = is_demo_mode()
 
-        # LLMを取得
-        llm = get_llm(demo_mode)
-        if llm is None and not demo_mode:
-            return jsonify({"error": "Failed to initialize VertexAI. Check authentication."}), 500
-
-        # プロンプトを作成して実行
-        prompt = AGENT_DESIGN_PROMPT.format(business_requirement=business_requirement)
+        timings = {}
+        try:
+            result = generate_design(business_requirement, demo_mode, timings)
+        except DesignGenerationError as e:
+            return jsonify(e.to_dict()), e.status_code, e.headers()
 
-        # LLMに問い合わせを実行
-        print("Generating agent design documents...")
-        response = llm.invoke(prompt)
+        if wants_files_written():
+            result = dict(result, files_written=wait_for_design_files(result))
 
-        # レスポンスからJSONを抽出
-        try:
-            json_start = response.find("```json")
-            json_end = response.find("```", json_start + 7)
-
-            if json_start != -1 and json_end != -1:
-                json_content = response[json_start + 7:json_end].strip()
-                design_data = json.loads(json_content)
-
-                # 生成された設計書を保存
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                save_generated_designs(design_data, timestamp, business_requirement)
-
-                return jsonify({
-                    "success": True,
-                    "timestamp": timestamp,
-                    "business_requirement": business_requirement,
-                    "generated_design": design_data
-                }), 200
-            else:
-                return jsonify({
-                    "error": "Could not extract JSON from LLM response",
-                    "raw_response": response
-                }), 500
-
-        except json.JSONDecodeError as e:
-            return jsonify({
-                "error": f"Invalid JSON in LLM response: {str(e)}",
-                "raw_response": response
-            }), 500
+        response = jsonify(result)
+        response.headers["X-Cache"] = result["cache"].upper()
+        response.headers["Server-Timing"] = server_timing_header(timings)
+        return response, 200
 
     except Exception as e:
         print(f"Error in generate_designs: {e}")
         return jsonify({"error": f"Internal server error: {str(e)}"}), 500
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheusのテキスト形式でメトリクスを返す"""
+    return Response(metrics_registry.render(), content_type=METRICS_CONTENT_TYPE)
+
+
+@app.route('/jobs', methods=['POST'])
+def create_design_job():
+    """設計書生成ジョブを登録し、ジョブIDをすぐに返す"""
+    business_requirement = get_business_requirement()
+    if not business_requirement:
+        return jsonify({"error": "business_requirements is required"}), 400
+
+    try:
+        job_id = job_runner.submit(business_requirement, is_demo_mode())
+    except JobQueueFullError as e:
+        return jsonify({"error": str(e)}), 429
+
+    print(f"Queued design job {job_id}: {business_requirement}")
+    status_url = f"/jobs/{job_id}"
+    return jsonify({"job_id": job_id, "status": "queued", "status_url": status_url}), 202, {"Location": status_url}
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_design_job(job_id):
+    """ジョブの状態・結果・所要時間の内訳を返す"""
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Job not found: {job_id}"}), 404
+
+    body = {
+        "job_id": job["id"],
+        "status": job["status"],
+        "business_requirement": job["business_requirement"],
+        "created_at": job["created_at"],
+        "started_at": job["started_at"],
+        "finished_at": job["finished_at"],
+        "timing": job["timing"]
+    }
+    if job["result"] is not None:
+        body["result"] = job["result"]
+    if job["error"] is not None:
+        body["error"] = job["error"]
+    return jsonify(body), 200
+
+
+@app.route('/batch', methods=['POST'])
+def generate_designs_batch():
+    """
+    複数のビジネス要件をまとめて受け取り、並列度を制限して設計書を生成する。
+    結果はリクエストと同じ順序で返し、失敗した要件は項目ごとにエラーを含める。
+    """
+    try:
+        requirements, concurrency = parse_batch_request()
+    except DesignGenerationError as e:
+        return jsonify(e.to_dict()), e.status_code
+
+    print(f"Received batch of {len(requirements)} requirements (concurrency: {concurrency})")
+    started = time.perf_counter()
+    results = sorted(run_batch(requirements, concurrency, is_demo_mode()), key=lambda item: item["index"])
+    succeeded = sum(1 for item in results if item["success"])
+    return jsonify({
+        "success": succeeded == len(results),
+        "total": len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "concurrency": concurrency,
+        "elapsed_ms": elapsed_ms(started),
+        "results": results
+    }), 200
+
+
+@app.route('/batch/stream', methods=['POST'])
+def stream_designs_batch():
+    """バッチ生成のストリーミング版 (Server-Sent Events)。完了した要件から順に item イベントを送る"""
+    try:
+        requirements, concurrency = parse_batch_request()
+    except DesignGenerationError as e:
+        return jsonify(e.to_dict()), e.status_code
+
+    print(f"Received batch stream of {len(requirements)} requirements (concurrency: {concurrency})")
+    demo_mode = is_demo_mode()
+
+    def events():
+        started = time.perf_counter()
+        succeeded = 0
+        for item in run_batch(requirements, concurrency, demo_mode):
+            succeeded += item["success"]
+            yield f"event: item\ndata: {json.dumps(item, ensure_ascii=False)}\n\n"
+        summary = {
+            "total": len(requirements),
+            "succeeded": succeeded,
+            "failed": len(requirements) - succeeded,
+            "concurrency": concurrency,
+            "elapsed_ms": elapsed_ms(started)
+        }
+        yield f"event: done\ndata: {json.dumps(summary, ensure_ascii=False)}\n\n"
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream', headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+
+@app.route('/writes/<write_id>', methods=['GET'])
+def get_design_write(write_id):
+    """設計書ファイルの書き込み状態を返す。?wait=秒数 を指定すると完了まで待つ"""
+    ticket = design_writer.get(write_id)
+    if ticket is None:
+        return jsonify({"error": f"Write not found: {write_id}"}), 404
+    wait = request.args.get("wait", type=float)
+    if wait:
+        ticket.wait(wait)
+    return jsonify(ticket.to_dict()), 200
+
+
+@app.route('/writes/flush', methods=['POST'])
+def flush_design_writes():
+    """予約済みの設計書ファイルの書き込みがすべて完了するまで待つ"""
+    timeout = request.args.get("timeout", default=30.0, type=float)
+    flushed = design_writer.flush(timeout)
+    return jsonify({"flushed": flushed, "writer": design_writer.stats()}), 200 if flushed else 504
+
+
+@app.route('/stream', methods=['POST'])
+def stream_designs():
+    """
+    設計書生成のストリーミング版 (Server-Sent Events)。
+    token（LLM出力の断片）、project_overview、agent（required_agentsの各要素）、done / error の順にイベントを送る。
+    """
+    business_requirement = get_business_requirement()
+    if not business_requirement:
+        return jsonify({"error": "business_requirements is required"}), 400
+
+    print(f"Received requirement (stream): {business_requirement}")
+    events = stream_design_events(business_requirement, is_demo_mode())
+    return Response(stream_with_context(events), mimetype='text/event-stream', headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
+
 if __name__ == '__main__':
     # .envファイルから環境変数を読み込む
     load_dotenv()
@@ -408,6 +1154,8 @@ if __name__ == '__main__':
     print(f"開発サーバーを http://127.0.0.1:{port} で起動します。")
     print("本番環境ではGunicornの使用を推奨します:")
     print(f"gunicorn --bind 0.0.0.0:{port} --workers 1 --threads 8 main:app")
+    print("多数の同時リクエストを1プロセスで扱う場合は非同期モードを使用してください:")
+    print(f"uvicorn asgi_main:app --host 0.0.0.0 --port {port}")
     print("--------------------------\n")
 
     app.run(host='0.0.0.0', port=port, debug=True)
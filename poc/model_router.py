@@ -0,0 +1,256 @@
+"""
+LLMのモデルルーティング
+呼び出しの種類（ルート）ごとに、安価で高速なモデルから順に試す。応答を期待する形式の検証関数にかけ、
+形式が不正な場合、確信度（検証関数が返す0〜1の値）が MODEL_ROUTER_MIN_CONFIDENCE 未満の場合、
+または再試行しても直らない種類の失敗（不正なリクエスト・未対応のモデルなど）の場合にだけ、
+次の（高性能な）モデルに切り替える。クォータ超過・タイムアウト・サービス停止などの一時的な失敗は切り替えずに送出し、
+外側のリトライ（llm_resilience.ResilientLLM）に任せる（再試行のたびに2つのモデルを呼ばないようにする）。
+ルートごとの切り替え率と、高速なモデルで済んだことによる短縮時間の推定値を /metrics と routing_stats() で確認できる。
+"""
+import os
+import threading
+import time
+
+from json_repair import parse_llm_json
+from json_stream import JSONExtractionError
+from llm_resilience import classify_error
+from metrics import registry as metrics_registry
+
+ROUTE_REQUESTS_TOTAL = metrics_registry.counter(
+    "llm_route_requests_total", "Routed LLM calls by the model tier that served them", ("route", "model"))
+ROUTE_ESCALATIONS_TOTAL = metrics_registry.counter(
+    "llm_route_escalations_total", "Routed LLM calls escalated to the next model", ("route", "reason"))
+ROUTE_LATENCY_SECONDS = metrics_registry.histogram(
+    "llm_route_latency_seconds", "Latency of each model tier call", ("route", "model"))
+
+# 設計書の各エージェントに期待する項目
+DESIGN_AGENT_FIELDS = ("agent_name", "agent_type", "responsibility", "skills", "autonomy_level", "main_functions")
+
+
+def validate_design(text):
+    """
+    設計書（project_overview と required_agents を持つJSON）の確信度。各エージェントの項目の充足率を使う。
+    ローカルで修復できる崩れは呼び出し元で直せるため、切り替えの理由にしない
+    """
+    try:
+        design, _ = parse_llm_json(text)
+    except JSONExtractionError:
+        return 0.0
+    overview = design.get("project_overview") if isinstance(design, dict) else None
+    agents = design.get("required_agents") if isinstance(design, dict) else None
+    if not isinstance(overview, dict) or not overview.get("name") or not isinstance(agents, list) or not agents:
+        return 0.0
+    filled = 0
+    for agent in agents:
+        if not isinstance(agent, dict):
+            continue
+        filled += sum(1 for field in DESIGN_AGENT_FIELDS if agent.get(field))
+        if agent.get("autonomy_level") not in ("L1", "L2", "L3"):
+            filled -= 1
+    return max(0.0, filled / (len(agents) * len(DESIGN_AGENT_FIELDS)))
+
+
+def validate_code_file(text):
+    """コーディングエージェントの応答（file_name と source_code を持つJSON）の確信度"""
+    try:
+        data, _ = parse_llm_json(text, require_fence=False)
+    except JSONExtractionError:
+        return 0.0
+    if not isinstance(data, dict) or not isinstance(data.get("file_name"), str) or not data["file_name"].strip():
+        return 0.0
+    source_code = data.get("source_code")
+    if not isinstance(source_code, str) or not source_code.strip():
+        return 0.0
+    # 数行に満たないコードは、指示を理解していない可能性が高い
+    return 1.0 if source_code.count("\n") >= 3 else 0.5
+
+
+def validate_markdown_report(text):
+    """マークダウン形式のレポートの確信度（見出しか箇条書きがあり、一定の長さがあるか）"""
+    if not isinstance(text, str) or not text.strip():
+        return 0.0
+    structured = any(line.lstrip().startswith(("#", "- ", "* ", "1.")) for line in text.splitlines())
+    if not structured:
+        return 0.5
+    return 1.0 if len(text) >= 200 else 0.5
+
+
+def validate_nonempty(text):
+    return 1.0 if isinstance(text, str) and text.strip() else 0.0
+
+
+# ルート名 -> 検証関数（未登録のルートは空でない応答なら合格）
+ROUTE_VALIDATORS = {
+    "design": validate_design,
+    "coding_agent": validate_code_file,
+    "security_report": validate_markdown_report,
+    "connection_test": validate_nonempty,
+}
+
+
+class _RouteState:
+    """ルートごとの統計。モデルごとの平均レイテンシから、高速なモデルで済んだ場合の短縮時間を推定する"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {"calls": 0, "served_by": {}, "escalations": {}, "failed": 0}
+        # モデル名 -> [呼び出し数, 合計秒数]
+        self.latency = {}
+        self.saved_seconds = 0.0
+        self.wasted_seconds = 0.0
+
+    def observe(self, model, seconds):
+        with self.lock:
+            count_total = self.latency.setdefault(model, [0, 0.0])
+            count_total[0] += 1
+            count_total[1] += seconds
+
+    def average(self, model):
+        count, total = self.latency.get(model, (0, 0.0))
+        return total / count if count else None
+
+    def snapshot(self, final_model):
+        with self.lock:
+            calls = self.stats["calls"]
+            escalated = sum(self.stats["escalations"].values())
+            return dict(
+                self.stats,
+                served_by=dict(self.stats["served_by"]),
+                escalations=dict(self.stats["escalations"]),
+                escalation_rate=round(escalated / calls, 3) if calls else 0.0,
+                average_latency_seconds={model: round(self.average(model), 3) for model in self.latency},
+                # 最上位のモデルだけを使った場合と比べた短縮時間（切り替えで余計にかかった時間を差し引く）
+                latency_saved_seconds=round(self.saved_seconds - self.wasted_seconds, 3),
+                final_model=final_model,
+            )
+
+
+_routes = {}
+_final_models = {}
+_routes_lock = threading.Lock()
+
+
+def _route_state(route):
+    with _routes_lock:
+        state = _routes.get(route)
+        if state is None:
+            state = _routes[route] = _RouteState()
+        return state
+
+
+def routing_stats():
+    """ルートごとの統計（モデルごとの処理件数、切り替え率、平均レイテンシ、短縮時間の推定値）を返す"""
+    with _routes_lock:
+        routes = dict(_routes)
+        final_models = dict(_final_models)
+    return {route: state.snapshot(final_models.get(route)) for route, state in routes.items()}
+
+
+class RoutedLLM:
+    """
+    複数のモデルを (モデル名, LLMクライアント) のリストで受け取り、先頭から順に試すLLM。
+    最後のモデルの応答は検証に通らなくてもそのまま返す（呼び出し元の既存のエラー処理に任せる）。
+    """
+
+    def __init__(self, route, tiers, validator=None, min_confidence=None):
+        if not tiers:
+            raise ValueError("RoutedLLM needs at least one model tier")
+        self.route = route
+        self.tiers = list(tiers)
+        self.validator = validator or ROUTE_VALIDATORS.get(route, validate_nonempty)
+        self.min_confidence = min_confidence if min_confidence is not None else float(
+            os.getenv('MODEL_ROUTER_MIN_CONFIDENCE', 0.8))
+        self._state = _route_state(route)
+        with _routes_lock:
+            _final_models[route] = self.tiers[-1][0]
+
+    @property
+    def model_names(self):
+        return [name for name, _ in self.tiers]
+
+    def invoke(self, prompt):
+        self._count("calls")
+        for index, (model, llm) in enumerate(self.tiers):
+            started = time.perf_counter()
+            try:
+                response = llm.invoke(prompt)
+            except Exception as e:
+                if self._escalate_on_error(index, model, started, e):
+                    continue
+                raise
+            if self._accept(index, model, started, response):
+                return response
+
+    async def ainvoke(self, prompt):
+        """invoke の非同期版"""
+        self._count("calls")
+        for index, (model, llm) in enumerate(self.tiers):
+            started = time.perf_counter()
+            try:
+                response = await llm.ainvoke(prompt)
+            except Exception as e:
+                if self._escalate_on_error(index, model, started, e):
+                    continue
+                raise
+            if self._accept(index, model, started, response):
+                return response
+
+    def stream(self, prompt):
+        """
+        ストリーミングでは検証前に断片を返してしまうため、切り替えを行わず最上位のモデルを使う
+        """
+        self._count("calls")
+        model, llm = self.tiers[-1]
+        started = time.perf_counter()
+        yield from llm.stream(prompt)
+        self._served(model, time.perf_counter() - started)
+
+    def _accept(self, index, model, started, response):
+        """応答を採用するかどうかを判断し、採用しない場合は切り替えを記録する"""
+        seconds = time.perf_counter() - started
+        ROUTE_LATENCY_SECONDS.observe(seconds, self.route, model)
+        self._state.observe(model, seconds)
+        if index == len(self.tiers) - 1:
+            self._served(model, seconds)
+            return True
+        confidence = self.validator(response)
+        if confidence >= self.min_confidence:
+            self._served(model, seconds)
+            return True
+        reason = "invalid" if confidence <= 0 else "low_confidence"
+        self._escalated(reason, seconds)
+        print(f"⤴️  [{self.route}] {model} の応答を採用せず、{self.tiers[index + 1][0]} に切り替えます "
+              f"({reason}, 確信度 {confidence:.2f})")
+        return False
+
+    def _escalate_on_error(self, index, model, started, error):
+        """
+        呼び出しの失敗時に次のモデルへ切り替えるかどうか。
+        最後のモデルの失敗と一時的な失敗（classify_error が other 以外）は呼び出し元に送出する
+        """
+        if index == len(self.tiers) - 1 or classify_error(error) != "other":
+            self._count("failed")
+            return False
+        self._escalated("error", time.perf_counter() - started)
+        print(f"⤴️  [{self.route}] {model} の呼び出しに失敗したため、{self.tiers[index + 1][0]} に切り替えます: {error}")
+        return True
+
+    def _served(self, model, seconds):
+        ROUTE_REQUESTS_TOTAL.inc(self.route, model)
+        state = self._state
+        with state.lock:
+            state.stats["served_by"][model] = state.stats["served_by"].get(model, 0) + 1
+            final_average = state.average(self.tiers[-1][0])
+            if model != self.tiers[-1][0] and final_average is not None:
+                state.saved_seconds += max(0.0, final_average - seconds)
+
+    def _escalated(self, reason, seconds):
+        ROUTE_ESCALATIONS_TOTAL.inc(self.route, reason)
+        state = self._state
+        with state.lock:
+            state.stats["escalations"][reason] = state.stats["escalations"].get(reason, 0) + 1
+            state.wasted_seconds += seconds
+
+    def _count(self, field):
+        with self._state.lock:
+            self._state.stats[field] += 1
@@ -0,0 +1,130 @@
+"""
+プロンプトのトークン予算管理
+すべてのLLM呼び出し箇所で共通に使うプロンプト組み立て層。
+送信前にトークン数を見積もり、JSONはコンパクトに直列化し、
+予算を超える場合は優先度の低いセクションから要約・切り詰めを行う。
+呼び出し箇所ごとにプロンプトと応答のトークン数を記録する。
+"""
+import json
+import os
+import threading
+
+TRUNCATION_MARKER = "\n...(トークン予算のため以下省略)..."
+
+
+def count_tokens(text):
+    """
+    トークン数を見積もる（API呼び出しなし）。
+    ASCII文字は約4文字で1トークン、日本語などの非ASCII文字は1文字で約1トークンとして数える。
+    """
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def compact_json(data):
+    """インデントや余分な空白を含まないJSON文字列を返す"""
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+def truncate_to_tokens(text, max_tokens):
+    """先頭から max_tokens に収まる長さに切り詰める"""
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    budget = max_tokens - count_tokens(TRUNCATION_MARKER)
+    if budget <= 0:
+        return ""
+    # 文字あたりのトークン数から長さを見積もり、超過している間は縮める
+    length = int(len(text) * budget / count_tokens(text))
+    while length > 0 and count_tokens(text[:length]) > budget:
+        length = int(length * 0.9)
+    return text[:length] + TRUNCATION_MARKER
+
+
+class PromptSection:
+    """プロンプトに埋め込むセクション。priority が小さいほど優先して残す"""
+
+    def __init__(self, text, priority=0, summarize=None):
+        """
+        Args:
+            text: セクションの本文。
+            priority: 予算超過時に削る順序（大きいものから削る）。
+            summarize: 予算に収まらない場合に本文を要約する関数（要約後も収まらなければ切り詰める）。
+        """
+        self.text = text
+        self.priority = priority
+        self.summarize = summarize
+
+
+class PromptBudget:
+    """トークン予算に収まるようにプロンプトを組み立て、呼び出し箇所ごとの統計を記録する"""
+
+    def __init__(self, max_tokens=None):
+        self.max_tokens = max_tokens or int(os.getenv('PROMPT_TOKEN_BUDGET', 32000))
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def build(self, call_site, template, sections, **fixed):
+        """
+        template.format(**fixed, **sections) を予算内に収めて返す。
+
+        Args:
+            call_site: 統計を記録する呼び出し箇所の名前。
+            template: str.format 形式のテンプレート。
+            sections: プレースホルダー名 -> PromptSection の辞書。
+            fixed: 削らずにそのまま埋め込む値。
+        """
+        texts = {name: section.text for name, section in sections.items()}
+        overhead = count_tokens(template.format(**fixed, **{name: "" for name in sections}))
+        remaining = self.max_tokens - overhead
+        truncated = []
+
+        for name, section in sorted(sections.items(), key=lambda item: item[1].priority):
+            tokens = count_tokens(texts[name])
+            if tokens > remaining and section.summarize is not None:
+                texts[name] = section.summarize(texts[name])
+                tokens = count_tokens(texts[name])
+                truncated.append(name)
+            if tokens > remaining:
+                texts[name] = truncate_to_tokens(texts[name], remaining)
+                tokens = count_tokens(texts[name])
+                if name not in truncated:
+                    truncated.append(name)
+            remaining -= tokens
+
+        prompt = template.format(**fixed, **texts)
+        if truncated:
+            print(f"✂️  [{call_site}] トークン予算 {self.max_tokens} に収めるためにセクションを縮小しました: {', '.join(truncated)}")
+        self._record(call_site, "prompt_tokens", count_tokens(prompt), truncated=bool(truncated))
+        return prompt
+
+    def record_prompt(self, call_site, prompt):
+        """build を使わずに組み立てたプロンプトのトークン数を記録する"""
+        self._record(call_site, "prompt_tokens", count_tokens(prompt))
+
+    def record_response(self, call_site, response):
+        """LLMの応答のトークン数を記録する"""
+        if isinstance(response, str):
+            self._record(call_site, "response_tokens", count_tokens(response), count_call=False)
+
+    def stats(self):
+        with self._lock:
+            return {site: dict(values) for site, values in self._stats.items()}
+
+    def _record(self, call_site, field, tokens, truncated=False, count_call=True):
+        with self._lock:
+            stats = self._stats.setdefault(call_site, {
+                "calls": 0, "truncated_calls": 0,
+                "prompt_tokens_total": 0, "prompt_tokens_max": 0,
+                "response_tokens_total": 0, "response_tokens_max": 0,
+            })
+            if count_call:
+                stats["calls"] += 1
+                stats["truncated_calls"] += int(truncated)
+            stats[f"{field}_total"] += tokens
+            stats[f"{field}_max"] = max(stats[f"{field}_max"], tokens)
+
+
+# プロセス内で共有する既定のインスタンス
+prompt_budget = PromptBudget()
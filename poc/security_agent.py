@@ -1,21 +1,67 @@
 import os
 import subprocess
 import json
-from langchain_core.language_models.llms import BaseLLM
+from typing import TYPE_CHECKING
+
+from llm_resilience import ResilientLLM
+from prompt_budget import PromptSection, compact_json, prompt_budget
+
+if TYPE_CHECKING:
+    # 型注釈専用。langchain_core の読み込みは重いため、実行時には読み込まない
+    from langchain_core.language_models.llms import BaseLLM
+
+SECURITY_REPORT_PROMPT = """
+以下のnpm auditのJSON結果を分析し、セキュリティ専門家として脆弱性の概要、リスク、および推奨される対策をマークダウン形式でまとめてください。
+重要な脆弱性があれば、特に焦点を当てて解説してください。
+
+**監査結果概要:**
+- クリティカル: {critical}
+- 高: {high}
+- 中: {moderate}
+- 低: {low}
+- 情報: {info}
+
+**監査結果(JSON):**
+```json
+{audit_json}
+```
+"""
+
+# 深刻度の高い順
+SEVERITY_ORDER = ["critical", "high", "moderate", "low", "info"]
+
+
+def summarize_audit_json(audit_json: str) -> str:
+    """
+    npm auditの結果を、深刻度順に並べた脆弱性ごとの要点（パッケージ・深刻度・影響範囲・修正可否）に要約します。
+    """
+    audit_data = json.loads(audit_json)
+    vulnerabilities = []
+    for name, vuln in audit_data.get("vulnerabilities", {}).items():
+        titles = [via.get("title") for via in vuln.get("via", []) if isinstance(via, dict) and via.get("title")]
+        vulnerabilities.append({
+            "name": name,
+            "severity": vuln.get("severity"),
+            "range": vuln.get("range"),
+            "titles": titles[:3],
+            "fixAvailable": bool(vuln.get("fixAvailable")),
+        })
+    vulnerabilities.sort(key=lambda v: SEVERITY_ORDER.index(v["severity"]) if v["severity"] in SEVERITY_ORDER else len(SEVERITY_ORDER))
+    return compact_json({"metadata": audit_data.get("metadata", {}), "vulnerabilities": vulnerabilities})
 
 class SecurityAgent:
     """
     生成されたコードのセキュリティ監査を担当するAIエージェント。
     """
 
-    def __init__(self, llm: BaseLLM):
+    def __init__(self, llm: "BaseLLM"):
         """
         SecurityAgentを初期化します。
 
         Args:
-            llm: エージェントが思考に使用する言語モデル。
+            llm: エージェントが思考に使用する言語モデル（リトライ付きで呼び出す）。
         """
-        self.llm = llm
+        self.llm = llm if isinstance(llm, ResilientLLM) else ResilientLLM(llm, "security_report")
         print("🤖 Security Agent initialized.")
 
     def run(self, project_path: str) -> str:
@@ -98,25 +144,16 @@ class SecurityAgent:
 
         summary = audit_data.get("metadata", {}).get("vulnerabilities", {})
         
-        prompt = f"""
-        以下のnpm auditのJSON結果を分析し、セキュリティ専門家として脆弱性の概要、リスク、および推奨される対策をマークダウン形式でまとめてください。
-        重要な脆弱性があれば、特に焦点を当てて解説してください。
-
-        **監査結果概要:**
-        - クリティカル: {summary.get('critical', 0)}
-        - 高: {summary.get('high', 0)}
-        - 中: {summary.get('moderate', 0)}
-        - 低: {summary.get('low', 0)}
-        - 情報: {summary.get('info', 0)}
-
-        **監査結果(JSON):**
-        ```json
-        {json.dumps(audit_data, indent=2)}
-        ```
-        """
+        prompt = prompt_budget.build(
+            "security_report",
+            SECURITY_REPORT_PROMPT,
+            {"audit_json": PromptSection(compact_json(audit_data), priority=0, summarize=summarize_audit_json)},
+            **{severity: summary.get(severity, 0) for severity in SEVERITY_ORDER}
+        )
         
         print(f"... asking LLM to generate report for {title}")
         response = self.llm.invoke(prompt)
+        prompt_budget.record_response("security_report", response)
         
         report_section = f"### {title} Analysis\n\n"
         report_section += f"Found **{summary.get('total', 0)}** total vulnerabilities ({summary.get('critical', 0)} critical, {summary.get('high', 0)} high).\n\n"
@@ -126,10 +163,14 @@ class SecurityAgent:
 
 if __name__ == '__main__':
     # このエージェントを直接実行した場合のテスト用コード
-    from langchain_community.llms.vertexai import VertexAI
-    
-    # VertexAIのラッパーを使用
-    llm = VertexAI(model_name="gemini-2.5-pro")
+    from llm_cassette import with_cassette
+
+    def build_vertex_ai():
+        from langchain_community.llms.vertexai import VertexAI
+        return VertexAI(model_name="gemini-2.5-pro")
+
+    # VertexAIのラッパーを使用（LLM_CASSETTE_MODE=record / replay で応答を記録・再生する）
+    llm = with_cassette("gemini-2.5-pro", build_vertex_ai)
 
     # テスト対象のプロジェクトパスを指定
     # この例では、AIが生成したプロジェクトの一つを指していると仮定
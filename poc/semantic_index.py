@@ -0,0 +1,170 @@
+"""
+ビジネス要件の意味的な近似検索
+言い換えられた要件（例: 「ログイン機能付きのブログサイト」と「ブログサイト（ログインあり）」）を
+完全一致キャッシュの外側で拾うための、ローカルで完結するベクトルインデックス。
+埋め込みは文字種ごとの語とその文字bigramをハッシュしたベクトルで、外部APIを使わない。
+"""
+import glob
+import hashlib
+import json
+import os
+import re
+import threading
+import unicodedata
+
+import numpy as np
+
+# 文字種の連続（カタカナ語・漢字語・英数字語・ひらがな）で要件を分割する
+_TOKEN_PATTERN = re.compile(r"[゠-ヿー]+|[一-鿿々]+|[a-z0-9]+|[぀-ゟ]+")
+_HIRAGANA_PATTERN = re.compile(r"^[぀-ゟ]+$")
+
+
+def tokenize(text):
+    """要件文字列を特徴量（語と語内の文字bigram）のリストに変換する"""
+    text = unicodedata.normalize("NFKC", text).lower()
+    features = []
+    for token in _TOKEN_PATTERN.findall(text):
+        # 「の」「あり」などの短いひらがなは助詞・補助語として除外する
+        if _HIRAGANA_PATTERN.match(token) and len(token) <= 2:
+            continue
+        features.append(token)
+        features.extend(token[i:i + 2] for i in range(len(token) - 1))
+    return features
+
+
+class HashingEmbedder:
+    """特徴量をハッシュトリックで固定長ベクトルに射影する埋め込みモデル"""
+
+    def __init__(self, dimensions=1024):
+        self.dimensions = dimensions
+
+    def embed(self, text):
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for feature in tokenize(text):
+            digest = hashlib.md5(feature.encode("utf-8")).digest()
+            index = int.from_bytes(digest[:4], "little") % self.dimensions
+            sign = 1.0 if digest[4] & 1 else -1.0
+            vector[index] += sign
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+
+def normalize_output_dir(path):
+    """
+    保存先ディレクトリを比較用に正規化する（カレントディレクトリからの相対パス）。
+    glob の結果（"./20250914_X"）と、finalize_design が渡す値（"20250914_X"）を同じものとして扱うため
+    """
+    return os.path.normpath(os.path.relpath(path)) if path else path
+
+
+class SemanticIndex:
+    """過去の要件と設計書を保持し、コサイン類似度で最も近いものを返すインデックス（NumPy総当たり）"""
+
+    def __init__(self, index_path=None, serve_threshold=None, warm_start_threshold=None, embedder=None):
+        self.index_path = index_path or os.getenv('SEMANTIC_INDEX_PATH', '.semantic_index.jsonl')
+        self.serve_threshold = serve_threshold or float(os.getenv('SEMANTIC_SERVE_THRESHOLD', 0.85))
+        self.warm_start_threshold = warm_start_threshold or float(os.getenv('SEMANTIC_WARM_START_THRESHOLD', 0.6))
+        self.enabled = os.getenv('SEMANTIC_INDEX_ENABLED', 'true').lower() == 'true'
+        self.embedder = embedder or HashingEmbedder(int(os.getenv('SEMANTIC_INDEX_DIMENSIONS', 1024)))
+
+        self._lock = threading.Lock()
+        self._entries = []
+        self._vectors = []
+        self._matrix = None
+        self._stats = {"semantic_hits": 0, "warm_starts": 0, "misses": 0}
+
+    def load(self, designs_root="."):
+        """永続化済みのインデックスと、保存済みの 00_project_overview.json を読み込む"""
+        if not self.enabled:
+            return
+        seen = set()
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+                    self._append(entry)
+                    seen.add(normalize_output_dir(entry.get("output_dir")))
+
+        # インデックス導入前に保存された設計書は、プロジェクト概要のみ（warm-start用）として登録する
+        for overview_file in glob.glob(os.path.join(designs_root, "*", "00_project_overview.json")):
+            output_dir = normalize_output_dir(os.path.dirname(overview_file))
+            if output_dir in seen:
+                continue
+            try:
+                with open(overview_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if not data.get("business_requirement"):
+                continue
+            self._append({
+                "requirement": data["business_requirement"],
+                "design": {"project_overview": data.get("project_overview", {})},
+                "complete": False,
+                "model": None,
+                "output_dir": output_dir,
+            })
+        print(f"🧭 セマンティックインデックスに {len(self._entries)} 件の要件を読み込みました。")
+
+    def add(self, requirement, design, model, output_dir=None):
+        """生成済みの設計書をインデックスに追加し、ファイルに追記する"""
+        if not self.enabled:
+            return
+        entry = {
+            "requirement": requirement,
+            "design": design,
+            "complete": True,
+            "model": model,
+            "output_dir": normalize_output_dir(output_dir),
+        }
+        with self._lock:
+            self._append(entry)
+            try:
+                with open(self.index_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            except OSError as e:
+                print(f"⚠️  セマンティックインデックスの保存に失敗しました: {e}")
+
+    def lookup(self, requirement, model):
+        """
+        最も近い過去の要件を探し、(判定, 類似度, エントリ) を返す。
+        判定は "serve"（保存済み設計をそのまま返す）、"warm_start"（参考としてプロンプトに含める）、"miss" のいずれか。
+        """
+        if not self.enabled:
+            return "miss", 0.0, None
+
+        query = self.embedder.embed(requirement)
+        with self._lock:
+            if not self._entries:
+                self._stats["misses"] += 1
+                return "miss", 0.0, None
+            if self._matrix is None:
+                self._matrix = np.vstack(self._vectors)
+            scores = self._matrix @ query
+            best = int(np.argmax(scores))
+            score = float(scores[best])
+            entry = self._entries[best]
+
+            if score >= self.serve_threshold and entry["complete"] and entry["model"] == model:
+                self._stats["semantic_hits"] += 1
+                return "serve", score, entry
+            if score >= self.warm_start_threshold:
+                self._stats["warm_starts"] += 1
+                return "warm_start", score, entry
+            self._stats["misses"] += 1
+            return "miss", score, None
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries))
+
+    def _append(self, entry):
+        self._entries.append(entry)
+        self._vectors.append(self.embedder.embed(entry["requirement"]))
+        self._matrix = None
@@ -8,6 +8,8 @@ import json
 from datetime import datetime
 from flask import Flask, request, jsonify
 
+from llm_simulator import DeadlineExceeded, ResourceExhausted, SimulatedLLM, simulator_enabled
+
 # Flaskアプリケーションのインスタンスを作成
 app = Flask(__name__)
 
@@ -183,8 +185,8 @@ class SimpleMockLLM:
             ]
         }
 
-# モックLLMインスタンス
-mock_llm = SimpleMockLLM()
+# モックLLMインスタンス（LLM_SIMULATOR=true の場合は遅延と障害を注入するシミュレーターで包む）
+mock_llm = SimulatedLLM(SimpleMockLLM()) if simulator_enabled() else SimpleMockLLM()
 
 @app.route("/", methods=["POST"])
 def generate_design_document():
@@ -215,7 +217,13 @@ def generate_design_document():
             "generated_design": design_data,
             "mode": "simplified_mock"
         }), 200
-            
+
+    except ResourceExhausted as e:
+        return jsonify({"error": f"LLM quota exceeded: {str(e)}"}), 429
+    except DeadlineExceeded as e:
+        return jsonify({"error": f"LLM call timed out: {str(e)}"}), 504
+    except json.JSONDecodeError as e:
+        return jsonify({"error": f"Invalid JSON in LLM response: {str(e)}"}), 500
     except Exception as e:
         print(f"Error in generate_design_document: {e}")
         return jsonify({"error": f"Internal server error: {str(e)}"}), 500
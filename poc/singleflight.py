@@ -0,0 +1,57 @@
+"""
+同一キーの同時実行をまとめるシングルフライト
+同じ要件に対する同時リクエストは、先に到着したリクエストのLLM呼び出し1回の結果を共有する。
+"""
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """キーごとに実行中の呼び出しを1つに制限し、後続の呼び出しはその結果を待つ"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stats = {"executed": 0, "deduplicated": 0}
+
+    def do(self, key, fn):
+        """
+        fn() を実行して (結果, 共有されたかどうか) を返す。
+        同じキーの呼び出しが実行中であれば、fn() を実行せずにその結果（または例外）を受け取る。
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self._stats["deduplicated"] += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self._stats["executed"] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, in_flight=len(self._calls))
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+起動時間レポート
+各エントリーポイントを新しいPythonプロセスで `python -X importtime` 付きで読み込み、
+プロセス全体の起動時間と、インポート時間のパッケージ別・モジュール別の内訳を表示する。
+起動時間が --budget 秒を超えたエントリーポイントがあれば終了コード1を返す（Cloud Runのコールドスタート対策の確認用）。
+
+使い方:
+    python startup_report.py                      # 既定のエントリーポイントをデモモードで計測
+    python startup_report.py main --top 20         # main.py だけを計測し、上位20件を表示
+    python startup_report.py --env DEMO_MODE=false --json startup.json
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+POC_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(POC_DIR)
+
+# 名前 -> 実行するコード（モジュールの読み込み、またはスクリプトの --help）
+DEFAULT_TARGETS = {
+    "main": "import main",
+    "asgi_main": "import asgi_main",
+    "simple_main": "import simple_main",
+    "security_agent": "import security_agent",
+    "gemini_connection_test": "import gemini_connection_test",
+    "full_agent_orchestrator (poc)": "import full_agent_orchestrator",
+    "full_agent_orchestrator (root) --help": (
+        "import runpy, sys; sys.argv = ['full_agent_orchestrator.py', '--help']; "
+        f"runpy.run_path({os.path.join(ROOT_DIR, 'full_agent_orchestrator.py')!r}, run_name='__main__')"
+    ),
+}
+
+_IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+
+def measure(code, env=None):
+    """
+    新しいプロセスで code を実行し、起動時間とインポート時間の内訳を返す。
+    設計書キャッシュやジョブDBなどのファイルを作らないよう、一時ディレクトリで実行する。
+    """
+    process_env = dict(os.environ, DEMO_MODE="true")
+    process_env.update(env or {})
+    process_env["PYTHONPATH"] = os.pathsep.join(filter(None, [POC_DIR, process_env.get("PYTHONPATH")]))
+    with tempfile.TemporaryDirectory() as workdir:
+        started = time.perf_counter()
+        completed = subprocess.run(
+            [sys.executable, "-X", "importtime", "-W", "ignore", "-c", code],
+            cwd=workdir, env=process_env, capture_output=True, text=True
+        )
+        wall_seconds = time.perf_counter() - started
+
+    modules = []
+    for line in completed.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            modules.append({
+                "module": name,
+                "depth": len(indent) // 2,
+                "self_ms": int(self_us) / 1000,
+                "cumulative_ms": int(cumulative_us) / 1000,
+            })
+
+    packages = {}
+    for module in modules:
+        package = module["module"].split(".")[0]
+        packages[package] = packages.get(package, 0.0) + module["self_ms"]
+
+    return {
+        "returncode": completed.returncode,
+        "wall_seconds": round(wall_seconds, 3),
+        "import_ms": round(sum(module["self_ms"] for module in modules), 1),
+        "packages": dict(sorted(((name, round(ms, 1)) for name, ms in packages.items()), key=lambda item: -item[1])),
+        # エントリーポイントが直接読み込んだモジュール（-X importtime の出力で1段下がったもの）
+        "direct_imports": sorted(
+            ({"module": module["module"], "cumulative_ms": round(module["cumulative_ms"], 1)}
+             for module in modules if module["depth"] == 1),
+            key=lambda item: -item["cumulative_ms"]
+        ),
+        "error": completed.stderr.strip().splitlines()[-1] if completed.returncode else None,
+    }
+
+
+def print_report(name, result, top, budget):
+    status = "✅" if result["returncode"] == 0 and result["wall_seconds"] <= budget else "❌"
+    print(f"\n{status} {name}: 起動 {result['wall_seconds']:.3f}s (インポート合計 {result['import_ms']:.1f}ms)")
+    if result["error"]:
+        print(f"   ⚠️  エラー: {result['error']}")
+    print("   パッケージ別（self時間の合計）:")
+    for package, ms in list(result["packages"].items())[:top]:
+        print(f"     {ms:>9.1f}ms  {package}")
+    print("   直接インポートされたモジュール（cumulative）:")
+    for module in result["direct_imports"][:top]:
+        print(f"     {module['cumulative_ms']:>9.1f}ms  {module['module']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="エントリーポイントの起動時間とインポート時間の内訳を計測する")
+    parser.add_argument("targets", nargs="*", help=f"計測するエントリーポイント（既定: すべて）。選択肢: {', '.join(DEFAULT_TARGETS)}")
+    parser.add_argument("--budget", type=float, default=1.0, help="許容する起動時間 (秒、既定: 1.0)")
+    parser.add_argument("--top", type=int, default=10, help="表示する上位の件数")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="計測時の環境変数（既定で DEMO_MODE=true）")
+    parser.add_argument("--json", default=None, help="結果を保存するJSONファイル")
+    args = parser.parse_args()
+
+    env = dict(item.split("=", 1) for item in args.env)
+    names = args.targets or list(DEFAULT_TARGETS)
+    targets = {}
+    for name in names:
+        matches = [target for target in DEFAULT_TARGETS if target == name or target.startswith(name + " ")]
+        targets[name] = DEFAULT_TARGETS[matches[0]] if matches else f"import {name}"
+
+    print("⏱️  起動時間レポート")
+    print(f"環境変数: {dict({'DEMO_MODE': 'true'}, **env)} / 許容時間: {args.budget}s")
+    results = {}
+    for name, code in targets.items():
+        results[name] = measure(code, env)
+        print_report(name, results[name], args.top, args.budget)
+
+    over_budget = [name for name, result in results.items()
+                   if result["returncode"] != 0 or result["wall_seconds"] > args.budget]
+    print()
+    if over_budget:
+        print(f"❌ 許容時間を超えた、または失敗したエントリーポイント: {', '.join(over_budget)}")
+    else:
+        print(f"✅ すべてのエントリーポイントが {args.budget}s 以内に起動しました。")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"budget_seconds": args.budget, "env": env, "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"💾 結果を保存しました: {args.json}")
+    return 1 if over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,17 +6,27 @@ import requests
 import json
 import sys
 
-def test_agent_generation(requirement):
-    """エージェント生成APIをテストする"""
-    url = "http://localhost:8080/"
-    
+DEFAULT_URL = "http://localhost:8080/"
+
+# テストケース
+TEST_CASES = [
+    "ログイン機能付きのブログサイト",
+    "電気工事士向けのキャリア相談ができるマッチングプラットフォーム",
+    "オンライン書店のWebアプリケーション"
+]
+
+def post_requirement(requirement, url=DEFAULT_URL, timeout=60, session=None):
+    """ビジネス要件をエージェント生成APIに送信し、レスポンスを返す"""
     payload = {
         "business_requirements": requirement
     }
-    
+    return (session or requests).post(url, json=payload, timeout=timeout)
+
+def test_agent_generation(requirement):
+    """エージェント生成APIをテストする"""
     try:
         print(f"要件を送信中: {requirement}")
-        response = requests.post(url, json=payload, timeout=60)
+        response = post_requirement(requirement)
         
         if response.status_code == 200:
             result = response.json()
@@ -46,12 +56,7 @@ def main():
     print("🏗️  Platform Architect Agent テストクライアント")
     print("=" * 50)
     
-    # テストケース
-    test_cases = [
-        "ログイン機能付きのブログサイト",
-        "電気工事士向けのキャリア相談ができるマッチングプラットフォーム",
-        "オンライン書店のWebアプリケーション"
-    ]
+    test_cases = TEST_CASES
     
     if len(sys.argv) > 1:
         # コマンドライン引数が指定された場合
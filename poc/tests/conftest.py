@@ -0,0 +1,32 @@
+import os
+import sys
+
+# poc/ 配下のモジュールはフラットに import し合うため、テストからも同じように読み込めるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+# main.py を読み込む前に設定する値（キャッシュ類は無効にし、LLMはデモモードのMockLLMを使う）
+DESIGN_SERVICE_ENV = {
+    "DEMO_MODE": "true",
+    "LLM_SIMULATOR": "false",
+    "LLM_CASSETTE_MODE": "off",
+    "DESIGN_CACHE_ENABLED": "false",
+    "SEMANTIC_INDEX_ENABLED": "false",
+    "LLM_HEDGE_ENABLED": "false",
+}
+
+
+@pytest.fixture
+def design_service(tmp_path, monkeypatch):
+    """
+    デモモードの main モジュールを返す。設計書・ジョブDBなどの保存先は tmp_path になる。
+    main.py は読み込み時に設定を読むため、最初の読み込みの前に環境変数を設定する
+    """
+    monkeypatch.chdir(tmp_path)
+    for name, value in DESIGN_SERVICE_ENV.items():
+        monkeypatch.setenv(name, value)
+    if "main" not in sys.modules:
+        monkeypatch.setenv("JOB_DB_PATH", str(tmp_path / "design_jobs.sqlite3"))
+    import main
+    return main
@@ -0,0 +1,159 @@
+import threading
+
+import pytest
+
+import llm_resilience
+from admission import AdmissionRejectedError, ConcurrencyLimiter
+from llm_resilience import HedgePolicy, ResilientLLM, RetryPolicy, resilience_stats
+
+
+def busy_limiter(max_queue, max_wait=30.0, average_seconds=4.0):
+    """枠がすべて使用中で、1回の呼び出しの平均所要時間が average_seconds のリミッター"""
+    limiter = ConcurrencyLimiter(max_concurrent=1, max_queue=max_queue, max_wait=max_wait)
+    limiter.acquire()
+    limiter.release(average_seconds)
+    limiter.acquire()
+    return limiter
+
+
+def test_full_queue_is_rejected_with_retry_after():
+    limiter = busy_limiter(max_queue=0)
+    with pytest.raises(AdmissionRejectedError) as error:
+        limiter.acquire()
+    assert error.value.reason == "queue_full"
+    assert error.value.retry_after == 4
+    assert limiter.stats()["rejected_queue_full"] == 1
+
+
+def test_wait_timeout_is_rejected_and_leaves_the_queue():
+    limiter = busy_limiter(max_queue=1, max_wait=0.05)
+    with pytest.raises(AdmissionRejectedError) as error:
+        limiter.acquire()
+    assert error.value.reason == "wait_timeout"
+    assert limiter.queue_depth() == 0
+    limiter.release()
+    assert limiter.acquire() == 0.0
+
+
+@pytest.mark.parametrize("max_queue, max_wait, reason", [(0, 30.0, "queue_full"), (1, 0.05, "wait_timeout")])
+def test_design_request_gets_429_with_retry_after(design_service, monkeypatch, max_queue, max_wait, reason):
+    limiter = busy_limiter(max_queue=max_queue, max_wait=max_wait)
+    monkeypatch.setattr(design_service, "llm_limiter", limiter)
+
+    response = design_service.app.test_client().post("/", data={"business_requirements": "在庫管理システム"})
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "4"
+    assert response.get_json()["retry_after"] == 4
+    assert limiter.stats()[f"rejected_{reason}"] == 1
+    # 拒否されたリクエストは枠を消費しない
+    assert limiter.active_count() == 1
+
+
+def test_design_request_succeeds_when_a_slot_is_free(design_service, monkeypatch):
+    limiter = ConcurrencyLimiter(max_concurrent=1, max_queue=0, max_wait=1)
+    monkeypatch.setattr(design_service, "llm_limiter", limiter)
+
+    response = design_service.app.test_client().post("/", data={"business_requirements": "在庫管理システム"})
+
+    assert response.status_code == 200
+    assert limiter.stats()["admitted"] == 1
+    assert limiter.active_count() == 0
+
+
+@pytest.mark.parametrize("module", ["llm_simulator", "google.api_core.exceptions"])
+@pytest.mark.parametrize("name, status, error_type", [
+    ("ResourceExhausted", 429, "quota_exceeded"), ("DeadlineExceeded", 504, "llm_timeout")])
+def test_llm_errors_are_mapped_by_class_name(design_service, module, name, status, error_type):
+    error_class = getattr(pytest.importorskip(module), name)
+    with pytest.raises(design_service.DesignGenerationError) as error:
+        with design_service.convert_llm_errors():
+            raise error_class("simulated")
+    assert (error.value.status_code, error.value.error_type) == (status, error_type)
+    assert design_service.llm_limiter.active_count() == 0
+
+
+class ServiceUnavailable(Exception):
+    pass
+
+
+class SlotRecordingLLM:
+    """呼び出しごとに使用中の枠数を記録するLLM。behaviors[i] が i 回目の呼び出しの動作"""
+
+    def __init__(self, limiter, behaviors):
+        self.limiter = limiter
+        self.behaviors = list(behaviors)
+        self.active = []
+        self.lock = threading.Lock()
+
+    def invoke(self, prompt):
+        with self.lock:
+            self.active.append(self.limiter.active_count())
+            behavior = self.behaviors.pop(0)
+        return behavior()
+
+
+def fail():
+    raise ServiceUnavailable("simulated")
+
+
+def test_retry_backoff_does_not_hold_a_slot(monkeypatch):
+    limiter = ConcurrencyLimiter(max_concurrent=1, max_queue=0, max_wait=1)
+    llm = SlotRecordingLLM(limiter, [fail, fail, lambda: "ok"])
+    active_during_backoff = []
+    monkeypatch.setattr(llm_resilience.time, "sleep", lambda seconds: active_during_backoff.append(limiter.active_count()))
+    retry = RetryPolicy({"unavailable": {"max_attempts": 3, "base_delay": 1.0, "max_delay": 1.0}})
+
+    assert ResilientLLM(llm, "test-retry-slots", retry=retry, limiter=limiter).invoke("prompt") == "ok"
+
+    assert llm.active == [1, 1, 1]
+    assert active_during_backoff == [0, 0]
+    assert limiter.stats()["admitted"] == 3
+    assert limiter.active_count() == 0
+
+
+def test_admission_rejection_is_not_retried_or_counted_as_llm_failure():
+    limiter = busy_limiter(max_queue=0)
+    llm = SlotRecordingLLM(limiter, [])
+
+    with pytest.raises(AdmissionRejectedError):
+        ResilientLLM(llm, "test-rejected-slots", limiter=limiter).invoke("prompt")
+
+    assert llm.active == []
+    assert resilience_stats()["test-rejected-slots"]["failed"] == 0
+
+
+@pytest.mark.parametrize("max_concurrent, hedged", [(2, True), (1, False)])
+def test_hedge_takes_its_own_slot_or_is_skipped(max_concurrent, hedged):
+    limiter = ConcurrencyLimiter(max_concurrent=max_concurrent, max_queue=0, max_wait=1)
+    primary_release = threading.Event()
+
+    def slow():
+        primary_release.wait(5)
+        return "primary"
+
+    llm = SlotRecordingLLM(limiter, [lambda: "warm-up", slow, lambda: "hedge"])
+    hedge = HedgePolicy(enabled=True, percentile=50, min_samples=1, max_ratio=1.0)
+    call_site = f"test-hedge-slots-{max_concurrent}"
+    resilient = ResilientLLM(llm, call_site, hedge=hedge, limiter=limiter)
+    resilient.invoke("prompt")
+
+    if not hedged:
+        # 枠が空いていなければヘッジを送らず、1本目の応答を待つ
+        threading.Timer(0.2, primary_release.set).start()
+    result = resilient.invoke("prompt")
+    primary_release.set()
+
+    stats = resilience_stats()[call_site]
+    if hedged:
+        assert (result, stats["hedges_fired"], stats["hedges_won"]) == ("hedge", 1, 1)
+        # ヘッジは1本目とは別の枠で実行される
+        assert llm.active == [1, 1, 2]
+    else:
+        assert (result, stats["hedges_fired"]) == ("primary", 0)
+        assert llm.active == [1, 1]
+    for _ in range(100):
+        if limiter.active_count() == 0:
+            break
+        threading.Event().wait(0.01)
+    assert limiter.active_count() == 0
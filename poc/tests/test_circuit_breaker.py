@@ -0,0 +1,189 @@
+import pytest
+
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitBreakerLLM, CircuitOpenError
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class ServiceUnavailable(Exception):
+    pass
+
+
+class InvalidArgument(Exception):
+    pass
+
+
+class FailingLLM:
+    """error が設定されている間は失敗し、latency 秒かかったことにするLLM"""
+
+    def __init__(self, clock, error=ServiceUnavailable):
+        self.clock = clock
+        self.error = error
+        self.latency = 0.0
+        self.calls = 0
+
+    def invoke(self, prompt):
+        self.calls += 1
+        self.clock.advance(self.latency)
+        if self.error is not None:
+            raise self.error("simulated")
+        return "ok"
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def breaker(clock):
+    return CircuitBreaker("test", failure_ratio=0.5, min_calls=4, window=10, slow_call_seconds=10,
+                          open_seconds=30, half_open_probes=1, clock=clock)
+
+
+def call(llm, times=1):
+    for _ in range(times):
+        try:
+            llm.invoke("prompt")
+        except ServiceUnavailable:
+            pass
+
+
+def open_circuit(breaker, clock):
+    llm = FailingLLM(clock)
+    call(CircuitBreakerLLM(llm, breaker), breaker.min_calls)
+    assert breaker.state == OPEN
+    return llm
+
+
+def test_closed_circuit_opens_when_failure_ratio_is_reached(breaker, clock):
+    llm = FailingLLM(clock)
+    wrapped = CircuitBreakerLLM(llm, breaker)
+
+    call(wrapped, breaker.min_calls - 1)
+    assert breaker.state == CLOSED
+
+    call(wrapped)
+    assert breaker.state == OPEN
+    assert breaker.stats()["opened"] == 1
+
+
+def test_open_circuit_rejects_without_calling_the_llm(breaker, clock):
+    llm = open_circuit(breaker, clock)
+    clock.advance(12.5)
+
+    with pytest.raises(CircuitOpenError) as error:
+        CircuitBreakerLLM(llm, breaker).invoke("prompt")
+    assert error.value.retry_after == 18
+    assert llm.calls == breaker.min_calls
+    assert breaker.stats()["rejected"] == 1
+
+
+def test_open_circuit_becomes_half_open_after_open_seconds(breaker, clock):
+    open_circuit(breaker, clock)
+    clock.advance(29.9)
+    assert breaker.state == OPEN
+    clock.advance(0.1)
+    assert breaker.state == HALF_OPEN
+
+
+def test_successful_probe_closes_the_circuit(breaker, clock):
+    llm = open_circuit(breaker, clock)
+    clock.advance(30)
+    llm.error = None
+
+    assert CircuitBreakerLLM(llm, breaker).invoke("prompt") == "ok"
+    assert breaker.state == CLOSED
+
+
+def test_failed_probe_opens_the_circuit_again(breaker, clock):
+    llm = open_circuit(breaker, clock)
+    clock.advance(30)
+
+    call(CircuitBreakerLLM(llm, breaker))
+    assert breaker.state == OPEN
+    assert breaker.stats()["opened"] == 2
+    # 開き直した時点から open_seconds を数え直す
+    assert breaker.retry_after() == 30
+
+
+def test_half_open_circuit_lets_only_the_probe_through(breaker, clock):
+    open_circuit(breaker, clock)
+    clock.advance(30)
+
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    # 試行が結果を残さずに終わった場合は、次の呼び出しが試行になる
+    breaker.cancel_call()
+    breaker.before_call()
+    breaker.record_success(0.1)
+    assert breaker.state == CLOSED
+
+
+def test_slow_calls_count_as_failures(breaker, clock):
+    llm = FailingLLM(clock, error=None)
+    llm.latency = breaker.slow_call_seconds
+    wrapped = CircuitBreakerLLM(llm, breaker)
+
+    for _ in range(breaker.min_calls):
+        assert wrapped.invoke("prompt") == "ok"
+    assert breaker.state == OPEN
+    assert breaker.stats()["slow_calls"] == breaker.min_calls
+
+
+def test_request_errors_do_not_open_the_circuit(breaker, clock):
+    wrapped = CircuitBreakerLLM(FailingLLM(clock, error=InvalidArgument), breaker)
+
+    for _ in range(breaker.min_calls * 2):
+        with pytest.raises(InvalidArgument):
+            wrapped.invoke("prompt")
+    assert breaker.state == CLOSED
+    assert breaker.stats()["window_calls"] == 0
+
+
+@pytest.fixture
+def open_design_breaker(design_service, monkeypatch, breaker, clock):
+    """設計書生成のブレーカーを、開いてから10秒経った状態に差し替える"""
+    open_circuit(breaker, clock)
+    clock.advance(10)
+    monkeypatch.setattr(design_service, "design_breaker", breaker)
+    return breaker
+
+
+def test_design_request_gets_degraded_response_when_circuit_is_open(design_service, open_design_breaker, monkeypatch):
+    monkeypatch.setenv("DEGRADED_FALLBACK", "mock")
+
+    response = design_service.app.test_client().post("/", data={"business_requirements": "在庫管理システム"})
+
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body["cache"] == "degraded"
+    assert body["degraded"]["source"] == "mock"
+    assert body["degraded"]["retry_after"] == 20
+    assert body["generated_design"]["required_agents"]
+
+
+@pytest.mark.parametrize("fallback", ["off", "cache"])
+def test_design_request_gets_503_when_no_fallback_is_available(design_service, open_design_breaker, monkeypatch,
+                                                               fallback):
+    # cache は類似要件の生成済み設計書がない場合に使えない
+    monkeypatch.setenv("DEGRADED_FALLBACK", fallback)
+
+    response = design_service.app.test_client().post("/", data={"business_requirements": "在庫管理システム"})
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "20"
+    body = response.get_json()
+    assert body["error"].startswith("LLM is temporarily unavailable")
+    assert body["retry_after"] == 20
+    assert open_design_breaker.stats()["rejected"] == 1
@@ -0,0 +1,118 @@
+import os
+import time
+
+import pytest
+
+import design_cache
+from design_cache import DesignCache
+
+
+class FakeTime:
+    """design_cache.time の代わりに使う、進めた分だけ時刻が進む時計（ファイルの更新時刻と比べるため実時刻から始める）"""
+
+    def __init__(self):
+        self.now = time.time()
+
+    def time(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    monkeypatch.setenv("DESIGN_CACHE_ENABLED", "true")
+    fake = FakeTime()
+    monkeypatch.setattr(design_cache, "time", fake)
+    return fake
+
+
+def make_cache(tmp_path, **kwargs):
+    options = dict(memory_entries=256, ttl_seconds=60, max_disk_bytes=1024 * 1024)
+    options.update(kwargs)
+    return DesignCache(cache_dir=str(tmp_path / "cache"), **options)
+
+
+def design(name):
+    return {"timestamp": "20261018_000000", "generated_design": {"project_overview": {"name": name}}}
+
+
+def cached_name(entry):
+    return entry["generated_design"]["project_overview"]["name"] if entry is not None else None
+
+
+def test_memory_tier_evicts_least_recently_used(tmp_path, clock):
+    cache = make_cache(tmp_path, memory_entries=2, max_disk_bytes=0)
+    cache.set("a", design("a"))
+    cache.set("b", design("b"))
+    cache.get("a")
+    cache.set("c", design("c"))
+
+    assert cached_name(cache.get("b")) is None
+    assert cached_name(cache.get("a")) == "a"
+    assert cached_name(cache.get("c")) == "c"
+    assert cache.stats()["memory_entries"] == 2
+
+
+def test_entries_expire_on_both_tiers(tmp_path, clock):
+    cache = make_cache(tmp_path, ttl_seconds=60)
+    cache.set("a", design("a"))
+    path = cache._path("a")
+
+    clock.advance(59)
+    assert cached_name(cache.get("a")) == "a"
+    # メモリ層を持たない別のインスタンスはディスク層から読む
+    assert cached_name(make_cache(tmp_path).get("a")) == "a"
+
+    clock.advance(1)
+    assert make_cache(tmp_path).get("a") is None
+    assert not os.path.exists(path)
+    assert cache.get("a") is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_disk_tier_evicts_oldest_files_over_the_size_limit(tmp_path, clock):
+    probe = make_cache(tmp_path / "probe")
+    probe.set("x", design("a"))
+    entry_size = os.path.getsize(probe._path("x"))
+
+    cache = make_cache(tmp_path, max_disk_bytes=entry_size * 2)
+    for age, key in ((30, "a"), (20, "b"), (10, "c")):
+        cache.set(key, design(key))
+        # 同じ秒に書いたファイルでも古い順が決まるように、更新時刻をずらす
+        mtime = clock.now - age
+        os.utime(cache._path(key), (mtime, mtime))
+
+    cache.set("d", design("d"))
+
+    assert sorted(name[:-len(".json")] for name in os.listdir(cache.cache_dir)) == ["c", "d"]
+    fresh = make_cache(tmp_path)
+    assert [cached_name(fresh.get(key)) for key in "abcd"] == [None, None, "c", "d"]
+
+
+def test_zero_memory_entries_uses_only_the_disk_tier(tmp_path, clock):
+    cache = make_cache(tmp_path, memory_entries=0)
+    cache.set("a", design("a"))
+
+    assert cache.stats()["memory_entries"] == 0
+    assert cached_name(cache.get("a")) == "a"
+    assert cached_name(cache.get("a")) == "a"
+    stats = cache.stats()
+    assert (stats["memory_hits"], stats["disk_hits"], stats["memory_entries"]) == (0, 2, 0)
+
+
+def test_zero_max_disk_bytes_uses_only_the_memory_tier(tmp_path, clock):
+    cache = make_cache(tmp_path, max_disk_bytes=0)
+    cache.set("a", design("a"))
+
+    assert not os.path.exists(cache.cache_dir)
+    assert cached_name(cache.get("a")) == "a"
+    assert make_cache(tmp_path).get("a") is None
+
+
+def test_zero_ttl_never_serves_entries(tmp_path, clock):
+    cache = make_cache(tmp_path, ttl_seconds=0)
+    cache.set("a", design("a"))
+
+    assert cache.get("a") is None
@@ -0,0 +1,362 @@
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+import pytest
+
+# ルートのオーケストレーター（poc/ の共有モジュールを使う）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import full_agent_orchestrator
+from full_agent_orchestrator import FullAgentOrchestrator, ThreadLocalOutput, critical_path, plan_schedule
+
+ROLES = ("01_architect", "02_ui_ux_engineer", "03_api_data_engineer", "04_quality_assurance")
+
+
+def role_of(prompt):
+    return re.search(r"DESIGN:(\w+)", prompt).group(1)
+
+
+class FakeCodingLLM:
+    """
+    設計書の担当ごとに決まったコードを返すLLM。delays[担当] 秒かけて応答し、
+    呼び出しの開始・終了の順番と、受け取ったプロンプトを記録する
+    """
+
+    def __init__(self, delays=None, suffix=""):
+        self.delays = delays or {}
+        # 生成するコードの末尾に付ける文字列（設計書の変更でコードが変わる場合を再現する）
+        self.suffix = suffix
+        self.lock = threading.Lock()
+        self.events = []
+        self.prompts = []
+
+    def invoke(self, prompt):
+        role = role_of(prompt)
+        with self.lock:
+            self.events.append(("start", role))
+            self.prompts.append(prompt)
+        time.sleep(self.delays.get(role, 0.0))
+        with self.lock:
+            self.events.append(("end", role))
+        return json.dumps({"file_name": f"{role}/main.py", "source_code": f"# generated for {role}{self.suffix}\n"})
+
+    @property
+    def calls(self):
+        return [role for event, role in self.events if event == "start"]
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    """設計書4件のプロジェクトのディレクトリ（コード生成キャッシュも tmp_path に置く）"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("CODEGEN_CACHE_DIR", str(tmp_path / ".codegen_cache"))
+    monkeypatch.setenv("CODEGEN_CACHE_ENABLED", "true")
+    monkeypatch.setenv("LLM_HEDGE_ENABLED", "false")
+    project_dir = tmp_path / "project"
+    project_dir.mkdir()
+    (project_dir / "00_project_overview.json").write_text(
+        json.dumps({"project_overview": {"name": "在庫管理"}}), encoding="utf-8")
+    for name in ROLES:
+        write_design(str(project_dir), name)
+    return str(project_dir)
+
+
+def write_design(project_dir, name, extra=""):
+    role = name.split("_", 1)[1]
+    with open(os.path.join(project_dir, f"{name}.md"), "w", encoding="utf-8") as f:
+        f.write(f"# {role}\nDESIGN:{role}\n{extra}")
+
+
+def run(project_dir, llm, monkeypatch, **options):
+    monkeypatch.setattr(full_agent_orchestrator, "get_llm", lambda: llm)
+    return FullAgentOrchestrator(project_dir, **options).execute()
+
+
+def test_plan_schedule_orders_dependencies_first():
+    files = [f"/p/{name}.md" for name in ("05_custom_role", "04_quality_assurance", "02_ui_ux_engineer",
+                                          "01_architect", "03_api_data_engineer")]
+
+    order, dependencies = plan_schedule(files)
+
+    assert [os.path.basename(f) for f in order] == [
+        "01_architect.md", "02_ui_ux_engineer.md", "03_api_data_engineer.md",
+        "04_quality_assurance.md", "05_custom_role.md"]
+    assert dependencies["/p/01_architect.md"] == []
+    # 表にない担当はアーキテクトだけを待ち、設計書のない担当（ux_ui_designer など）への依存は無視する
+    assert dependencies["/p/05_custom_role.md"] == ["/p/01_architect.md"]
+    assert dependencies["/p/04_quality_assurance.md"] == [
+        "/p/01_architect.md", "/p/02_ui_ux_engineer.md", "/p/03_api_data_engineer.md"]
+
+
+def test_plan_schedule_rejects_cycles(monkeypatch):
+    monkeypatch.setattr(full_agent_orchestrator, "ROLE_DEPENDENCIES",
+                        {"architect": (), "frontend": ("backend",), "backend": ("frontend",)})
+
+    with pytest.raises(ValueError, match="循環"):
+        plan_schedule(["/p/01_architect.md", "/p/02_frontend.md", "/p/03_backend.md"])
+
+
+def test_critical_path_follows_the_longest_dependency_chain():
+    results = [
+        {"design_file": "a", "depends_on": [], "seconds": 1.0},
+        {"design_file": "b", "depends_on": ["a"], "seconds": 5.0},
+        {"design_file": "c", "depends_on": ["a"], "seconds": 2.0},
+        {"design_file": "d", "depends_on": ["b", "c"], "seconds": 1.5},
+    ]
+    assert critical_path(results) == (["a", "b", "d"], 7.5)
+    assert critical_path([]) == ([], 0.0)
+
+
+def test_thread_local_output_captures_each_thread_separately(capsys):
+    output = ThreadLocalOutput(sys.stdout)
+    logs = {}
+
+    def worker(name):
+        with output.capture() as log:
+            for i in range(50):
+                output.write(f"{name}{i}\n")
+        logs[name] = log.getvalue()
+
+    threads = [threading.Thread(target=worker, args=(name,)) for name in "ab"]
+    for thread in threads:
+        thread.start()
+    output.write("main\n")
+    for thread in threads:
+        thread.join()
+
+    assert logs == {name: "".join(f"{name}{i}\n" for i in range(50)) for name in "ab"}
+    assert capsys.readouterr().out == "main\n"
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_results_and_logs_follow_the_schedule_order(project, monkeypatch, capsys, workers):
+    # ui_ux_engineer は api_data_engineer より後に終わる
+    llm = FakeCodingLLM(delays={"ui_ux_engineer": 0.3})
+
+    results = run(project, llm, monkeypatch, workers=workers)
+
+    assert [result["design_file"] for result in results] == [f"{name}.md" for name in ROLES]
+    assert all(result["success"] for result in results)
+    out = capsys.readouterr().out
+    log_positions = [out.index(f"`{name}`") for name in ROLES]
+    assert log_positions == sorted(log_positions)
+    if workers > 1:
+        assert llm.events.index(("end", "api_data_engineer")) < llm.events.index(("end", "ui_ux_engineer"))
+
+
+def test_dependents_start_after_their_upstreams_finish(project, monkeypatch):
+    llm = FakeCodingLLM(delays={"architect": 0.1, "ui_ux_engineer": 0.2, "api_data_engineer": 0.05})
+
+    results = run(project, llm, monkeypatch, workers=4)
+
+    events = llm.events
+    for upstream in ("ui_ux_engineer", "api_data_engineer"):
+        assert events.index(("end", "architect")) < events.index(("start", upstream))
+        assert events.index(("end", upstream)) < events.index(("start", "quality_assurance"))
+    # ui と api は並列に実行される
+    assert events.index(("start", "api_data_engineer")) < events.index(("end", "ui_ux_engineer"))
+    # 依存先が生成したコードはプロンプトに含まれる
+    qa_prompt = next(prompt for prompt in llm.prompts if role_of(prompt) == "quality_assurance")
+    for upstream in ("architect", "ui_ux_engineer", "api_data_engineer"):
+        assert f"# generated for {upstream}" in qa_prompt
+    assert results[-1]["depends_on"] == ["01_architect.md", "02_ui_ux_engineer.md", "03_api_data_engineer.md"]
+
+
+def read_output(project_dir, role):
+    with open(os.path.join(project_dir, role, "main.py"), encoding="utf-8") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_unchanged_rerun_makes_no_llm_calls(project, monkeypatch, workers):
+    run(project, FakeCodingLLM(), monkeypatch, workers=workers)
+    os.remove(os.path.join(project, "api_data_engineer", "main.py"))
+    llm = FakeCodingLLM()
+
+    results = run(project, llm, monkeypatch, workers=workers)
+
+    assert llm.calls == []
+    assert [result["cache"] for result in results] == ["hit"] * len(ROLES)
+    assert all(result["success"] for result in results)
+    # キャッシュから再利用したコードも保存される
+    assert read_output(project, "api_data_engineer") == "# generated for api_data_engineer\n"
+
+
+def test_editing_a_leaf_design_regenerates_only_that_file(project, monkeypatch):
+    run(project, FakeCodingLLM(), monkeypatch)
+    write_design(project, "04_quality_assurance", extra="E2Eテストも追加する\n")
+    llm = FakeCodingLLM()
+
+    results = run(project, llm, monkeypatch)
+
+    assert llm.calls == ["quality_assurance"]
+    assert [result["cache"] for result in results] == ["hit", "hit", "hit", "miss"]
+
+
+@pytest.mark.parametrize("suffix, regenerated", [
+    # 生成し直したコードが前回と同じなら、下流はキャッシュを再利用する
+    ("", ["architect"]),
+    ("  # v2", ["architect", "ui_ux_engineer", "api_data_engineer", "quality_assurance"]),
+])
+def test_editing_an_upstream_design_regenerates_dependents_whose_context_changed(project, monkeypatch, suffix,
+                                                                                 regenerated):
+    # 依存先のコードはキャッシュキーに含まれるため、アーキテクトのコードが変われば下流もすべて生成し直す
+    run(project, FakeCodingLLM(), monkeypatch)
+    write_design(project, "01_architect", extra="マイクロサービス構成にする\n")
+    llm = FakeCodingLLM(suffix=suffix)
+
+    run(project, llm, monkeypatch)
+
+    assert llm.calls == regenerated
+
+
+def test_no_cache_regenerates_everything_and_leaves_the_cache_untouched(project, monkeypatch):
+    run(project, FakeCodingLLM(), monkeypatch)
+    llm = FakeCodingLLM()
+
+    results = run(project, llm, monkeypatch, use_cache=False)
+
+    assert sorted(llm.calls) == sorted(name.split("_", 1)[1] for name in ROLES)
+    assert [result["cache"] for result in results] == ["miss"] * len(ROLES)
+    llm = FakeCodingLLM()
+    run(project, llm, monkeypatch)
+    assert llm.calls == []
+
+
+class FakeManifestLLM:
+    """
+    マニフェスト形式の応答をストリームで返すLLM。担当ごとに応答の本文を差し替えられ、
+    cut_at の文字列の直前で応答を打ち切る（error を指定した場合はそこで例外を送出する）。
+    invoke はファイル1つ分の再生成の依頼に答え、依頼されたファイル名を記録する
+    """
+
+    def __init__(self, files, cut_at=None, error=None, delays=None, bodies=None):
+        self.files = files
+        self.cut_at = cut_at or {}
+        self.error = error
+        self.delays = delays or {}
+        self.bodies = bodies or {}
+        self.lock = threading.Lock()
+        self.streamed = []
+        self.regenerated = []
+
+    def response(self, role):
+        files = self.bodies.get(role) or [
+            {"file_name": name, "source_code": f"# {name} streamed\n"} for name in self.files[role]]
+        text = "```json\n" + json.dumps({"manifest": [item["file_name"] for item in files if isinstance(item, dict)],
+                                         "files": files}) + "\n```"
+        cut = self.cut_at.get(role)
+        return text[:text.index(cut)] if cut else text
+
+    def stream(self, prompt):
+        role = role_of(prompt)
+        with self.lock:
+            self.streamed.append(role)
+        time.sleep(self.delays.get(role, 0.0))
+        text = self.response(role)
+        for start in range(0, len(text), 7):
+            yield text[start:start + 7]
+        if self.error is not None and role in self.cut_at:
+            raise self.error
+
+    def invoke(self, prompt):
+        file_name = re.search(r"「(.+?)」のソースコードだけ", prompt).group(1)
+        with self.lock:
+            self.regenerated.append(file_name)
+        return json.dumps({"file_name": file_name, "source_code": f"# {file_name} regenerated\n"})
+
+
+MANIFEST_FILES = {
+    role: [f"{role}/a.py", f"{role}/b.py", f"{role}/c.py"]
+    for role in ("architect", "ui_ux_engineer", "api_data_engineer", "quality_assurance")
+}
+
+
+def read_file(project_dir, file_name):
+    with open(os.path.join(project_dir, file_name), encoding="utf-8") as f:
+        return f.read()
+
+
+def qa_result(project, llm, monkeypatch):
+    results = run(project, llm, monkeypatch, multi_file=True)
+    return results[-1]
+
+
+def test_complete_manifest_stream_writes_every_file_in_one_call(project, monkeypatch, capsys):
+    llm = FakeManifestLLM(MANIFEST_FILES)
+
+    results = run(project, llm, monkeypatch, multi_file=True)
+
+    assert llm.regenerated == []
+    for result in results:
+        assert (result["success"], result["llm_calls"], len(result["files"])) == (True, 1, 3)
+    assert read_file(project, "quality_assurance/b.py") == "# quality_assurance/b.py streamed\n"
+    assert "📦 生成ファイル: 12 件 / LLM呼び出し 4 回 (1回あたり 3.00 ファイル)" in capsys.readouterr().out
+
+
+@pytest.mark.parametrize("cut, error", [
+    # 2つ目のファイルのコードの途中で打ち切られた（修復できない）
+    ('ance/b.py streamed', None),
+    # 受信中に接続が切れた
+    ('ance/b.py streamed', ConnectionError("stream reset")),
+])
+def test_broken_stream_regenerates_only_the_missing_files(project, monkeypatch, cut, error):
+    llm = FakeManifestLLM(MANIFEST_FILES, cut_at={"quality_assurance": cut}, error=error)
+
+    result = qa_result(project, llm, monkeypatch)
+
+    # 打ち切られる前に保存したファイルは再生成しない
+    assert llm.regenerated == ["quality_assurance/b.py", "quality_assurance/c.py"]
+    assert (result["success"], result["llm_calls"]) == (True, 3)
+    assert sorted(result["files"]) == MANIFEST_FILES["quality_assurance"]
+    assert read_file(project, "quality_assurance/a.py") == "# quality_assurance/a.py streamed\n"
+    assert read_file(project, "quality_assurance/b.py") == "# quality_assurance/b.py regenerated\n"
+    assert read_file(project, "quality_assurance/c.py") == "# quality_assurance/c.py regenerated\n"
+
+
+def test_truncated_stream_is_salvaged_by_repair(project, monkeypatch):
+    # 2つ目のエントリーの閉じ括弧の手前で打ち切られた応答は、修復で2つ目まで取り出せる
+    llm = FakeManifestLLM(MANIFEST_FILES, cut_at={"quality_assurance": '}, {"file_name": "quality_assurance/c.py"'})
+
+    result = qa_result(project, llm, monkeypatch)
+
+    assert llm.regenerated == ["quality_assurance/c.py"]
+    assert (result["success"], result["llm_calls"]) == (True, 2)
+    assert read_file(project, "quality_assurance/b.py") == "# quality_assurance/b.py streamed\n"
+
+
+def test_malformed_entries_are_skipped_and_regenerated(project, monkeypatch):
+    body = [
+        {"file_name": "quality_assurance/a.py", "source_code": "# a\n"},
+        {"file_name": "quality_assurance/b.py", "source_code": 123},
+        {"file_name": "quality_assurance/c.py", "source_code": "# c\n"},
+    ]
+    llm = FakeManifestLLM(MANIFEST_FILES, bodies={"quality_assurance": body})
+
+    result = qa_result(project, llm, monkeypatch)
+
+    assert llm.regenerated == ["quality_assurance/b.py"]
+    assert (result["success"], result["llm_calls"]) == (True, 2)
+    assert result["files"] == ["quality_assurance/a.py", "quality_assurance/c.py", "quality_assurance/b.py"]
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_shared_path_keeps_the_later_design_in_schedule_order(project, monkeypatch, capsys, workers):
+    # ui_ux_engineer と api_data_engineer は互いに依存せず、どちらも shared.txt を生成する。
+    # ui は api より後に応答するが、実行順で後の api の内容が残る（逐次実行と同じ）
+    bodies = {role: [{"file_name": "shared.txt", "source_code": f"{role}\n"}]
+              for role in ("ui_ux_engineer", "api_data_engineer")}
+    llm = FakeManifestLLM(MANIFEST_FILES, bodies=bodies, delays={"ui_ux_engineer": 0.3})
+
+    results = run(project, llm, monkeypatch, multi_file=True, workers=workers)
+
+    assert all(result["success"] for result in results)
+    assert read_file(project, "shared.txt") == "api_data_engineer\n"
+    out = capsys.readouterr().out
+    assert "shared.txt: 02_ui_ux_engineer.md, 03_api_data_engineer.md" in out
+    if workers > 1:
+        assert "shared.txt は他の設計書 (03_api_data_engineer.md) も生成したため" in out
@@ -0,0 +1,91 @@
+import json
+
+import pytest
+
+from json_repair import extract_json_tolerant, json_repair_stats, parse_llm_json, repair_json
+from json_stream import JSONExtractionError, extract_json
+
+
+def fenced(body):
+    return f"設計書は次のとおりです。\n```json\n{body}\n```\n以上です。"
+
+
+DESIGN = {
+    "project_overview": {"name": "在庫管理", "description": "倉庫の在庫を管理する"},
+    "required_agents": [
+        {"name": "api", "source_code": "def main():\n\tprint(\"ok\")\n", "pattern": "\\d+"},
+        {"name": "db", "tables": ["items", "stocks"], "replicas": 2, "cache": None, "enabled": True},
+    ],
+}
+
+
+@pytest.mark.parametrize("text", [
+    fenced(json.dumps(DESIGN, ensure_ascii=False)),
+    fenced(json.dumps(DESIGN, ensure_ascii=False, indent=2)),
+])
+def test_valid_json_passes_through_unchanged(text):
+    assert repair_json(text) == (DESIGN, [])
+    assert parse_llm_json(text) == (DESIGN, [])
+
+
+@pytest.mark.parametrize("text, expected, fixes", [
+    # 文字列内の生の改行とタブ
+    (fenced('{"source_code": "def main():\n\tpass"}'), {"source_code": "def main():\n\tpass"}, ["unescaped_control"]),
+    # 閉じ括弧の直前のカンマ
+    (fenced('{"tables": ["items", "stocks",], "replicas": 2,}'), {"tables": ["items", "stocks"], "replicas": 2},
+     ["trailing_comma"]),
+    # 途中で打ち切られ、閉じ括弧と閉じのフェンスがない
+    ('```json\n{"agents": [{"name": "api"}, {"name": "db", "replicas": 2', {"agents": [{"name": "api"},
+                                                                                    {"name": "db", "replicas": 2}]},
+     ["unclosed_brackets"]),
+    # シングルクォートの文字列（アポストロフィとダブルクォートを含む）
+    (fenced("{'name': 'it's \"api\"', 'replicas': 2}"), {"name": "it's \"api\"", "replicas": 2}, ["single_quotes"]),
+    # フェンスなし
+    ('結果: {"name": "api"} です', {"name": "api"}, ["missing_fence"]),
+    # 正規表現の \d などの不正なエスケープ
+    (fenced('{"pattern": "^\\d+\\.\\w$"}'), {"pattern": "^\\d+\\.\\w$"}, ["invalid_escape"]),
+])
+def test_each_repair_class(text, expected, fixes):
+    # 厳密な抽出では失敗する応答だけを対象にする
+    with pytest.raises(JSONExtractionError):
+        extract_json(text)
+    assert repair_json(text) == (expected, fixes)
+
+
+def test_repairs_combine():
+    text = "{'agents': [{'name': 'api', 'source_code': 'a\nb',},"
+    value, fixes = repair_json(text)
+    assert value == {"agents": [{"name": "api", "source_code": "a\nb"}]}
+    assert fixes == ["missing_fence", "single_quotes", "trailing_comma", "unclosed_brackets", "unescaped_control"]
+
+
+def test_missing_fence_is_not_a_fix_when_fence_is_optional():
+    assert repair_json('{"name": "api",}', require_fence=False) == ({"name": "api"}, ["trailing_comma"])
+
+
+@pytest.mark.parametrize("text", [
+    # 文字列の途中で打ち切られた（内容が欠けている）
+    fenced('{"name": "api", "source_code": "def main'),
+    # キーの直後で打ち切られた
+    fenced('{"name": "api", "replicas"'),
+    # JSONがない
+    "設計書を生成できませんでした。",
+    # 修復の対象外の崩れ
+    fenced('{"name": "api" "replicas": 2}'),
+])
+def test_unrepairable_responses_fail(text):
+    with pytest.raises(JSONExtractionError):
+        repair_json(text)
+
+
+def test_extract_json_tolerant_records_outcomes():
+    call_site = "test-json-repair"
+    assert extract_json_tolerant(fenced('{"name": "api"}'), call_site) == {"name": "api"}
+    assert extract_json_tolerant(fenced('{"name": "api",}'), call_site) == {"name": "api"}
+    with pytest.raises(JSONExtractionError):
+        extract_json_tolerant(fenced('{"name": "ap'), call_site)
+
+    stats = json_repair_stats()[call_site]
+    assert (stats["clean"], stats["repaired"], stats["failed"]) == (1, 1, 1)
+    assert stats["fixes"] == {"trailing_comma": 1}
+    assert stats["repair_rate"] == 0.5
@@ -0,0 +1,98 @@
+import json
+
+import pytest
+
+from json_stream import IncrementalJSONExtractor, JSONExtractionError, extract_json
+
+DESIGN = {
+    "project_overview": {"name": "在庫管理", "description": "引用符 \" とバックスラッシュ \\ と {括弧} [配列]"},
+    "required_agents": [
+        {"agent_name": "Architect", "skills": ["設計", "レビュー"], "autonomy_level": "L2"},
+        {"agent_name": "Coder", "source_code": "```python\nprint('}{')\n```\n", "tab": "\t", "emoji": "🤖"},
+        {"agent_name": "QA", "kpis": [], "nested": {"a": [1, 2.5, -3e2, True, False, None]}},
+    ],
+    "count": 3,
+    "empty": {},
+    "flag": None,
+}
+
+DOCUMENTS = {
+    "design": "以下が設計書です。\n```json\n" + json.dumps(DESIGN, ensure_ascii=False, indent=2) + "\n```\n以上です。",
+    "escaped_unicode": "```json\n" + json.dumps(DESIGN) + "\n```",
+    "top_level_array": "```json\n[1, {\"a\": \"b\"}, [2, 3], \"x\\\"y\", null]\n```",
+    "compact": "```json\n" + json.dumps(DESIGN, ensure_ascii=False, separators=(",", ":")) + "```",
+}
+
+# 走査用バッファの切り詰め（_COMPACT_THRESHOLD）を通るだけの長さの文書
+LARGE = {"required_agents": [dict(DESIGN["required_agents"][1], index=i, padding="x" * 200) for i in range(40)]}
+LARGE_DOCUMENT = "```json\n" + json.dumps(LARGE, ensure_ascii=False, indent=1) + "\n```"
+
+
+def feed_all(text, chunks):
+    extractor = IncrementalJSONExtractor()
+    events = []
+    for chunk in chunks:
+        events.extend(extractor.feed(chunk))
+    return extractor.close(), events
+
+
+def split_at(text, *offsets):
+    bounds = [0, *offsets, len(text)]
+    return [text[start:end] for start, end in zip(bounds, bounds[1:])]
+
+
+@pytest.mark.parametrize("name", sorted(DOCUMENTS))
+def test_every_two_way_split_matches_single_shot(name):
+    text = DOCUMENTS[name]
+    expected, expected_events = feed_all(text, [text])
+    assert expected == extract_json(text)
+    for offset in range(1, len(text)):
+        assert feed_all(text, split_at(text, offset)) == (expected, expected_events), offset
+
+
+@pytest.mark.parametrize("name", sorted(DOCUMENTS))
+def test_every_three_way_split_matches_single_shot(name):
+    text = DOCUMENTS[name]
+    expected = feed_all(text, [text])
+    # 断片の境界が文字列・エスケープ・フェンスの途中に来る組み合わせを網羅する（2つ目の境界は数文字後）
+    for first in range(1, len(text) - 1):
+        for second in range(first + 1, min(len(text), first + 8)):
+            assert feed_all(text, split_at(text, first, second)) == expected, (first, second)
+
+
+@pytest.mark.parametrize("size", list(range(1, 17)) + [63, 64, 65, 4095, 4096, 4097])
+def test_fixed_size_chunks_of_a_large_document(size):
+    expected = feed_all(LARGE_DOCUMENT, [LARGE_DOCUMENT])
+    chunks = [LARGE_DOCUMENT[i:i + size] for i in range(0, len(LARGE_DOCUMENT), size)]
+    assert feed_all(LARGE_DOCUMENT, chunks) == expected
+    assert expected[0] == LARGE
+
+
+def test_events_report_members_and_elements_in_order():
+    _, events = feed_all(DOCUMENTS["design"], [DOCUMENTS["design"]])
+    assert [event[0] for event in events] == ["member", "element", "element", "element", "member",
+                                              "member", "member", "member", "document"]
+    assert [event[2] for event in events if event[0] == "element"] == [0, 1, 2]
+    assert events[-1][1] == DESIGN
+
+
+@pytest.mark.parametrize("text", [
+    "```json\n{\"a\": 1,}\n```",
+    "```json\n{\"a\": }\n```",
+    "```json\n[1, 2,]\n```",
+    "```json\n{\"a\": [1, 2}\n```",
+    "```json\n{\"a\": \"unterminated",
+])
+def test_invalid_documents_fail_at_every_split(text):
+    with pytest.raises(JSONExtractionError):
+        extract_json(text)
+    for offset in range(1, len(text)):
+        with pytest.raises(JSONExtractionError):
+            feed_all(text, split_at(text, offset))
+
+
+def test_missing_fence_is_reported():
+    with pytest.raises(JSONExtractionError) as error:
+        extract_json("{\"a\": 1}")
+    assert error.value.found_block is False
+    assert extract_json("note {\"a\": 1}", require_fence=False) == {"a": 1}
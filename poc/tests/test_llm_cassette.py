@@ -0,0 +1,145 @@
+import asyncio
+
+import pytest
+
+import llm_cassette
+from llm_cassette import Cassette, CassetteLLM, CassetteMissError
+from llm_resilience import classify_error
+
+
+class FakeTime:
+    """llm_cassette.time の代わりに使う時計。sleep した秒数を記録し、その分だけ時刻を進める"""
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def perf_counter(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(round(seconds, 3))
+        self.now += seconds
+
+
+class ResourceExhausted(Exception):
+    pass
+
+
+class ScriptedLLM:
+    """呼び出しごとに script の先頭の (秒数, 応答または例外) を使うLLM。stream は応答のリストを断片として返す"""
+
+    def __init__(self, clock, script):
+        self.clock = clock
+        self.script = list(script)
+
+    def invoke(self, prompt):
+        seconds, response = self.script.pop(0)
+        self.clock.now += seconds
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    async def ainvoke(self, prompt):
+        return self.invoke(prompt)
+
+    def stream(self, prompt):
+        seconds, chunks = self.script.pop(0)
+        for chunk in chunks:
+            self.clock.now += seconds
+            if isinstance(chunk, Exception):
+                raise chunk
+            yield chunk
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeTime()
+    monkeypatch.setattr(llm_cassette, "time", fake)
+    return fake
+
+
+@pytest.fixture(params=["cassette.jsonl", "cassette.jsonl.gz"])
+def path(request, tmp_path):
+    return str(tmp_path / request.param)
+
+
+def record(path, clock, script, calls):
+    """script の応答を記録しながら calls（LLMを受け取って呼び出す関数）を順に実行する"""
+    llm = CassetteLLM(ScriptedLLM(clock, script), "gemini-test", Cassette(path, mode="record"))
+    for call in calls:
+        try:
+            call(llm)
+        except Exception:
+            pass
+
+
+def replayer(path, timing="instant"):
+    return CassetteLLM(None, "gemini-test", Cassette(path, mode="replay", timing=timing))
+
+
+def test_invoke_is_replayed_with_recorded_latency(path, clock):
+    record(path, clock, [(1.5, "設計書")], [lambda llm: llm.invoke("prompt")])
+
+    assert replayer(path).invoke("prompt") == "設計書"
+    assert clock.sleeps == [0.0]
+    assert replayer(path, timing="recorded").invoke("prompt") == "設計書"
+    assert clock.sleeps == [0.0, 1.5]
+    assert asyncio.run(replayer(path).ainvoke("prompt")) == "設計書"
+
+
+def test_stream_is_replayed_with_recorded_chunk_timing(path, clock):
+    record(path, clock, [(0.25, ["a", "bc", "def"])], [lambda llm: list(llm.stream("prompt"))])
+
+    assert list(replayer(path, timing="recorded").stream("prompt")) == ["a", "bc", "def"]
+    assert clock.sleeps == [0.25, 0.25, 0.25]
+
+
+def test_recorded_errors_are_replayed_with_the_same_class_name(path, clock):
+    record(path, clock, [(0.1, ResourceExhausted("quota")), (0.1, ["partial ", ResourceExhausted("quota")])],
+           [lambda llm: llm.invoke("prompt"), lambda llm: list(llm.stream("stream prompt"))])
+
+    llm = replayer(path)
+    with pytest.raises(Exception) as error:
+        llm.invoke("prompt")
+    assert (type(error.value).__name__, str(error.value)) == ("ResourceExhausted", "quota")
+    # リトライとサーキットブレーカーは記録時と同じ種類の失敗として扱う
+    assert classify_error(error.value) == "quota"
+
+    chunks = []
+    with pytest.raises(Exception) as error:
+        for chunk in llm.stream("stream prompt"):
+            chunks.append(chunk)
+    assert chunks == ["partial "]
+    assert type(error.value).__name__ == "ResourceExhausted"
+
+
+def test_repeated_prompts_are_replayed_in_order_and_the_last_repeats(path, clock):
+    record(path, clock, [(0.1, ResourceExhausted("quota")), (0.1, "first"), (0.1, "second")],
+           [lambda llm: llm.invoke("prompt")] * 3)
+
+    llm = replayer(path)
+    with pytest.raises(Exception):
+        llm.invoke("prompt")
+    assert [llm.invoke("prompt") for _ in range(3)] == ["first", "second", "second"]
+
+
+def test_missing_prompt_raises_cassette_miss(path, clock):
+    record(path, clock, [(0.1, "recorded")], [lambda llm: llm.invoke("prompt")])
+
+    llm = replayer(path)
+    with pytest.raises(CassetteMissError):
+        llm.invoke("another prompt")
+    assert llm.cassette.stats()["misses"] == 1
+
+
+def test_rerecording_replaces_the_previous_cassette(path, clock):
+    record(path, clock, [(0.1, "old"), (0.1, "old other")],
+           [lambda llm: llm.invoke("prompt"), lambda llm: llm.invoke("other prompt")])
+    record(path, clock, [(0.1, "new")], [lambda llm: llm.invoke("prompt")])
+
+    llm = replayer(path)
+    assert llm.invoke("prompt") == "new"
+    with pytest.raises(CassetteMissError):
+        llm.invoke("other prompt")
+    assert llm.cassette.stats()["prompts"] == 1
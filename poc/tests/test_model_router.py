@@ -0,0 +1,114 @@
+import asyncio
+import json
+
+import pytest
+
+from model_router import RoutedLLM, routing_stats, validate_code_file
+
+
+class ResourceExhausted(Exception):
+    pass
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class InvalidArgument(Exception):
+    pass
+
+
+class FakeLLM:
+    """決まった応答を返すか、例外を送出するLLM"""
+
+    def __init__(self, response=None, error=None):
+        self.response = response
+        self.error = error
+        self.calls = 0
+
+    def invoke(self, prompt):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error("simulated")
+        return self.response
+
+    async def ainvoke(self, prompt):
+        return self.invoke(prompt)
+
+
+def code_file(lines):
+    return json.dumps({"file_name": "app.py", "source_code": "\n".join(["pass"] * lines)})
+
+
+GOOD = code_file(5)
+# 数行に満たないコードは確信度0.5
+SHORT = code_file(2)
+
+
+def route(name, fast, pro):
+    return RoutedLLM(name, [("flash", fast), ("pro", pro)], validator=validate_code_file, min_confidence=0.8)
+
+
+def test_valid_fast_response_is_served_by_the_fast_model():
+    fast, pro = FakeLLM(GOOD), FakeLLM(GOOD)
+
+    assert route("test-route-valid", fast, pro).invoke("prompt") == GOOD
+
+    assert (fast.calls, pro.calls) == (1, 0)
+    stats = routing_stats()["test-route-valid"]
+    assert stats["served_by"] == {"flash": 1}
+    assert stats["escalations"] == {}
+
+
+@pytest.mark.parametrize("response, reason", [("not json", "invalid"), (SHORT, "low_confidence")])
+def test_rejected_fast_response_escalates(response, reason):
+    fast, pro = FakeLLM(response), FakeLLM(GOOD)
+    name = f"test-route-{reason}"
+
+    assert route(name, fast, pro).invoke("prompt") == GOOD
+
+    assert (fast.calls, pro.calls) == (1, 1)
+    stats = routing_stats()[name]
+    assert stats["served_by"] == {"pro": 1}
+    assert stats["escalations"] == {reason: 1}
+
+
+def test_non_transient_error_escalates():
+    fast, pro = FakeLLM(error=InvalidArgument), FakeLLM(GOOD)
+
+    assert route("test-route-error", fast, pro).invoke("prompt") == GOOD
+
+    assert pro.calls == 1
+    assert routing_stats()["test-route-error"]["escalations"] == {"error": 1}
+
+
+@pytest.mark.parametrize("error", [ResourceExhausted, DeadlineExceeded])
+def test_transient_error_is_left_to_the_retry_layer(error):
+    fast, pro = FakeLLM(error=error), FakeLLM(GOOD)
+    name = f"test-route-{error.__name__}"
+
+    with pytest.raises(error):
+        route(name, fast, pro).invoke("prompt")
+    with pytest.raises(error):
+        asyncio.run(route(name, fast, pro).ainvoke("prompt"))
+
+    assert pro.calls == 0
+    stats = routing_stats()[name]
+    assert (stats["failed"], stats["escalations"]) == (2, {})
+
+
+def test_last_tier_response_is_returned_without_validation():
+    fast, pro = FakeLLM("not json"), FakeLLM("still not json")
+
+    assert route("test-route-last", fast, pro).invoke("prompt") == "still not json"
+    assert routing_stats()["test-route-last"]["served_by"] == {"pro": 1}
+
+
+def test_last_tier_error_is_raised():
+    fast, pro = FakeLLM(error=InvalidArgument), FakeLLM(error=InvalidArgument)
+
+    with pytest.raises(InvalidArgument):
+        route("test-route-last-error", fast, pro).invoke("prompt")
+
+    stats = routing_stats()["test-route-last-error"]
+    assert (stats["failed"], stats["escalations"]) == (1, {"error": 1})
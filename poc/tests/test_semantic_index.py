@@ -0,0 +1,45 @@
+import json
+
+import pytest
+
+from semantic_index import SemanticIndex
+
+
+def write_saved_design(root, name, requirement):
+    directory = root / name
+    directory.mkdir()
+    overview = {"business_requirement": requirement, "project_overview": {"name": name}}
+    (directory / "00_project_overview.json").write_text(json.dumps(overview, ensure_ascii=False), encoding="utf-8")
+
+
+@pytest.fixture
+def designs_root(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("SEMANTIC_INDEX_ENABLED", "true")
+    write_saved_design(tmp_path, "20250914_Indexed", "在庫管理システムを作りたい")
+    write_saved_design(tmp_path, "20250914_Legacy", "勤怠管理アプリを作りたい")
+    # finalize_design が記録する形式（カレントディレクトリからの相対パス、"./" なし）
+    entry = {"requirement": "在庫管理システムを作りたい", "design": {"project_overview": {}, "required_agents": []},
+             "complete": True, "model": "MockLLM", "output_dir": "20250914_Indexed"}
+    (tmp_path / "index.jsonl").write_text(json.dumps(entry, ensure_ascii=False) + "\n", encoding="utf-8")
+    return tmp_path
+
+
+@pytest.mark.parametrize("root", [".", "absolute"])
+def test_load_does_not_duplicate_indexed_designs(designs_root, root):
+    index = SemanticIndex(index_path="index.jsonl")
+    index.load(str(designs_root) if root == "absolute" else root)
+
+    assert index.stats()["entries"] == 2
+    entries = sorted(index._entries, key=lambda entry: entry["output_dir"])
+    assert [(entry["output_dir"], entry["complete"]) for entry in entries] == [
+        ("20250914_Indexed", True), ("20250914_Legacy", False)]
+
+
+def test_add_normalizes_output_dir(designs_root):
+    index = SemanticIndex(index_path="index.jsonl")
+    index.add("勤怠管理アプリを作りたい", {"project_overview": {}, "required_agents": []}, "MockLLM", "./20250914_Legacy")
+
+    reloaded = SemanticIndex(index_path="index.jsonl")
+    reloaded.load(".")
+    assert reloaded.stats()["entries"] == 2
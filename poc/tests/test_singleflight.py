@@ -0,0 +1,83 @@
+import threading
+import time
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def run_concurrently(flight, key, fn, followers):
+    """先頭の呼び出しが fn を実行中の間に followers 件の同じキーの呼び出しを重ね、(結果, 例外) を呼び出し順に返す"""
+    release = threading.Event()
+    outcomes = [None] * (followers + 1)
+
+    def blocked():
+        release.wait(5)
+        return fn()
+
+    def worker(index):
+        try:
+            outcomes[index] = (flight.do(key, blocked), None)
+        except Exception as e:
+            outcomes[index] = (None, e)
+
+    threads = [threading.Thread(target=worker, args=(0,))]
+    threads[0].start()
+    wait_until(lambda: flight.stats()["in_flight"] == 1)
+    threads += [threading.Thread(target=worker, args=(i,)) for i in range(1, followers + 1)]
+    for thread in threads[1:]:
+        thread.start()
+    wait_until(lambda: flight.stats()["deduplicated"] == followers)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    return outcomes
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    calls = []
+
+    outcomes = run_concurrently(flight, "key", lambda: calls.append(1) or {"design": "shared"}, followers=4)
+
+    assert len(calls) == 1
+    assert outcomes[0] == (({"design": "shared"}, False), None)
+    assert all(outcome == (({"design": "shared"}, True), None) for outcome in outcomes[1:])
+    assert flight.stats() == {"executed": 1, "deduplicated": 4, "in_flight": 0}
+
+
+def test_error_is_raised_to_every_waiter():
+    flight = SingleFlight()
+    error = RuntimeError("LLM failed")
+
+    def fail():
+        raise error
+
+    outcomes = run_concurrently(flight, "key", fail, followers=3)
+
+    assert all(outcome == (None, error) for outcome in outcomes)
+    # 失敗した呼び出しは残らず、次の呼び出しは改めて実行される
+    assert flight.do("key", lambda: "retried") == ("retried", False)
+
+
+def test_different_keys_run_independently():
+    flight = SingleFlight()
+
+    assert flight.do("a", lambda: 1) == (1, False)
+    assert flight.do("b", lambda: 2) == (2, False)
+    assert flight.do("a", lambda: 3) == (3, False)
+    assert flight.stats()["executed"] == 3
+
+
+def test_leader_error_is_raised_to_the_leader():
+    flight = SingleFlight()
+    with pytest.raises(ValueError):
+        flight.do("key", lambda: int("not a number"))
+    assert flight.stats()["in_flight"] == 0